@@ -0,0 +1,76 @@
+"""Interned attribute sets and what the agents render from them.
+
+Feeds reuse a small number of attribute sets across many prefixes, so the payload fragment an
+agent derives from an attribute set (ExaBGP text, YaBGP JSON or UPDATE wire bytes) is rendered
+once and kept in a LRU cache keyed on the canonical form of the set.
+"""
+import sys
+from collections import OrderedDict
+
+
+def attr_key(attr):
+    """A hashable key identifying an attribute set. Attributes decoded from a MRT file are
+    identified by their wire encoding and nexthop, without looking at the decoded values."""
+    raw = getattr(attr, 'raw', None)
+    if raw is not None:
+        return (raw, attr.as4, attr.get('nexthop'))
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in attr.items()))
+
+
+def _size(key, value):
+    return sys.getsizeof(key) + sum(sys.getsizeof(k) for k in key) + sys.getsizeof(value)
+
+
+class AttrCache(object):
+    """A LRU cache of render(attr, *args), keyed on attr_key(attr) and args. The memory held
+    is estimated from the size of the keys and values."""
+    def __init__(self, render, maxsize=4096, name='attributes'):
+        self.render = render
+        self.maxsize = maxsize
+        self.name = name
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+    def get(self, attr, *args):
+        if self.maxsize <= 0:
+            self.misses += 1
+            return self.render(attr, *args)
+        key = (attr_key(attr),) + args
+        entries = self.entries
+        value = entries.get(key)
+        if value is not None:
+            self.hits += 1
+            entries.move_to_end(key)
+            return value
+        self.misses += 1
+        value = entries[key] = self.render(attr, *args)
+        self.nbytes += _size(key[0], value)
+        if len(entries) > self.maxsize:
+            old_key, old_value = entries.popitem(last=False)
+            self.nbytes -= _size(old_key[0], old_value)
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return '%s cache: %d hits, %d misses (%.1f%% hit rate), %d evictions, %d entries, ~%d KiB' % (
+            self.name, stats['hits'], stats['misses'], stats['hit_rate'] * 100, stats['evictions'],
+            stats['entries'], stats['bytes'] // 1024)
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+"""Benchmarks of bgp-gen: decoding, generating, encoding and sending updates, each in
+isolation, and the generator end to end. Synthetic MRT files are generated in-tree from a seed,
+so runs are repeatable, and every stage runs in a child process of its own to report its peak
+memory. Results can be saved as JSON and compared with an earlier run.
+"""
+import os, sys, time
+import json
+import random
+import struct
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+import collections
+import multiprocessing
+
+import dpkt
+
+from pybgpdump import BGPDump, FastBGPDump
+
+
+def _pack_prefix(prefix, plen):
+    return struct.pack('>B', plen) + prefix[:(plen + 7) // 8]
+
+
+def _bgp_update(withdrawn, attrs, nlri):
+    withdrawn = b''.join(_pack_prefix(p, l) for p, l in withdrawn)
+    nlri = b''.join(_pack_prefix(p, l) for p, l in nlri)
+    body = struct.pack('>H', len(withdrawn)) + withdrawn + struct.pack('>H', len(attrs)) + attrs + nlri
+    return b'\xff' * 16 + struct.pack('>HB', 19 + len(body), dpkt.bgp.UPDATE) + body
+
+
+def _bgp_keepalive():
+    return b'\xff' * 16 + struct.pack('>HB', 19, dpkt.bgp.KEEPALIVE)
+
+
+def _mp_attribute(at_type, value):
+    return struct.pack('>BBH', 0x90, at_type, len(value)) + value
+
+
+def _prefixes6(rand, count):
+    return [(struct.pack('>QQ', (0x2000 << 48) | (rand.getrandbits(29) << 16), 0), 48)
+            for _ in range(count)]
+
+
+def _attributes(rand, peer_as):
+    as_path = [peer_as] + [rand.randint(1, 64999) for _ in range(rand.randint(1, 6))]
+    attrs = struct.pack('>BBBB', 0x40, dpkt.bgp.ORIGIN, 1, rand.randint(0, 2))
+    seg = struct.pack('>BB', 2, len(as_path)) + b''.join(struct.pack('>H', asn) for asn in as_path)
+    attrs += struct.pack('>BBB', 0x40, dpkt.bgp.AS_PATH, len(seg)) + seg
+    attrs += struct.pack('>BBB4s', 0x40, dpkt.bgp.NEXT_HOP, 4, struct.pack('>I', rand.getrandbits(32)))
+    attrs += struct.pack('>BBBI', 0x80, dpkt.bgp.MULTI_EXIT_DISC, 4, rand.randint(0, 100))
+    return attrs
+
+
+def write_synthetic_mrt(filename, count, seed=1, max_prefix=4, noise=0.1, ipv6=0.0):
+    """Write a BGP4MP MRT file with count UPDATE records (plus some KEEPALIVE noise). A share
+    `ipv6` of the updates carry IPv6 prefixes in MP_REACH_NLRI/MP_UNREACH_NLRI, over an IPv6
+    session. Returns the number of UPDATE records written."""
+    rand = random.Random(seed)
+    ts = 1500000000
+    with open(filename, 'wb') as f:
+        for _ in range(count):
+            session = struct.pack('>HHHH4s4s', 65001, 65000, 0, dpkt.mrt.AFI_IPv4,
+                                  b'\x0a\x00\x00\x01', b'\x0a\x00\x00\x02')
+            if rand.random() < noise:
+                msg = _bgp_keepalive()
+            elif ipv6 and rand.random() < ipv6:
+                withdrawn = b''.join(_pack_prefix(p, l) for p, l in _prefixes6(rand, rand.randint(0, 1)))
+                nlri = b''.join(_pack_prefix(p, l) for p, l in _prefixes6(rand, rand.randint(1, max_prefix)))
+                attrs = _attributes(rand, 65001)
+                if withdrawn:
+                    attrs += _mp_attribute(dpkt.bgp.MP_UNREACH_NLRI, struct.pack('>HB', 2, 1) + withdrawn)
+                nexthop = b'\x20\x01\x0d\xb8' + b'\x00' * 11 + b'\x01'
+                attrs += _mp_attribute(dpkt.bgp.MP_REACH_NLRI, struct.pack('>HBB', 2, 1, 16) + nexthop + b'\x00' + nlri)
+                msg = _bgp_update([], attrs, [])
+                session = struct.pack('>HHHH16s16s', 65001, 65000, 0, dpkt.mrt.AFI_IPv6,
+                                      nexthop, nexthop[:15] + b'\x02')
+            else:
+                withdrawn = [(struct.pack('>I', rand.getrandbits(24) << 8), 24)
+                             for _ in range(rand.randint(0, 1))]
+                nlri = [(struct.pack('>I', rand.getrandbits(24) << 8), 24)
+                        for _ in range(rand.randint(1, max_prefix))]
+                msg = _bgp_update(withdrawn, _attributes(rand, 65001), nlri)
+            ts += rand.randint(0, 1)
+            body = session + msg
+            f.write(struct.pack('>IHHI', ts, dpkt.mrt.BGP4MP, dpkt.mrt.BGP4MP_MESSAGE, len(body)))
+            f.write(body)
+    updates = 0
+    for _ in FastBGPDump(filename).records():
+        updates += 1
+    return updates
+
+
+def fixture(directory, records, seed=1, ipv6=0.0):
+    """Return (filename, number of updates) of the synthetic MRT file for these parameters,
+    writing it in directory unless a previous run already did. The same parameters always
+    give the same file."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename = os.path.join(directory, 'synthetic-%d-%d-%g.mrt' % (records, seed, ipv6))
+    if not os.path.exists(filename):
+        tmp = filename + '.tmp'
+        write_synthetic_mrt(tmp, records, seed=seed, ipv6=ipv6)
+        os.rename(tmp, filename)
+    return filename, sum(1 for _ in FastBGPDump(filename).records())
+
+
+def _decoded(filename):
+    """The updates of filename as the generator hands them to an agent."""
+    updates = []
+    for _, attr, nlri, withdraw in FastBGPDump(filename):
+        attr['nexthop'] = '10.0.0.1'
+        updates.append({'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
+    return updates
+
+
+class NullSink(object):
+    """A file object discarding what is written, for agents printing their updates."""
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def bench_decode(filename, reader):
+    """Decode every update in filename."""
+    dump = reader(filename)
+    start = time.time()
+    n = 0
+    for _ in dump:
+        n += 1
+    return {'count': n, 'seconds': time.time() - start}
+
+
+def bench_scan(filename):
+    """Walk the file with FastBGPDump without decoding updates."""
+    start = time.time()
+    n = 0
+    for _ in FastBGPDump(filename).records():
+        n += 1
+    return {'count': n, 'seconds': time.time() - start}
+
+
+def bench_trace(filename, compression='none'):
+    """Record the updates of filename to a trace file, then time reading it back."""
+    from updatetrace import TraceReader, record
+    fd, trace = tempfile.mkstemp(suffix='.trace')
+    os.close(fd)
+    try:
+        record(((ts, {'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
+                for ts, attr, nlri, withdraw in FastBGPDump(filename)), trace, compression)
+        start = time.time()
+        n = sum(1 for _ in TraceReader(trace))
+        return {'count': n, 'seconds': time.time() - start, 'bytes': os.path.getsize(trace)}
+    finally:
+        os.remove(trace)
+
+
+def bench_generate(count, generator='numpy', update_type='announce', max_prefix=4, family='ipv4'):
+    """Generate count random updates with the per-update loop or with NumPy."""
+    config = {'agent': 'console', 'pack': False, 'local_as': 65000, 'nexthop': ['10.0.0.1', '10.0.0.2'],
+              'update_type': update_type, 'max_prefix': max_prefix, 'seed': 1, 'family': family,
+              'table_size': 0}
+    if generator == 'numpy':
+        from randgen import RandomUpdates
+        updates = iter(RandomUpdates(65000, config['nexthop'], update_type, max_prefix, seed=1, family=family))
+    else:
+        from bgpplayer import BgpUpdateGenerator
+        updates = BgpUpdateGenerator(config)._random_updates_loop()
+    start = time.time()
+    for _, _ in zip(range(count), updates):
+        pass
+    return {'count': count, 'seconds': time.time() - start}
+
+
+def bench_encode(filename, agent):
+    """Turn every update of filename into what agent sends: ExaBGP statements, YaBGP JSON or
+    UPDATE messages."""
+    updates = _decoded(filename)
+    if agent == 'exabgp':
+        from bgpplayer import ExaBGPAgent
+        encode = ExaBGPAgent()._payload
+    elif agent == 'yabgp':
+        from bgpplayer import YaBGPAgent
+        yabgp = YaBGPAgent()
+
+        def encode(update):
+            attr = yabgp.attr_cache.get(update['attr'])
+            return yabgp._build_yabgp_msg(dict(update, attr=attr))
+    else:
+        from bgpspeaker import UpdateEncoder
+        encoder = UpdateEncoder(as4=True)
+
+        def encode(update):
+            return b''.join(bytes(msg) for msg in encoder.messages(update['attr'], update['nlri'], update['withdraw']))
+    start = time.time()
+    for update in updates:
+        encode(update)
+    return {'count': len(updates), 'seconds': time.time() - start}
+
+
+def bench_native(filename, updates):
+    """Replay filename through the native agent to a stand-in peer."""
+    from bgpplayer import NativeAgent
+    from bgpspeaker import StandInPeer
+    peer = StandInPeer('127.0.0.1', 0, 65000)
+    peer.start()
+    agent = NativeAgent()
+    agent.start([('127.0.0.1', peer.address[1], 65000)], '127.0.0.1', 65001)
+    agent.connected(timeout=10)
+    start = time.time()
+    for _, attr, nlri, withdraw in FastBGPDump(filename):
+        attr['nexthop'] = '10.0.0.1'
+        agent.send_update({'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
+    sent = time.time()
+    # every update fits in one message here
+    while peer.updates < updates and time.time() - sent < 10:
+        time.sleep(0.01)
+    elapsed = time.time() - start
+    with contextlib.redirect_stdout(NullSink()):
+        agent.stop()
+    peer.stop()
+    return {'count': updates, 'seconds': elapsed, 'messages': peer.updates}
+
+
+def bench_yabgp(filename, updates, max_inflight=4, delay=0.0):
+    """Replay filename through the YaBGP agent to a stub of the YaBGP API."""
+    from bgpplayer import YaBGPAgent
+    from yabgpapi import StubYaBGP
+    stub = StubYaBGP('127.0.0.1', 0, delay=delay)
+    stub.start()
+    agent = YaBGPAgent()
+    agent.rest_addrs = ['127.0.0.1:%d' % stub.address[1]]
+    agent.max_inflight = max_inflight
+    agent.start([('127.0.0.1', 179, 65000)], '127.0.0.1', 65001)
+    agent.connected()
+    start = time.time()
+    for _, attr, nlri, withdraw in FastBGPDump(filename):
+        attr['nexthop'] = '10.0.0.1'
+        agent.send_update({'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
+    agent.fanout.close()
+    for client in agent.clients:
+        client.close()
+    elapsed = time.time() - start
+    stats = agent.clients[0].stats()
+    stub.stop()
+    return {'count': updates, 'seconds': elapsed, 'requests': stub.requests,
+            'request_p99': stats['p99'], 'errors': stats['errors']}
+
+
+def bench_end_to_end(filename=None, count=0, agent='console'):
+    """Run the generator with agent, its output going to a null sink, replaying filename as
+    fast as possible or else generating count random updates."""
+    from bgpplayer import BgpUpdateGenerator, DEFAULTS
+    config = dict(DEFAULTS, agent=agent, mrt=filename, count=count, seed=1)
+    generator = BgpUpdateGenerator(config)
+    if filename:
+        updates = generator._updates_from_source('mrt_file', filename=filename)
+    else:
+        updates = generator._random_updates()
+    with contextlib.redirect_stdout(NullSink()):
+        start = time.time()
+        # a rate no run reaches: updates are sent back to back
+        generator._send(updates, 1e12)
+        elapsed = time.time() - start
+        generator.agent.stop()
+    return {'count': generator.sent_counter.value, 'seconds': elapsed}
+
+
+def _first_update(command, marker=b"{'attr'"):
+    """Seconds from starting command to the first line of its output starting with marker."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    elapsed = None
+    for line in proc.stdout:
+        if elapsed is None and line.startswith(marker):
+            elapsed = time.perf_counter() - start
+    proc.wait()
+    return elapsed
+
+
+def bench_startup(runs=5, agent='console'):
+    """Start the generator runs times with agent to send one random update, and time the
+    first update from the start of the process. The interpreter alone, and with NumPy imported
+    (random updates need it), are timed the same way: `own` is the time to the first update
+    without the NumPy import, what the startup budget is checked against."""
+    player = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bgpplayer.py')
+    command = [sys.executable, player, '--agent', agent, '--count', '1', '--rate', '1000000', '--seed', '1']
+    times = sorted(_first_update(command) for _ in range(runs))
+    if None in times:
+        raise RuntimeError('no update printed by %s' % ' '.join(command))
+    interpreter = sorted(_first_update([sys.executable, '-c', 'print("{\'attr\'")']) for _ in range(runs))
+    numpy = sorted(_first_update([sys.executable, '-c', 'import numpy; print("{\'attr\'")']) for _ in range(runs))
+    numpy_import = max(0.0, numpy[runs // 2] - interpreter[runs // 2])
+    return {'count': runs, 'seconds': sum(times), 'first_update': times[runs // 2],
+            'interpreter': interpreter[runs // 2], 'numpy_import': numpy_import,
+            'own': times[runs // 2] - numpy_import}
+
+
+def _peak_rss():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _child(conn, bench, args):
+    try:
+        result = bench(*args)
+        result['peak_rss'] = _peak_rss()
+        conn.send(result)
+    except Exception as e:
+        conn.send({'error': '%s: %s' % (type(e).__name__, e)})
+    conn.close()
+
+
+def run(bench, *args):
+    """Run bench(*args) in a child process of its own, so its peak memory is its own, and
+    return its result with the rate and time per item."""
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        result = bench(*args)
+        result['peak_rss'] = _peak_rss()
+    else:
+        parent, child = context.Pipe(duplex=False)
+        process = context.Process(target=_child, args=(child, bench, args))
+        process.start()
+        child.close()
+        result = parent.recv()
+        process.join()
+    if 'error' not in result:
+        seconds = result['seconds']
+        result['rate'] = result['count'] / seconds if seconds else float('inf')
+        result['ns_per_item'] = seconds * 1e9 / result['count'] if result['count'] else 0.0
+    return result
+
+
+def stages(filename, updates, args):
+    """Return the (name, bench, args) of every stage, in order."""
+    ipv4_only = not args.ipv6
+    stages = []
+    if ipv4_only:
+        stages.append(('decode.dpkt', bench_decode, (filename, BGPDump)))
+    stages += [
+        ('decode.fast', bench_decode, (filename, FastBGPDump)),
+        ('decode.lazy_scan', bench_scan, (filename,)),
+        ('decode.trace', bench_trace, (filename,)),
+        ('generate.loop', bench_generate, (args.updates, 'loop')),
+    ]
+    try:
+        import numpy
+        stages.append(('generate.numpy', bench_generate, (args.updates, 'numpy')))
+    except ImportError:
+        pass
+    stages += [
+        ('encode.exabgp', bench_encode, (filename, 'exabgp')),
+        ('encode.yabgp', bench_encode, (filename, 'yabgp')),
+        ('encode.native', bench_encode, (filename, 'native')),
+        ('send.native', bench_native, (filename, updates)),
+        ('send.yabgp_stub', bench_yabgp, (filename, updates)),
+        ('end_to_end.mrt_console', bench_end_to_end, (filename, 0, 'console')),
+        ('end_to_end.random_console', bench_end_to_end, (None, args.updates, 'console')),
+        ('startup.console', bench_startup, ()),
+    ]
+    return stages
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the change of rate of every stage against a baseline run, return the names of the
+    stages slower by more than threshold."""
+    slower = []
+    print('\nagainst %s (%s):' % (baseline['meta'].get('commit'), baseline['meta'].get('time')))
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if not old or 'rate' not in old or 'rate' not in result:
+            continue
+        change = result['rate'] / old['rate'] - 1 if old['rate'] else 0.0
+        mark = ''
+        if change < -threshold:
+            mark = '  <-- slower'
+            slower.append(name)
+        print('%-28s %+7.1f%% rate, %+7.1f%% peak memory%s' % (
+            name, change * 100, (float(result['peak_rss']) / old['peak_rss'] - 1) * 100, mark))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=100000, help='number of MRT records to generate')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic MRT file')
+    parser.add_argument('--mrt', help='benchmark an existing uncompressed MRT file instead')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'bgp-gen-fixtures'),
+                        help='directory the synthetic MRT files are kept in')
+    parser.add_argument('--updates', type=int, default=100000, help='number of random updates to generate')
+    parser.add_argument('--ipv6', type=float, default=0.0, help='share of generated updates carrying IPv6 prefixes')
+    parser.add_argument('--stages', help='comma separated prefixes of the stages to run, e.g. decode,encode.native')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each stage, the fastest is kept')
+    parser.add_argument('--json', help='file to save the results to')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown against --compare reported as a regression. Default=0.1')
+    parser.add_argument('--startup_budget', type=float,
+                        help='seconds to the first update of the startup stage, not counting the import of '
+                        'NumPy, exit with 1 beyond it, ex: 0.15')
+    args = parser.parse_args()
+
+    if args.mrt:
+        filename = args.mrt
+        updates = sum(1 for _ in FastBGPDump(filename).records())
+    else:
+        filename, updates = fixture(args.fixtures, args.records, args.seed, args.ipv6)
+    print('%d updates in %s' % (updates, filename))
+    selected = args.stages.split(',') if args.stages else None
+    results = collections.OrderedDict()
+    for name, bench, bench_args in stages(filename, updates, args):
+        if selected and not any(name.startswith(prefix) for prefix in selected):
+            continue
+        runs = [run(bench, *bench_args) for _ in range(max(1, args.repeat))]
+        result = max(runs, key=lambda r: r.get('rate', 0))
+        results[name] = result
+        if 'error' in result:
+            print('%-28s failed: %s' % (name, result['error']))
+        else:
+            print('%-28s %12.0f /sec %10.0f ns each %8.1f MiB peak' % (
+                name, result['rate'], result['ns_per_item'], result['peak_rss'] / 1048576.0))
+            if 'first_update' in result:
+                print('%-28s first update after %.0f ms, interpreter alone %.0f ms, NumPy import %.0f ms' % (
+                    '', result['first_update'] * 1000, result['interpreter'] * 1000,
+                    result['numpy_import'] * 1000))
+
+    output = {
+        'meta': {
+            'commit': _git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'mrt': args.mrt,
+            'records': args.records,
+            'updates': updates,
+            'seed': args.seed,
+            'ipv6': args.ipv6,
+            'random_updates': args.updates,
+        },
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    over_budget = False
+    startup = results.get('startup.console')
+    if args.startup_budget and startup and 'own' in startup:
+        over_budget = startup['own'] > args.startup_budget
+        print('\nfirst update after %.0f ms without the NumPy import, budget %.0f ms%s' % (
+            startup['own'] * 1000, args.startup_budget * 1000, '  <-- over' if over_budget else ''))
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        if slower:
+            sys.exit(1)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
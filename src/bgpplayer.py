@@ -1,14 +1,7 @@
 #!/usr/bin/env python
-import sys, os, subprocess, re, tempfile
+import sys, os, re
 import random
 import time
-import json
-import traceback
-import ipaddress
-import socket
-import requests
-from requests.auth import HTTPBasicAuth
-from oslo_config import cfg
 
 
 class ConsoleAgent(object):
@@ -23,23 +16,38 @@ class ConsoleAgent(object):
         return True
 
     def send_update(self, update):
+        update = dict(update)
+        update['nlri'] = [str(prefix) for prefix in update.get('nlri', [])]
+        update['withdraw'] = [str(prefix) for prefix in update.get('withdraw', [])]
         print(update)
 
 
 class ExaBGPAgent(object):
-    """This tells us to use ExaBGP as BGP library to connect to BGP routers and send out updates."""
+    """This tells us to use ExaBGP as BGP library to connect to BGP routers and send out updates.
+
+    Statements are written straight to ExaBGP's API pipe by a worker which batches whatever
+    is queued into one write and holds back while more than `max_inflight` statements are
+    waiting for ExaBGP's done/error answer."""
     exabgp = None
     config_file = None
-    socket = None
+    pipe = None
+    fanout = None
+    max_inflight = 10000
+
+    def __init__(self):
+        from attrcache import AttrCache
+        self.attr_cache = AttrCache(self._render_attributes, name='exabgp')
+
+    def caches(self):
+        return [self.attr_cache]
 
     def start(self, peers, local_ip, local_as):
         """Start ExaBGP in subprocess."""
-        CONFIG = """
-process announce {
-    run nc -l -U %s;
-    encoder json;
-}
-        """
+        import subprocess, tempfile
+        from exabgpapi import ExaBGPPipe, make_pipes, PIPENAME
+        from fanout import FanOut
+        if self.fanout is None:
+            self.fanout = FanOut()
         PEER_CONFIG = """
 neighbor %s {
     passive;
@@ -48,220 +56,680 @@ neighbor %s {
     local-address %s;
     local-as %s;
     router-id 192.168.192.192;
-    api {
-        processes [announce];
+    family {
+        ipv4 unicast;
+        ipv6 unicast;
     }
 }
         """
         _, config_file = tempfile.mkstemp()
-        _, sock_path = tempfile.mkstemp()
         _, logfile = tempfile.mkstemp()
+        self.pipe_dir = tempfile.mkdtemp()
+        in_path, out_path = make_pipes(self.pipe_dir)
         print('exabgp log is located at: %s' % logfile)
         self.config_file = config_file
         self.logfile = logfile
+        self.peers = [peer[0] for peer in peers]
         with open(config_file, 'w') as f:
-            config = CONFIG % sock_path
-            f.write('%s\n' % config)
             for peer in peers:
                 peer_ip, peer_port, peer_as = peer
-            peer_config = PEER_CONFIG % (peer_ip, peer_port, peer_as, local_ip, local_as)
-            f.write('%s\n' % peer_config)
+                peer_config = PEER_CONFIG % (peer_ip, peer_port, peer_as, local_ip, local_as)
+                f.write('%s\n' % peer_config)
         self.exabgp = subprocess.Popen(
                 ['env',
                  'exabgp.daemon.daemonize=false',
                  'exabgp.log.level=DEBUG',
                  'exabgp.log.all=true',
                  'exabgp.log.destination=%s' % self.logfile,
+                 'exabgp.api.ack=true',
+                 'exabgp.api.pipename=%s' % PIPENAME,
+                 'exabgp_cli_pipe=%s' % self.pipe_dir,
                  'exabgp', '%s' % config_file],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        for _ in range(10):
-            try:
-                self.socket.connect(sock_path)
-                break
-            except:
-                time.sleep(1)
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        self.pipe = ExaBGPPipe(in_path, out_path, self.max_inflight)
+        if not self.pipe.open():
+            print('exabgp did not open its API pipe %s' % in_path)
+            self.pipe = None
+            return
+        self.channel = self.fanout.add('exabgp', self.pipe.send)
 
     def stop(self):
         """stop Exabgp running in the subprocess."""
+        import shutil
         print('stopping...')
-        if self.socket:
-            self.socket.close()
+        if self.attr_cache.hits or self.attr_cache.misses:
+            print(self.attr_cache.summary())
+        if self.fanout:
+            self.fanout.close()
+        if self.pipe:
+            self.pipe.drain()
+            print(self.pipe.summary())
+            self.pipe.close()
+            self.pipe = None
         if self.exabgp:
             self.exabgp.kill()
+            self.exabgp = None
         if self.config_file:
             os.remove(self.config_file)
+            shutil.rmtree(self.pipe_dir, ignore_errors=True)
+            self.config_file = None
 
-    def connected(self):
-        """wait for connection to BGP peers."""
-        time.sleep(10)
-        return True
+    def connected(self, timeout=120, interval=0.1):
+        """wait for ExaBGP to report every session established, asking it through the API.
+        ExaBGP versions without `show neighbor summary` get a fixed 10 seconds."""
+        if not self.pipe:
+            return False
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            lines = self.pipe.query('show neighbor summary')
+            if lines is None:
+                time.sleep(10)
+                return True
+            established = set(line.split()[0] for line in lines
+                              if line.split() and 'established' in line.lower())
+            if all(peer in established for peer in self.peers):
+                return True
+            time.sleep(interval)
+        return False
 
-    def _to_exabgp_format(self, update):
+    def _render_attributes(self, attr, ipv6):
+        """The attributes part of an announcement, with an IPv6 (or IPv4-mapped) nexthop for
+        IPv6 prefixes."""
         exabgp_attr_name_conversion = {
                 'local_pref': 'local-preference', 'nexthop': 'next-hop', 'as_path': 'as-path',
                 'med': 'med', 'origin': 'origin',
                 }
+        from bgpprefix import is_ipv6
+        origins = {0: 'igp', 1: 'egp', 2: 'incomplete'}
+        text = ''
+        for at_name, at_value in attr.items():
+            if at_name == 'nexthop' and ipv6 and not is_ipv6(at_value):
+                at_value = '::ffff:%s' % at_value
+            elif at_name == 'as_path':
+                at_value = '[ %s ]' % ' '.join(str(asn) for asn in at_value)
+            elif at_name == 'origin':
+                at_value = origins.get(at_value, at_value)
+            if at_name in exabgp_attr_name_conversion:
+                text += ' %s %s' % (exabgp_attr_name_conversion[at_name], str(at_value))
+        return text
+
+    def metrics(self):
+        if not self.pipe:
+            return []
+        return [('exabgp_%s' % name, {}, value) for name, value in self.pipe.stats().items()]
+
+    def _to_exabgp_format(self, update):
+        from bgpprefix import Prefix6, split_families
         statements = []
         peers = update.get('peers', [])
         if peers:
             announce_template = 'neighbor {neighbor} announce attributes {attr} nlri {nlri}'
-            withdraw_template = 'neihgbor {neighbor} withdraw {withdraw}'
+            withdraw_template = 'neighbor {neighbor} withdraw route {withdraw}'
         else:
             announce_template = 'announce attributes {attr} nlri {nlri}'
             withdraw_template = 'withdraw route {withdraw}'
-        nlri = update.get('nlri', [])
-        if nlri:
-            attr = ''
-            for at_name, at_value in update['attr'].items():
-                if at_name in exabgp_attr_name_conversion:
-                    attr += ' %s %s' % (exabgp_attr_name_conversion[at_name], str(at_value))
-                else:
-                    print(at_name, at_value)
-            nlri = ' '.join(nlri)
+        # IPv4 and IPv6 prefixes are announced apart
+        for nlri in split_families(update.get('nlri', [])):
+            if not nlri:
+                continue
+            attr = self.attr_cache.get(update['attr'], nlri[0].afi == Prefix6.afi)
+            nlri = ' '.join(str(prefix) for prefix in nlri)
             for peer in peers:
                 statements.append(announce_template.format(neighbor=peer, attr=attr, nlri=nlri))
             if not peers:
                 statements.append(announce_template.format(attr=attr, nlri=nlri))
-        withdraw = update.get('withdraw', [])
-        if withdraw:
-            withdraw = ' '.join(withdraw)
+        # a withdraw route statement takes a single prefix
+        for withdraw in update.get('withdraw', []):
             for peer in peers:
                 statements.append(withdraw_template.format(neighbor=peer, withdraw=withdraw))
             if not peers:
                 statements.append(withdraw_template.format(withdraw=withdraw))
         return statements
 
+    def _payload(self, update):
+        statements = self._to_exabgp_format(update)
+        return '\n'.join(statements) + '\n' if statements else None
+
     def send_update(self, update):
-        """send the update to client process in ExaBGP."""
-        if self.socket:
-            for statement in self._to_exabgp_format(update):
-                self.socket.sendall(statement + '\r\n')
+        """queue the update for the pipe writer."""
+        payload = self._payload(update)
+        if self.pipe and payload:
+            self.fanout.publish(payload, [self.channel])
+
+    async def send_update_async(self, update):
+        payload = self._payload(update)
+        if self.pipe and payload:
+            await self.fanout.publish_async(payload, [self.channel])
 
 
 class YaBGPAgent(object):
-    """
-    """
-    yabgp = None
+    """Use YaBGP to send updates, one yabgpd per peer, or the APIs listed in `rest_addrs` when
+    yabgpd is already running. The attributes of each update are converted to YaBGP's JSON once;
+    the peer's worker merges the updates queued for it and posts them over a pool of keep-alive
+    connections."""
+    rest_port = 5555
+    rest_addrs = []
+    max_inflight = 4
+    fanout = None
+
+    def __init__(self):
+        from attrcache import AttrCache
+        self.attr_cache = AttrCache(self._render_attributes, name='yabgp')
+        self.clients = []
+
+    def caches(self):
+        return [self.attr_cache]
+
     def start(self, peers, local_ip, local_as):
-        peer_ip, peer_port, peer_as = peers[0]
-        self.yabgp = subprocess.Popen([
-            'yabgpd',
-            '--bgp-local_as ' + str(local_as),
-            '--bgp-remote_as ' + str(peer_as),
-            '--bgp-remote_addr ' + str(peer_ip),
-            '--bgp-remote_port ' + str(peer_port),
-            '--rest-bind_host 127.0.0.1',
-            '--rest-bind_port 5555'],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        print(self.yabgp.stdout.readline())
-        self.session = requests.Session()
-        self.peer = None
+        import subprocess
+        from fanout import FanOut
+        if self.fanout is None:
+            self.fanout = FanOut()
+        self.daemons = []
+        self.channels = []
+        for addr in self.rest_addrs:
+            self.daemons.append((None, 'http://%s' % addr))
+        if self.daemons:
+            return
+        for i, (peer_ip, peer_port, peer_as) in enumerate(peers):
+            rest_port = self.rest_port + i
+            yabgp = subprocess.Popen([
+                'yabgpd',
+                '--bgp-local_as', str(local_as),
+                '--bgp-remote_as', str(peer_as),
+                '--bgp-remote_addr', str(peer_ip),
+                '--bgp-remote_port', str(peer_port),
+                '--rest-bind_host', '127.0.0.1',
+                '--rest-bind_port', str(rest_port)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            print(yabgp.stdout.readline())
+            self.daemons.append((yabgp, 'http://127.0.0.1:%d' % rest_port))
 
     def stop(self):
-        if self.yabgp:
-            self.yabgp.kill()
+        if self.fanout:
+            self.fanout.close()
+            self.fanout.report()
+        for client in self.clients:
+            client.close()
+            print(client.summary())
+        if self.attr_cache.hits or self.attr_cache.misses:
+            print(self.attr_cache.summary())
+        for yabgp, _ in getattr(self, 'daemons', []):
+            if yabgp:
+                yabgp.kill()
 
-    def _get(self, path):
-        data = self.session.get('http://localhost/v1/' + path, auth=HTTPBasicAuth('admin', 'admin'))
+    def _get(self, base_url, path):
+        import requests
+        data = requests.get('%s/v1/%s' % (base_url, path), auth=('admin', 'admin'))
         return data.json()
 
-    def connected(self):
-        for _ in range(60):
-            data = self._get('peers')
-            for peer in data.get('peers', []):
-                if peer['fsm'] == 'ESTABLISHED':
-                    self.peer = peer
-                    return True
-        return
+    def _established(self, base_url):
+        for peer in self._get(base_url, 'peers').get('peers', []):
+            if peer['fsm'] == 'ESTABLISHED':
+                return peer
+        return None
+
+    def connected(self, timeout=60, interval=0.1):
+        """wait for every yabgpd to establish its session."""
+        import requests
+        from yabgpapi import YaBGPClient
+        deadline = time.time() + timeout
+        for yabgp, base_url in self.daemons:
+            while True:
+                try:
+                    peer = self._established(base_url)
+                except requests.RequestException:
+                    peer = None
+                if peer:
+                    break
+                if time.time() >= deadline:
+                    return False
+                time.sleep(interval)
+            url = '%s/v1/peer/%s/send/update' % (base_url, peer['remote_addr'])
+            client = YaBGPClient(url, self._build_yabgp_msg, self.max_inflight)
+            self.clients.append(client)
+            self.channels.append(self.fanout.add(peer['remote_addr'], client.send))
+        return True
+
+    def metrics(self):
+        from metrics import histogram_samples
+        samples = []
+        for client in self.clients:
+            labels = {'url': client.url}
+            samples.append(('yabgp_requests', labels, client.requests))
+            samples.append(('yabgp_errors', labels, client.errors))
+            samples.append(('yabgp_held', labels, client.held))
+            samples.extend(histogram_samples('yabgp_request_seconds', client.latency, labels))
+        return samples
 
-    def _build_yabgp_msgs(self, update):
+    def _render_attributes(self, attr):
+        """Return the JSON members of the attribute map when announcing IPv4 prefixes, the same
+        without NEXT_HOP (3) when announcing IPv6 prefixes only, and the start of the
+        MP_REACH_NLRI (14) member, up to its nlri list."""
+        import json
+        from bgpprefix import is_ipv6
         yabgp_attr_name_conversion = {
             'nexthop': 3, 'origin': 1, 'as_path': 2, 'local_pref': 5 }
-        yabgp_msg = {}
-        if not self.peer:
-            return {}
-        nlri = update.get('nlri')
-        if nlri:
-            attributes = {}
-            attr = update['attr']
-            for at_name, at_value in attr.items():
-                if at_name == 'as_path':
-                    at_value = [[1, at_value]]
-                if at_name in yabgp_attr_name_conversion:
-                    attributes[yabgp_attr_name_conversion[at_name]] = at_value
-            yabgp_msg['attr'] = attributes
-            yabgp_msg['nlri'] = nlri
-        withdraw = update.get('withdraw')
-        if 'withdraw' in data:
-            yabgp_msg['withdraw'] = withdraw
-        return {self.peer['remote_addr']: yabgp_msg}
-
-    def _send_yabgp(self, update):
-        yabgp_msg = self._build_yabgp_msgs(update)
-        for peer_ip, msg in yabgp_msg.items():
-            headers = {'content-type':'application/json'}
-            res = self.session.post(
-                    'http://localhost/v1/peer/%s/send/update' % peer_ip,
-                    data=json.dumps(msg), auth=HTTPBasicAuth('admin', 'admin'),
-                    headers=headers)
-            print(res)
+        attributes = {}
+        for at_name, at_value in attr.items():
+            if at_name == 'as_path':
+                at_value = [[1, at_value]]
+            if at_name in yabgp_attr_name_conversion:
+                attributes[yabgp_attr_name_conversion[at_name]] = at_value
+        members = json.dumps(attributes)[1:-1]
+        nexthop = attributes.pop(3, None)
+        if nexthop is not None and not is_ipv6(nexthop):
+            nexthop = '::ffff:%s' % nexthop
+        mp_reach = '"14": {"afi_safi": [2, 1], "nexthop": %s, "nlri": ' % json.dumps(nexthop)
+        return members, json.dumps(attributes)[1:-1], mp_reach
+
+    def _build_yabgp_msg(self, update):
+        """Return the JSON of an update whose attributes were rendered by _render_attributes.
+        IPv6 prefixes go in MP_REACH_NLRI (14) and MP_UNREACH_NLRI (15) attributes."""
+        import json
+        from bgpprefix import split_families
+        members = []
+        attributes = []
+        nlri, nlri6 = split_families(update.get('nlri') or [])
+        withdraw, withdraw6 = split_families(update.get('withdraw') or [])
+        if nlri or nlri6:
+            attr, attr6, mp_reach = update['attr']
+            attr = attr if nlri else attr6
+            if attr:
+                attributes.append(attr)
+            if nlri:
+                members.append('"nlri": %s' % json.dumps([str(prefix) for prefix in nlri]))
+            if nlri6:
+                attributes.append('%s%s}' % (mp_reach, json.dumps([str(prefix) for prefix in nlri6])))
+        if withdraw:
+            members.append('"withdraw": %s' % json.dumps([str(prefix) for prefix in withdraw]))
+        if withdraw6:
+            attributes.append('"15": {"afi_safi": [2, 1], "withdraw": %s}' % json.dumps(
+                [str(prefix) for prefix in withdraw6]))
+        if attributes:
+            members.append('"attr": {%s}' % ', '.join(attributes))
+        return '{%s}' % ', '.join(members)
 
     def send_update(self, update):
-        if self.peer:
-            self._send_yabgp(update)
+        if self.channels:
+            nlri = update.get('nlri') or []
+            self.fanout.publish({
+                'attr': self.attr_cache.get(update['attr']) if nlri else None,
+                'nlri': nlri,
+                'withdraw': update.get('withdraw') or [],
+                }, self.channels)
+
+
+class NativeAgent(object):
+    """Speak BGP to the peers directly. Each update is encoded on the wire once (per 2 or 4
+    byte AS encoding) and fanned out to every session."""
+    sessions = []
+    fanout = None
+
+    def __init__(self):
+        from bgpspeaker import UpdateEncoder
+        self.encoders = {True: UpdateEncoder(as4=True), False: UpdateEncoder(as4=False)}
+
+    def caches(self):
+        return [encoder.attr_cache for encoder in self.encoders.values()]
+
+    def start(self, peers, local_ip, local_as):
+        from bgpspeaker import BGPSession
+        from fanout import FanOut
+        if self.fanout is None:
+            self.fanout = FanOut()
+        self.sessions = []
+        self.channels = {}
+        for peer_ip, peer_port, peer_as in peers:
+            session = BGPSession(peer_ip, peer_port, peer_as, local_ip, local_as)
+            session.start()
+            self.sessions.append(session)
+            self.channels[session] = self.fanout.add('%s:%d' % session.peer, session.send_many)
+
+    def stop(self):
+        if self.fanout:
+            self.fanout.close()
+            self.fanout.report()
+        for cache in self.caches():
+            if cache.hits or cache.misses:
+                print(cache.summary())
+        for session in self.sessions:
+            session.stop()
+
+    def connected(self, timeout=120):
+        """wait for all sessions to be established."""
+        deadline = time.time() + timeout
+        for session in self.sessions:
+            if not session.established.wait(max(0, deadline - time.time())):
+                return False
+        return True
+
+    def _encode(self, update):
+        """Yield (UPDATE messages, channels) for each group of sessions sharing an encoding."""
+        for as4, encoder in self.encoders.items():
+            channels = [self.channels[s] for s in self.sessions if s.as4 == as4 and s.established.is_set()]
+            if channels:
+                msgs = encoder.messages(update['attr'], update.get('nlri', []), update.get('withdraw', []))
+                yield b''.join(bytes(msg) for msg in msgs), channels
+
+    def send_update(self, update):
+        for payload, channels in self._encode(update):
+            self.fanout.publish(payload, channels)
+
+    async def send_update_async(self, update):
+        for payload, channels in self._encode(update):
+            await self.fanout.publish_async(payload, channels)
 
 
 BGP_AGENTS  = {
         'console': ConsoleAgent,
         'yabgp': YaBGPAgent,
-        'exabgp': ExaBGPAgent
+        'exabgp': ExaBGPAgent,
+        'native': NativeAgent,
         }
 
 class BgpUpdateGenerator(object):
     """Generate random BGP updates, replay from a MRT file or live from a CAIDA collector.
+    source, when given, is a function creating the (timestamp, update) pairs to send instead
+    (the updates of the workers).
     """
 
-    def __init__(self, config):
+    def __init__(self, config, source=None):
         self.config = config
+        self.source = source
         self.agent = BGP_AGENTS[config['agent']]()
+        if hasattr(self.agent, 'fanout'):
+            from fanout import FanOut
+            self.agent.fanout = FanOut(config['peer_queue'], config['slow_peer'])
+        if hasattr(self.agent, 'caches'):
+            for cache in self.agent.caches():
+                cache.maxsize = config['attr_cache']
+        if config['agent'] == 'exabgp':
+            self.agent.max_inflight = config['exabgp_inflight']
+        elif config['agent'] == 'yabgp':
+            self.agent.max_inflight = config['yabgp_inflight']
+            self.agent.rest_addrs = config['yabgp_api'] or []
+        self.backend = self.agent
+        if config['pack']:
+            from updatepacker import UpdatePacker
+            self.agent = UpdatePacker(self.agent, config['pack_window'], config['pack_size'])
+        self.scheduler = None
+        self.stream = None
+        self.phase = None
+        self.reporter = None
+        self.profile = None
+        self.convergence = None
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Register the metrics of the run: counters and sampled timings kept by the send
+        and decode loops, and collectors reading the agent's queues and statistics."""
+        from metrics import Registry, rss
+        registry = self.metrics = Registry()
+        self.sent_counter = registry.counter('updates_sent', 'Updates handed to the agent')
+        self.records_counter = registry.counter('records_decoded', 'Records read from a MRT file or live feed')
+        self.decode_timing = registry.timing('decode_seconds', 'Time to read and decode a record (sampled)')
+        self.encode_timing = registry.timing(
+            'encode_seconds', 'Time for the agent to encode and queue an update (sampled)')
+        registry.gauge('rss_bytes', rss, 'Resident set size')
+        registry.gauge('scheduler_lag_seconds', lambda: self.scheduler.lag if self.scheduler else 0.0,
+                       'How late the last update was sent')
+        if self.config['scenario']:
+            registry.gauge('scenario_phase', lambda: self.phase if self.phase is not None else -1,
+                           'Index of the running scenario phase')
+
+        def stream_samples():
+            errors = getattr(self.stream, 'errors', None)
+            if errors is None:
+                return []
+            errors = errors()
+            return [('mrt_corrupt_records', {}, errors['corrupt']),
+                    ('mrt_truncated_records', {}, errors['truncated'])]
+        registry.add_collector(stream_samples)
+        backend = self.backend
+        if getattr(backend, 'fanout', None) is not None:
+            registry.add_collector(backend.fanout.samples)
+        if hasattr(backend, 'metrics'):
+            registry.add_collector(backend.metrics)
+        if hasattr(backend, 'caches'):
+            def cache_samples():
+                samples = []
+                for cache in backend.caches():
+                    labels = {'cache': cache.name}
+                    samples.append(('attr_cache_hits', labels, cache.hits))
+                    samples.append(('attr_cache_misses', labels, cache.misses))
+                    samples.append(('attr_cache_entries', labels, len(cache.entries)))
+                return samples
+            registry.add_collector(cache_samples)
+
+    def _start_metrics(self):
+        config = self.config
+        if config['metrics_interval'] or config['metrics_port'] is not None:
+            from metrics import Reporter
+            self.reporter = Reporter(self.metrics, config['metrics_interval'], config['metrics_file'],
+                                     config['metrics_port'])
+            self.reporter.start()
+        if config['profile_updates']:
+            from metrics import ProfileWindow
+            self.profile = ProfileWindow(config['profile_updates'], config['profile_skip'],
+                                         config['profile_output'])
+        if config['convergence_log']:
+            from convergence import EventLog
+            self.convergence = EventLog(config['convergence_log'])
+            if self.agent is not self.backend:
+                # log the packed updates as they are sent, not those coalesced away
+                self.agent.log = self.convergence
+
+    def _stop(self):
+        self.agent.stop()
+        if self.profile:
+            self.profile.stop()
+        if self.reporter:
+            self.reporter.stop()
+        if self.convergence:
+            self.convergence.close()
 
     def run(self):
-        """Start sending updates."""
+        """Start sending updates. Returns False if no BGP router connected; errors are raised
+        once the agent is stopped."""
         try:
+            self._start_metrics()
             self.agent.start(self.config['peers'], self.config['local_ip'], self.config['local_as'])
             if not self.agent.connected():
                 print('no BGP router is connected')
-                return
-            time.sleep(1)
-            if self.config['mrt']:
-                self._send_update_from_source(source_type='mrt_file', filename=self.config['mrt'])
-            elif self.config['live']:
-                self._send_update_from_source(source_type='live', collector=self.config['live'])
-            else:
-                self._send_random_update()
-            self.agent.stop()
-        except (KeyboardInterrupt, Exception):
-            self.agent.stop()
-            traceback.print_exc()
+                return False
+            updates, rate = self._source()
+            self._send(updates, rate, self.config['speed'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop()
+        return True
+
+    def _stages(self):
+        """Return a function creating the (timestamp, update) pairs of the source, the rate to
+        send them at (None to follow their timestamps) and the transforms to apply to every
+        update."""
+        if self.source is not None:
+            return self.source, self.config['rate'] or 1, []
+        if self.config['replay']:
+            from updatetrace import TraceReader
+            trace = TraceReader(self.config['replay'])
+            rate = self.config['rate']
+            if not rate and not trace.timestamps:
+                rate = trace.metadata.get('rate') or 1
+            if self.config['replay_preload']:
+                start = time.time()
+                updates = list(trace)
+                print('loaded %d updates in %.1fs' % (len(updates), time.time() - start))
+                return lambda: iter(updates), rate, []
+            return lambda: iter(trace), rate, []
+        if self.config['mrt']:
+            # a compiled cache holds updates whose nexthop is already rewritten
+            transforms = [] if self.config['mrt_cache'] else [self._rewrite_nexthop]
+            return (lambda: self._updates_from_source(source_type='mrt_file', filename=self.config['mrt']),
+                    self.config['rate'], transforms)
+        if self.config['live']:
+            return (lambda: self._updates_from_source(source_type='live', collector=self.config['live']),
+                    self.config['rate'], [self._rewrite_nexthop])
+        if self.config['scenario']:
+            return self._scenario_updates, self.config['rate'], []
+        return self._random_updates, self.config['rate'] or 1, []
+
+    def _source(self):
+        """Return the (timestamp, update) pairs to send and the rate to send them at. With a
+        pipeline, the source and the transforms run ahead in threads or a child process."""
+        make_source, rate, transforms = self._stages()
+        if self.config['pipeline'] != 'none':
+            from pipeline import Pipeline
+            return iter(Pipeline(make_source, transforms, self.config['pipeline'],
+                                 self.config['pipeline_depth'])), rate
+        updates = make_source()
+        if transforms:
+            updates = self._transformed(updates, transforms)
+        return updates, rate
+
+    @staticmethod
+    def _transformed(updates, transforms):
+        for timestamp, update in updates:
+            for transform in transforms:
+                transform(update)
+            yield timestamp, update
+
+    def _rewrite_nexthop(self, update):
+        update['attr']['nexthop'] = self._random_nexthop()
+
+    def record(self):
+        """Write the updates to the trace file config['record'] instead of sending them."""
+        from updatetrace import record
+        updates, rate = self._source()
+        metadata = dict((k, self.config[k]) for k in (
+            'mrt', 'live', 'scenario', 'update_type', 'family', 'max_prefix', 'seed', 'from', 'until'))
+        metadata['rate'] = rate
+        # only random updates come without timestamps
+        timestamps = any(self.config[k] for k in ('mrt', 'live', 'scenario', 'replay'))
+        start = time.time()
+        count = record(updates, self.config['record'], self.config['record_compression'],
+                       timestamps=timestamps, metadata=metadata, count=self.config['count'])
+        elapsed = time.time() - start
+        print('recorded %d updates to %s in %.1fs (%.0f/s), %d bytes' % (
+            count, self.config['record'], elapsed, count / elapsed if elapsed else 0.0,
+            os.path.getsize(self.config['record'])))
+
+    def _send(self, updates, rate, speed=1.0):
+        if hasattr(self.agent, 'send_update_async'):
+            import asyncio
+            asyncio.run(self._send_updates(updates, rate, speed))
+        else:
+            # no event loop to start for the console agent
+            self._send_updates_sync(updates, rate, speed)
+
+    async def _send_updates(self, updates, rate, speed=1.0):
+        """Send the (timestamp, update) pairs from updates, at rate updates/sec if given or else
+        following their timestamps, speed times faster."""
+        from metrics import SAMPLE_EVERY
+        from scheduler import Scheduler
+        scheduler = self.scheduler = Scheduler(rate, speed)
+        send_update_async = self.agent.send_update_async
+        count = self.config['count']
+        sent = self.sent_counter
+        encode = self.encode_timing
+        profile = self.profile
+        convergence = self.convergence if self.agent is self.backend else None
+        try:
+            for timestamp, update in updates:
+                await scheduler.wait(timestamp)
+                if convergence:
+                    convergence.log(update)
+                timed = not sent.value % SAMPLE_EVERY
+                if timed:
+                    start = time.perf_counter()
+                await send_update_async(update)
+                if timed:
+                    encode.add(time.perf_counter() - start)
+                sent.value += 1
+                if profile:
+                    profile.tick()
+                if count and scheduler.sent >= count:
+                    break
+        finally:
+            print(scheduler.summary())
+
+    def _send_updates_sync(self, updates, rate, speed=1.0):
+        """_send_updates for agents without send_update_async."""
+        from metrics import SAMPLE_EVERY
+        from scheduler import Scheduler
+        scheduler = self.scheduler = Scheduler(rate, speed)
+        send_update = self.agent.send_update
+        count = self.config['count']
+        sent = self.sent_counter
+        encode = self.encode_timing
+        profile = self.profile
+        convergence = self.convergence if self.agent is self.backend else None
+        try:
+            for timestamp, update in updates:
+                scheduler.wait_sync(timestamp)
+                if convergence:
+                    convergence.log(update)
+                timed = not sent.value % SAMPLE_EVERY
+                if timed:
+                    start = time.perf_counter()
+                send_update(update)
+                if timed:
+                    encode.add(time.perf_counter() - start)
+                sent.value += 1
+                if profile:
+                    profile.tick()
+                if count and scheduler.sent >= count:
+                    break
+        finally:
+            print(scheduler.summary())
 
     def _random_nexthop(self):
         if not self.config['nexthop']:
             return None
         return str(random.choice(self.config['nexthop']))
 
-    def _send_random_update(self):
-        """generate updates randomly."""
-        def random_prefix():
-            prefix = ".".join(map(str, (random.randint(0,255) for _ in range(3))))
-            prefix += '.0/24'
-            return prefix
+    def _scenario_updates(self):
+        """generate the phases of a synthetic workload, paced by their own rates."""
+        from workload import Workload, fit_distributions, parse_scenario
+        distributions = None
+        if self.config['profile_mrt']:
+            distributions = fit_distributions(self._open_mrt(self.config['profile_mrt']))
+        workload = Workload(self.config['local_as'], self.config['nexthop'],
+                            table_size=self.config['table_size'] or 900000,
+                            distributions=distributions, seed=self.config['seed'])
+
+        def on_phase(index, name, rate):
+            self.phase = index
+            print('starting phase %d (%s) at %.0f updates/sec' % (index, name, rate))
+        return workload.run(parse_scenario(self.config['scenario']), on_phase)
+
+    def _random_updates(self):
+        """generate updates randomly, in bulk with NumPy when it is installed."""
+        try:
+            from randgen import RandomUpdates
+        except ImportError:
+            return self._random_updates_loop()
+        updates = RandomUpdates(self.config['local_as'], self.config['nexthop'],
+                                update_type=self.config['update_type'],
+                                max_prefix=self.config['max_prefix'], seed=self.config['seed'],
+                                table_size=self.config['table_size'], family=self.config['family'],
+                                shard=self.config.get('shard', (0, 1)))
+        return ((None, update) for update in updates)
+
+    def _random_updates_loop(self):
+        """generate updates randomly, one at a time."""
+        random.seed(self.config['seed'])
+        from bgpprefix import Prefix, Prefix6
+        from prefixrib import PrefixStore, withdraw_probability
+        ipv6_share = {'ipv4': 0.0, 'ipv6': 1.0, 'both': 0.5}[self.config['family']]
 
         def random_prefixes(max_prefix):
-            prefixes = []
-            for _ in range(random.randint(1, max_prefix)):
-                prefixes.append(random_prefix())
-            return prefixes
+            count = random.randint(1, max_prefix)
+            if random.random() < ipv6_share:
+                return [Prefix6.from_int(((1 << 45) | random.getrandbits(45)) << 80, 48) for _ in range(count)]
+            return [Prefix.from_int(random.getrandbits(24) << 8, 24) for _ in range(count)]
 
         def random_as_path(max_length=5):
             as_path = [self.config['local_as']]
@@ -269,17 +737,8 @@ class BgpUpdateGenerator(object):
                 as_path.append(random.randint(1, 64999))
             return as_path
 
-        def sample(seq, num):
-            if len(seq) >= num:
-                return random.sample(seq, num)
-            else:
-                return seq
-        sent = 0
-        update_per_sec = self.config['rate'] or 1
-        update_per_sec = float(update_per_sec)
-        announced_prefixes = set()
-        rate = self.config['rate']
-        while sent < self.config['count'] or self.config['count'] == 0:
+        announced_prefixes = PrefixStore()
+        while True:
             update = {
                 'attr': {
                         'nexthop': self._random_nexthop(),
@@ -289,104 +748,235 @@ class BgpUpdateGenerator(object):
                         'local_pref': random.randint(100, 150),
                         }
                 }
-            update['nlri'] = []
-            update['withdraw'] = []
+            nlri = []
+            withdraw = []
             if self.config['update_type'] == 'announce':
-                update['nlri'] = random_prefixes(self.config['max_prefix'])
-                announced_prefixes.update(update['nlri'])
+                nlri = random_prefixes(self.config['max_prefix'])
             elif self.config['update_type'] == 'withdraw':
-                update['withdraw'] = random_prefixes(self.config['max_prefix'])
+                withdraw = random_prefixes(self.config['max_prefix'])
             else:
-                if random.getrandbits(1):
-                    update['withdraw'] = sample(announced_prefixes, self.config['max_prefix'])
-                if random.getrandbits(1):
-                    update['nlri'] = random_prefixes(self.config['max_prefix'])
-                    announced_prefixes.update(update['nlri'])
-            self.agent.send_update(update)
-            sent += 1
-            time.sleep(1/update_per_sec)
-
-    def _send_update_from_source(self, source_type, **kwargs):
+                p_withdraw = withdraw_probability(len(announced_prefixes), self.config['table_size'])
+                if random.random() < p_withdraw and announced_prefixes:
+                    withdraw = announced_prefixes.pick_many(
+                        random.random() for _ in range(random.randint(1, self.config['max_prefix'])))
+                    for prefix in withdraw:
+                        announced_prefixes.remove(prefix)
+                if random.random() >= p_withdraw:
+                    nlri = random_prefixes(self.config['max_prefix'])
+                    for prefix in nlri:
+                        announced_prefixes.add(prefix)
+            update['nlri'] = nlri
+            update['withdraw'] = withdraw
+            yield None, update
+
+    def _open_mrt(self, filename):
+        from mrtmerge import expand_mrt_files, MultiBGPDump
+        filenames = expand_mrt_files(filename)
+        if len(filenames) > 1:
+            return MultiBGPDump(filenames, workers=self.config['mrt_workers'])
+        elif self.config['mrt_reader'] == 'dpkt':
+            from pybgpdump import BGPDump
+            return BGPDump(filename)
+        else:
+            from pybgpdump import FastBGPDump
+            return FastBGPDump(filename)
+
+    def _open_mrt_cache(self, filename):
+        """Open the compiled cache of filename, compiling it first if needed."""
+        from mrtmerge import expand_mrt_files
+        from mrtcache import cached_dump
+
+        def rewrite_nexthop(attr):
+            attr['nexthop'] = self._random_nexthop()
+        nexthops = [str(nexthop) for nexthop in self.config['nexthop']]
+        return cached_dump(expand_mrt_files(filename), self.config['mrt_cache'],
+                           lambda: self._open_mrt(filename), rewrite_nexthop, nexthops)
+
+    def _updates_from_source(self, source_type, **kwargs):
+        """Yield (timestamp, update) from a MRT file or a live feed, within the from/until
+        window. Sources which can seek skip straight to the start of the window."""
         stream = None
         if source_type == 'mrt_file':
-            from .pybgpdump import BGPDump
-            stream = BGPDump(kwargs['filename'])
+            if self.config['mrt_cache']:
+                stream = self._open_mrt_cache(kwargs['filename'])
+            else:
+                stream = self._open_mrt(kwargs['filename'])
         elif source_type == 'live':
             from bgpstream import BGPStreamReader
-            stream = BGPStreamReader({'collector': kwargs['collector']})
+            live_config = {'collector': kwargs['collector']}
+            if self.config['from'] is not None:
+                live_config['from_date'] = self.config['from']
+            if self.config['until'] is not None:
+                live_config['until_date'] = self.config['until']
+            stream = BGPStreamReader(live_config)
         else:
             print('unsupported type: %s' % source_type)
             sys.exit(-1)
 
-        delay = 0.0
-        prev_timestamp = 0
-        sent = 0
-        self.update_per_sec = self.config['rate']
-        while sent < self.config['count'] or self.config['count'] == 0:
+        from metrics import SAMPLE_EVERY
+        self.stream = stream
+        start, until = self.config['from'], self.config['until']
+        if start is not None and hasattr(stream, 'seek'):
+            stream.seek(start)
+        records = self.records_counter
+        decode = self.decode_timing
+        while True:
+            timed = not records.value % SAMPLE_EVERY
+            if timed:
+                started = time.perf_counter()
             try:
                 timestamp, attr, nlri, withdraw = stream.next()
-                attr['nexthop'] = self._random_nexthop()
-                update = {
-                        'attr': attr,
-                        'nlri': nlri,
-                        'withdraw': withdraw,
-                        }
-                self.agent.send_update(update)
-                sent += 1
-                if prev_timestamp == 0:
-                    delay = 0.0
-                else:
-                    delay = timestamp - prev_timestamp
-                prev_timestamp = timestamp
-                if self.update_per_sec:
-                    time.sleep(1/self.update_per_sec)
-                else:
-                    time.sleep(delay)
-            except Exception as e:
-                traceback.print_exc()
-                sys.exit(-1)
+            except StopIteration:
+                errors = stream.errors() if hasattr(stream, 'errors') else {}
+                if errors.get('corrupt') or errors.get('truncated'):
+                    print('%d corrupt records skipped, %d truncated%s' % (
+                        errors['corrupt'], errors['truncated'],
+                        ' (%s)' % errors['error'] if errors.get('error') else ''))
+                return
+            if timed:
+                decode.add(time.perf_counter() - started)
+            records.value += 1
+            if start is not None and timestamp < start:
+                continue
+            if until is not None and timestamp > until:
+                if hasattr(stream, 'close'):
+                    stream.close()
+                return
+            update = {
+                    'attr': attr,
+                    'nlri': nlri,
+                    'withdraw': withdraw,
+                    }
+            yield timestamp, update
 
 
 def setup_cli_opts():
-    CONF = cfg.CONF
-    cli_opts = [
-        cfg.MultiStrOpt('peers', short='p',
-            help='one or more peers to send update to. It takes format address:port/asn, ex: 127.0.0.1:179/65000'),
-        cfg.StrOpt('mrt', help='BGP MRT file to replay'),
-        cfg.StrOpt('live', help='Replay BGP updates from live feed (a valid CAIDA collector, ex:rrc00)'),
-        cfg.BoolOpt('rand', help='Randomly generate BGP updates. It is enabled by default if file or live is not specified'),
-        cfg.StrOpt('agent', short='a',
-            choices=[('yabgp', 'https://github.com/smartbgp/yabgp'),
-                     ('exabgp', 'https://github.com/Exa-Networks/exabgp'),
-                     ('console', 'Print to screen')],
-            help='Use YaBGP or ExaBGP for BGP peering or simply print to screen'),
-        cfg.IntOpt('count', short='c',
-            help='Number of updates to send. Use 0 for no limit (default)'),
-        cfg.FloatOpt('rate', short='r',
-            help='Number of updates per sec, if not specified, based on timestamp in MRT file, or 1 for random updates'),
-        cfg.IntOpt('max_prefix', short='m',
-            help='Max number of prefixes per updates. Default=1. The actual number is randomly between 1 to the max'),
-        cfg.StrOpt('update_type', short='t', choices=['announce', 'withdraw', 'mixed'],
-            help='Type of updates: announce, withdraw or mixed (default)'),
-        cfg.MultiStrOpt('nexthop', short='nh',
-            help='A nexthop(s) to use for announcements. Default=IP address used to establish the peering'),
-        cfg.IntOpt('local_as', help='Local ASN, default=65000'),
-        cfg.StrOpt('local_ip', help='Local IP, default=127.0.0.1'),
-    ]
-    CONF.register_cli_opts(cli_opts)
-    return CONF
+    """Return the parser of the command line. Options default to None, so the environment
+    (BGPGEN_<OPTION>) and then DEFAULTS fill in those not given."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Send BGP updates, random, from MRT files or from a live feed, to BGP peers', allow_abbrev=False)
+    add = parser.add_argument
+    add('--peers', '-p', action='append',
+        help='one or more peers to send update to. It takes format address:port/asn, ex: 127.0.0.1:179/65000')
+    add('--mrt',
+        help='BGP MRT file to replay. A directory or glob replays all matching files in timestamp order')
+    add('--mrt_reader', choices=['fast', 'dpkt'],
+        help='MRT parser: fast (mmap, no dpkt objects, default) or dpkt')
+    add('--mrt_workers', type=int,
+        help='Number of processes decoding MRT files when replaying several files. Default=number of CPUs')
+    add('--mrt_cache', help='Directory of compiled MRT replay caches. The MRT file is compiled on first use')
+    add('--live', help='Replay BGP updates from live feed (a valid CAIDA collector, ex:rrc00)')
+    add('--rand', action='store_true', default=None,
+        help='Randomly generate BGP updates. It is enabled by default if file or live is not specified')
+    add('--scenario',
+        help='Synthetic workload phases, ex: load:rate=5000,churn:duration=60:rate=100,storm:count=10000:rate=1000:prefixes=500')
+    add('--profile_mrt',
+        help='MRT file to fit the workload prefix length and AS path length distributions from')
+    add('--agent', '-a', choices=['yabgp', 'exabgp', 'native', 'console'],
+        help='Use YaBGP (https://github.com/smartbgp/yabgp), ExaBGP (https://github.com/Exa-Networks/exabgp) or the built-in speaker for BGP peering or simply print to screen')
+    add('--count', '-c', type=int, help='Number of updates to send. Use 0 for no limit (default)')
+    add('--rate', '-r', type=float,
+        help='Number of updates per sec, if not specified, based on timestamp in MRT file, or 1 for random updates')
+    add('--speed', type=float,
+        help='Replay timestamps this many times faster, ex: 60 replays an hour in a minute. Default=1')
+    add('--from', help='Replay MRT or live updates from this time, unix seconds or YYYY-MM-DDTHH:MM:SS (UTC)')
+    add('--until',
+        help='Replay MRT or live updates up to this time, unix seconds or YYYY-MM-DDTHH:MM:SS (UTC)')
+    add('--max_prefix', '-m', type=int,
+        help='Max number of prefixes per updates. Default=1. The actual number is randomly between 1 to the max')
+    add('--update_type', '-t', choices=['announce', 'withdraw', 'mixed'],
+        help='Type of updates: announce, withdraw or mixed (default)')
+    add('--family', choices=['ipv4', 'ipv6', 'both'],
+        help='Address family of random updates: ipv4 (default), ipv6 or both')
+    add('--nexthop', '-nh', action='append',
+        help='A nexthop(s) to use for announcements. Default=IP address used to establish the peering')
+    add('--peer_queue', type=int, help='Max number of updates queued for each peer. Default=1024')
+    add('--slow_peer', choices=['block', 'drop'],
+        help='When a peer queue is full, wait for it (block, default) or skip the peer (drop)')
+    add('--attr_cache', type=int,
+        help='Number of attribute sets whose rendered form (ExaBGP text, YaBGP JSON, wire bytes) is kept. Default=4096')
+    add('--exabgp_inflight', type=int,
+        help='Max number of statements waiting for an answer from ExaBGP. Default=10000')
+    add('--yabgp_inflight', type=int,
+        help='Max number of requests in flight to each yabgpd; requests sharing a prefix are never in flight together. Default=4')
+    add('--yabgp_api', action='append',
+        help='host:port of the REST API of an already running yabgpd (or yabgpapi.py stub), one per peer')
+    add('--record', help='Write the updates to this trace file instead of sending them')
+    add('--record_compression', choices=['none', 'zstd', 'lz4'],
+        help='Compression of the recorded trace: none (default), zstd or lz4')
+    add('--replay', help='Send the updates of a trace file written by --record')
+    add('--replay_preload', action='store_true', default=None,
+        help='Decode the whole trace before sending, so sending is all the replay does')
+    add('--pipeline', choices=['none', 'thread', 'process'],
+        help='Run the source ahead of sending: none (default), in threads or in a child process')
+    add('--pipeline_depth', type=int,
+        help='Chunks of updates (thread) or 1 MiB ring slots (process) between pipeline stages. Default=16')
+    add('--metrics_interval', type=float, help='Seconds between JSON lines of metrics, 0 (default) for none')
+    add('--metrics_file', help='File the JSON lines of metrics are appended to. Default=stdout')
+    add('--metrics_port', type=int, help='Port serving the metrics in Prometheus text format on /metrics')
+    add('--profile_updates', type=int, help='Run cProfile over this many updates, 0 (default) for none')
+    add('--profile_skip', type=int, help='Number of updates sent before profiling starts. Default=0')
+    add('--profile_output', help='File the profile is written to in pstats format')
+    add('--convergence_log', help='Log the time every prefix is sent to this file, for convergence.py report')
+    add('--pack', action='store_true', default=None,
+        help='Coalesce prefixes sharing the same attributes into full UPDATE messages')
+    add('--pack_window', type=float, help='Max seconds an update is held for packing. Default=1')
+    add('--pack_size', type=int, help='Max number of prefixes held for packing. Default=10000')
+    add('--table_size', type=int,
+        help='Number of announced prefixes the mixed mode settles around (default unbounded), or the table size of scenarios (default 900000)')
+    add('--seed', type=int, help='Seed for random updates, the same seed gives the same updates')
+    add('--workers', type=int,
+        help='Processes generating random updates, each with a slice of the prefixes and a share of the count, sent over one session per peer. Default=1')
+    add('--local_as', type=int, help='Local ASN, default=65000')
+    add('--local_ip', help='Local IP, default=127.0.0.1')
+    return parser
 
 DEFAULTS = {
         'live': None,
         'mrt': None,
+        'mrt_reader': 'fast',
+        'mrt_workers': 0,
+        'mrt_cache': None,
         'rand': True,
+        'scenario': None,
+        'profile_mrt': None,
         'peers': ['127.0.0.1:9179/65000'],
         'agent': 'console',
         'count': 0,
         'rate': 0,
+        'speed': 1.0,
+        'from': None,
+        'until': None,
         'max_prefix': 1,
         'update_type': 'mixed',
+        'family': 'ipv4',
         'nexthop': ['127.0.0.1'],
+        'peer_queue': 1024,
+        'slow_peer': 'block',
+        'attr_cache': 4096,
+        'exabgp_inflight': 10000,
+        'yabgp_inflight': 4,
+        'yabgp_api': None,
+        'record': None,
+        'record_compression': 'none',
+        'replay': None,
+        'replay_preload': False,
+        'pipeline': 'none',
+        'pipeline_depth': 16,
+        'metrics_interval': 0,
+        'metrics_file': None,
+        'metrics_port': None,
+        'profile_updates': 0,
+        'profile_skip': 0,
+        'profile_output': None,
+        'convergence_log': None,
+        'pack': False,
+        'pack_window': 1.0,
+        'pack_size': 10000,
+        'table_size': 0,
+        'seed': None,
+        'workers': 1,
         'local_as': 65000,
         'local_ip': '127.0.0.1',
         }
@@ -403,6 +993,7 @@ def check_peer_format(peers):
     return results
 
 def check_nexthop_format(nexthops):
+    import ipaddress
     results = []
     try:
         for nexthop in nexthops:
@@ -413,24 +1004,95 @@ def check_nexthop_format(nexthops):
     return results
 
 
+def check_time_format(value):
+    if value is None:
+        return None
+    import calendar
+    import datetime
+    try:
+        if value.isdigit():
+            return int(value)
+        dt = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        return calendar.timegm(dt.timetuple())
+    except Exception as e:
+        print('Incorrect argument format: %s' % e)
+        sys.exit(-1)
+
+
+def check_scenario(value):
+    if value is None:
+        return None
+    from workload import parse_scenario
+    try:
+        parse_scenario(value)
+    except ValueError as e:
+        print('Incorrect scenario: %s' % e)
+        sys.exit(-1)
+    return value
+
+
+def run_workers(config):
+    """Send random updates generated by config['workers'] processes. Returns the exit code."""
+    from workers import Coordinator
+    if any(config[k] for k in ('mrt', 'live', 'scenario', 'replay', 'record')):
+        print('--workers only applies to sending random updates')
+        return -1
+    coordinator = Coordinator(config, BgpUpdateGenerator,
+                              lambda config: BgpUpdateGenerator(config)._random_updates(), config['workers'])
+    return 1 if coordinator.run() else 0
+
+
 CHECKS = {
         'peers': check_peer_format,
-        'nexthop': check_nexthop_format
+        'nexthop': check_nexthop_format,
+        'from': check_time_format,
+        'until': check_time_format,
+        'scenario': check_scenario,
         }
 
+def environment_args(parser):
+    """Return the command line equivalent of the BGPGEN_<OPTION> environment variables, so they
+    are converted and checked like options. Options given several times take comma separated
+    values, flags 1, true, yes or on."""
+    import argparse
+    args = []
+    for action in parser._actions:
+        value = os.environ.get('BGPGEN_' + action.dest.upper())
+        if value is None or not action.option_strings:
+            continue
+        option = action.option_strings[0]
+        if action.nargs == 0:
+            if value.lower() in ('1', 'true', 'yes', 'on'):
+                args.append(option)
+        elif isinstance(action, argparse._AppendAction):
+            args.extend('%s=%s' % (option, item) for item in value.split(','))
+        else:
+            args.append('%s=%s' % (option, value))
+    return args
+
+
 def main():
-    conf = setup_cli_opts()
-    conf(args=sys.argv[1:])
+    parser = setup_cli_opts()
+    conf = parser.parse_args(sys.argv[1:])
+    environment = parser.parse_args(environment_args(parser))
 
     config = {}
     for param in DEFAULTS.keys():
-        value = getattr(conf, param) or os.environ.get('BGPGEN_' + param.upper(), None) or DEFAULTS[param]
+        value = getattr(conf, param) or getattr(environment, param) or DEFAULTS[param]
         if param in CHECKS:
             value = CHECKS[param](value)
         config[param] = value
     print(config)
+    if config['mrt_cache'] and config['mrt_reader'] == 'dpkt':
+        print('--mrt_cache needs the fast MRT reader: the dpkt reader does not keep the wire encoding of the attributes')
+        sys.exit(-1)
+    if config['workers'] > 1:
+        sys.exit(run_workers(config))
     bgpgen = BgpUpdateGenerator(config)
-    bgpgen.run()
+    if config['record']:
+        bgpgen.record()
+    elif not bgpgen.run():
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,99 @@
+"""Packed IPv4 and IPv6 prefixes.
+
+A prefix is kept in its NLRI wire format, the length in bits followed by the significant
+octets of the address, in a bytes subclass. Decoders slice prefixes out of the messages they
+read, the speaker writes them back as they are, and they are only turned into text by str()
+for the agents which need it.
+"""
+import socket
+
+AFI_IPV4 = 1
+AFI_IPV6 = 2
+SAFI_UNICAST = 1
+
+
+class Prefix(bytes):
+    """An IPv4 prefix in NLRI wire format."""
+    __slots__ = ()
+    afi = AFI_IPV4
+    family = socket.AF_INET
+    addr_len = 4
+
+    @classmethod
+    def from_address(cls, addr, plen):
+        """Make a prefix from a packed address (only the first (plen + 7) // 8 octets are used)."""
+        return cls(bytes((plen,)) + bytes(addr[:(plen + 7) // 8]))
+
+    @classmethod
+    def from_int(cls, addr, plen):
+        size = cls.addr_len
+        return cls(((plen << (8 * size)) | addr).to_bytes(size + 1, 'big')[:1 + (plen + 7) // 8])
+
+    @classmethod
+    def from_string(cls, text):
+        addr, _, plen = text.partition('/')
+        plen = int(plen) if plen else cls.addr_len * 8
+        return cls.from_address(socket.inet_pton(cls.family, addr), plen)
+
+    @property
+    def plen(self):
+        return self[0]
+
+    @property
+    def address(self):
+        """The packed address, zero padded."""
+        return bytes(self[1:]) + b'\x00' * (self.addr_len + 1 - len(self))
+
+    def __str__(self):
+        return '%s/%d' % (socket.inet_ntop(self.family, self.address), self[0])
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, str(self))
+
+
+class Prefix6(Prefix):
+    """An IPv6 prefix in NLRI wire format. It never equals an IPv4 prefix with the same
+    octets."""
+    __slots__ = ()
+    afi = AFI_IPV6
+    family = socket.AF_INET6
+    addr_len = 16
+
+    def __eq__(self, other):
+        return isinstance(other, Prefix6) and bytes.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((AFI_IPV6, bytes(self)))
+
+
+PREFIX_TYPES = {AFI_IPV4: Prefix, AFI_IPV6: Prefix6}
+
+
+def parse_prefix(value):
+    """Return value as a Prefix or Prefix6, parsing 'address/len' text."""
+    if isinstance(value, Prefix):
+        return value
+    value = str(value)
+    if ':' in value:
+        return Prefix6.from_string(value)
+    return Prefix.from_string(value)
+
+
+def split_families(prefixes):
+    """Return (ipv4, ipv6) lists of prefixes, parsing text prefixes."""
+    ipv4 = []
+    ipv6 = []
+    for prefix in prefixes:
+        prefix = parse_prefix(prefix)
+        if prefix.afi == AFI_IPV6:
+            ipv6.append(prefix)
+        else:
+            ipv4.append(prefix)
+    return ipv4, ipv6
+
+
+def is_ipv6(address):
+    return address is not None and ':' in str(address)
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+"""A minimal BGP speaker: wire format UPDATE encoding, an active session (OPEN/KEEPALIVE/UPDATE)
+and a passive stand-in peer which counts what it receives.
+"""
+import time
+import socket
+import struct
+import threading
+import argparse
+
+from attrcache import AttrCache
+from bgpprefix import AFI_IPV4, AFI_IPV6, SAFI_UNICAST, split_families, is_ipv6
+
+MARKER = b'\xff' * 16
+HEADER_LEN = 19
+MAX_MSG_LEN = 4096
+OPEN, UPDATE, NOTIFICATION, KEEPALIVE = 1, 2, 3, 4
+ORIGIN, AS_PATH, NEXT_HOP, MULTI_EXIT_DISC, LOCAL_PREF, COMMUNITIES = 1, 2, 3, 4, 5, 8
+MP_REACH_NLRI, MP_UNREACH_NLRI = 14, 15
+AS_SEQUENCE = 2
+AS_TRANS = 23456
+CAP_MULTIPROTOCOL = 1
+CAP_FOUR_OCTET_AS = 65
+ORIGINS = {'igp': 0, 'egp': 1, 'incomplete': 2}
+FLAG_OPTIONAL = 0x80
+FLAG_TRANSITIVE = 0x40
+FLAG_EXTENDED = 0x10
+
+_HEADER = struct.Struct('>16sHB')
+_LEN = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+
+
+def _attribute(flags, at_type, value):
+    if len(value) > 255:
+        return struct.pack('>BBH', flags | FLAG_EXTENDED, at_type, len(value)) + value
+    return struct.pack('>BBB', flags, at_type, len(value)) + value
+
+
+def _community(value):
+    if isinstance(value, int):
+        return value
+    high, low = str(value).split(':')
+    return (int(high) << 16) | int(low)
+
+
+def encode_attributes(attr, as4=True, with_nexthop=True):
+    """Encode an attribute dict (as produced by the generators and BGPDump) into wire format.
+    An IPv6 nexthop is left out, it belongs in MP_REACH_NLRI."""
+    data = b''
+    origin = attr.get('origin')
+    if origin is not None:
+        data += _attribute(FLAG_TRANSITIVE, ORIGIN, struct.pack('>B', ORIGINS.get(origin, origin)))
+    as_path = attr.get('as_path')
+    if as_path is not None:
+        fmt = '>I' if as4 else '>H'
+        asns = [int(asn) for asn in as_path]
+        if not as4:
+            asns = [asn if asn <= 0xffff else AS_TRANS for asn in asns]
+        segments = b''
+        for i in range(0, len(asns), 255):
+            segment = asns[i:i + 255]
+            segments += struct.pack('>BB', AS_SEQUENCE, len(segment))
+            segments += b''.join(struct.pack(fmt, asn) for asn in segment)
+        data += _attribute(FLAG_TRANSITIVE, AS_PATH, segments)
+    nexthop = attr.get('nexthop')
+    if with_nexthop and nexthop is not None and not is_ipv6(nexthop):
+        data += _attribute(FLAG_TRANSITIVE, NEXT_HOP, socket.inet_aton(str(nexthop)))
+    med = attr.get('med')
+    if med is not None:
+        data += _attribute(FLAG_OPTIONAL, MULTI_EXIT_DISC, _U32.pack(int(med)))
+    local_pref = attr.get('local_pref')
+    if local_pref is not None:
+        data += _attribute(FLAG_TRANSITIVE, LOCAL_PREF, _U32.pack(int(local_pref)))
+    community = attr.get('community')
+    if community:
+        value = b''.join(_U32.pack(_community(c)) for c in community)
+        data += _attribute(FLAG_OPTIONAL | FLAG_TRANSITIVE, COMMUNITIES, value)
+    return data
+
+
+def replace_nexthop(raw, nexthop):
+    """Return the wire encoded attributes raw with NEXT_HOP set to nexthop, or removed if it is
+    None. Other attributes are copied as they are."""
+    raw = bytes(raw)
+    new = b''
+    if nexthop is not None:
+        new = _attribute(FLAG_TRANSITIVE, NEXT_HOP, socket.inet_aton(str(nexthop)))
+    off = 0
+    while off < len(raw):
+        flags, at_type = raw[off], raw[off + 1]
+        if flags & FLAG_EXTENDED:
+            end = off + 4 + _LEN.unpack_from(raw, off + 2)[0]
+        else:
+            end = off + 3 + raw[off + 2]
+        if at_type == NEXT_HOP:
+            return raw[:off] + new + raw[end:]
+        off = end
+    return raw + new
+
+
+def mp_nexthop(nexthop):
+    """The 16 octet MP_REACH_NLRI nexthop of IPv6 prefixes. An IPv4 nexthop is IPv4-mapped."""
+    if nexthop is None:
+        return b'\x00' * 16
+    if is_ipv6(nexthop):
+        return socket.inet_pton(socket.AF_INET6, str(nexthop))
+    return b'\x00' * 10 + b'\xff\xff' + socket.inet_aton(str(nexthop))
+
+
+def wire_attributes(attr, as4, with_nexthop=True):
+    """Return the wire encoding of attr, reusing the bytes from the MRT file if only the
+    nexthop has been changed since it was decoded. NEXT_HOP is left out without with_nexthop
+    or for an IPv6 nexthop."""
+    nexthop = attr.get('nexthop')
+    if not with_nexthop or is_ipv6(nexthop):
+        nexthop = None
+    raw = getattr(attr, 'raw', None)
+    if raw is not None and attr.as4 == as4:
+        if with_nexthop and attr.get('nexthop') is None:
+            return raw
+        return replace_nexthop(raw, nexthop)
+    return encode_attributes(attr, as4, with_nexthop)
+
+
+class UpdateEncoder(object):
+    """Encode updates into UPDATE messages in a preallocated buffer. Updates which do not fit
+    in a single message are split. IPv6 prefixes go in MP_UNREACH_NLRI and MP_REACH_NLRI
+    messages of their own, after those of the IPv4 prefixes.
+
+    The encoded attributes of the last `cache_size` attribute sets are cached."""
+    def __init__(self, as4=True, cache_size=4096):
+        self.as4 = as4
+        self.attr_cache = AttrCache(self._render, cache_size, 'AS%d wire' % (4 if as4 else 2))
+        self.buf = bytearray(MAX_MSG_LEN)
+        self.buf[:16] = MARKER
+        self.buf[18] = UPDATE
+        self.view = memoryview(self.buf)
+
+    def _render(self, attr, ipv6):
+        """Return (attributes, MP_REACH_NLRI head) for announcing IPv4 or IPv6 prefixes."""
+        if not ipv6:
+            return wire_attributes(attr, self.as4), b''
+        head = struct.pack('>HBB', AFI_IPV6, SAFI_UNICAST, 16) + mp_nexthop(attr.get('nexthop')) + b'\x00'
+        return wire_attributes(attr, self.as4, with_nexthop=False), head
+
+    def messages(self, attr, nlri, withdraw):
+        """Yield the UPDATE messages for an update. Each message is a view of the internal buffer
+        which is only valid until the next one is requested."""
+        buf = self.buf
+        withdraw, withdraw6 = split_families(withdraw)
+        nlri, nlri6 = split_families(nlri)
+        attrs = self.attr_cache.get(attr, False)[0] if nlri else b''
+        if HEADER_LEN + 4 + len(attrs) + 5 > MAX_MSG_LEN:
+            raise ValueError('path attributes too long: %d bytes' % len(attrs))
+        i = j = 0
+        while i < len(withdraw) or j < len(nlri):
+            pos = HEADER_LEN + 2
+            while i < len(withdraw) and pos + len(withdraw[i]) + 2 <= MAX_MSG_LEN:
+                buf[pos:pos + len(withdraw[i])] = withdraw[i]
+                pos += len(withdraw[i])
+                i += 1
+            _LEN.pack_into(buf, HEADER_LEN, pos - HEADER_LEN - 2)
+            attr_pos = pos
+            pos += 2
+            if i == len(withdraw) and j < len(nlri) and pos + len(attrs) + len(nlri[j]) <= MAX_MSG_LEN:
+                buf[pos:pos + len(attrs)] = attrs
+                pos += len(attrs)
+                _LEN.pack_into(buf, attr_pos, len(attrs))
+                while j < len(nlri) and pos + len(nlri[j]) <= MAX_MSG_LEN:
+                    buf[pos:pos + len(nlri[j])] = nlri[j]
+                    pos += len(nlri[j])
+                    j += 1
+            else:
+                _LEN.pack_into(buf, attr_pos, 0)
+            _LEN.pack_into(buf, 16, pos)
+            yield self.view[:pos]
+        if withdraw6:
+            head = struct.pack('>HB', AFI_IPV6, SAFI_UNICAST)
+            for msg in self._mp_messages(b'', MP_UNREACH_NLRI, head, withdraw6):
+                yield msg
+        if nlri6:
+            attrs, head = self.attr_cache.get(attr, True)
+            for msg in self._mp_messages(attrs, MP_REACH_NLRI, head, nlri6):
+                yield msg
+
+    def _mp_messages(self, attrs, at_type, head, prefixes):
+        """Yield messages carrying prefixes in a MP_REACH_NLRI or MP_UNREACH_NLRI attribute
+        starting with head, after the other attributes attrs."""
+        buf = self.buf
+        start = HEADER_LEN + 4 + len(attrs) + 4 + len(head)
+        if start + 17 > MAX_MSG_LEN:
+            raise ValueError('path attributes too long: %d bytes' % len(attrs))
+        _LEN.pack_into(buf, HEADER_LEN, 0)
+        buf[HEADER_LEN + 4:HEADER_LEN + 4 + len(attrs)] = attrs
+        buf[start - len(head):start] = head
+        i = 0
+        while i < len(prefixes):
+            pos = start
+            while i < len(prefixes) and pos + len(prefixes[i]) <= MAX_MSG_LEN:
+                buf[pos:pos + len(prefixes[i])] = prefixes[i]
+                pos += len(prefixes[i])
+                i += 1
+            struct.pack_into('>BBH', buf, HEADER_LEN + 4 + len(attrs), FLAG_OPTIONAL | FLAG_EXTENDED,
+                             at_type, pos - (HEADER_LEN + 4 + len(attrs) + 4))
+            _LEN.pack_into(buf, HEADER_LEN + 2, pos - HEADER_LEN - 4)
+            _LEN.pack_into(buf, 16, pos)
+            yield self.view[:pos]
+
+
+def encode_message(msg_type, body=b''):
+    return _HEADER.pack(MARKER, HEADER_LEN + len(body), msg_type) + body
+
+
+def encode_open(local_as, hold_time, router_id):
+    caps = struct.pack('>BBHBB', CAP_MULTIPROTOCOL, 4, AFI_IPV4, 0, SAFI_UNICAST)
+    caps += struct.pack('>BBHBB', CAP_MULTIPROTOCOL, 4, AFI_IPV6, 0, SAFI_UNICAST)
+    caps += struct.pack('>BBI', CAP_FOUR_OCTET_AS, 4, local_as)
+    params = struct.pack('>BB', 2, len(caps)) + caps
+    my_as = local_as if local_as <= 0xffff else AS_TRANS
+    body = struct.pack('>BHH4sB', 4, my_as, hold_time, socket.inet_aton(router_id), len(params)) + params
+    return encode_message(OPEN, body)
+
+
+def decode_open(body):
+    """Return (asn, hold_time, router_id, four_octet_as) from an OPEN message body."""
+    _, asn, hold_time, router_id, params_len = struct.unpack_from('>BHH4sB', body)
+    as4 = False
+    off = 10
+    end = off + params_len
+    while off + 2 <= end:
+        param_type, param_len = body[off], body[off + 1]
+        if param_type == 2:
+            cap_off = off + 2
+            while cap_off + 2 <= off + 2 + param_len:
+                cap_code, cap_len = body[cap_off], body[cap_off + 1]
+                if cap_code == CAP_FOUR_OCTET_AS:
+                    as4 = True
+                    asn = _U32.unpack_from(body, cap_off + 2)[0]
+                cap_off += 2 + cap_len
+        off += 2 + param_len
+    return asn, hold_time, socket.inet_ntoa(router_id), as4
+
+
+def read_message(sock):
+    """Read one BGP message from sock, return (type, body) or (None, None) if it is closed."""
+    header = _recv_exact(sock, HEADER_LEN)
+    if header is None:
+        return None, None
+    _, length, msg_type = _HEADER.unpack(header)
+    body = _recv_exact(sock, length - HEADER_LEN) if length > HEADER_LEN else b''
+    if body is None:
+        return None, None
+    return msg_type, body
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class BGPSession(object):
+    """An active BGP session to a peer. start() connects in the background and keeps retrying
+    until the session is established or stop() is called."""
+    def __init__(self, peer_ip, peer_port, peer_as, local_ip, local_as, hold_time=90, retry=5):
+        self.peer = (peer_ip, int(peer_port))
+        self.peer_as = int(peer_as)
+        self.local_as = int(local_as)
+        self.router_id = local_ip if local_ip != '0.0.0.0' else '127.0.0.1'
+        self.hold_time = hold_time
+        self.retry = retry
+        self.as4 = False
+        self.sock = None
+        self.state = 'IDLE'
+        self.established = threading.Event()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sock:
+            try:
+                self.send(encode_message(NOTIFICATION, struct.pack('>BB', 6, 2)))
+            except socket.error:
+                pass
+            self.sock.close()
+        self.established.clear()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self._connect()
+                self._receive()
+            except (socket.error, ValueError) as e:
+                if not self.stopped.is_set():
+                    print('session to %s:%d failed: %s' % (self.peer + (e,)))
+            self.established.clear()
+            self.state = 'IDLE'
+            self.stopped.wait(self.retry)
+
+    def _connect(self):
+        self.state = 'CONNECT'
+        self.sock = socket.create_connection(self.peer, timeout=self.retry)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(encode_open(self.local_as, self.hold_time, self.router_id))
+        self.state = 'OPENSENT'
+        msg_type, body = read_message(self.sock)
+        if msg_type != OPEN:
+            raise ValueError('expected OPEN, got %s' % msg_type)
+        asn, hold_time, _, as4 = decode_open(body)
+        if asn != self.peer_as:
+            raise ValueError('peer AS %d, expected %d' % (asn, self.peer_as))
+        self.as4 = as4
+        self.hold_time = min(self.hold_time, hold_time)
+        self.sock.sendall(encode_message(KEEPALIVE))
+        self.state = 'OPENCONFIRM'
+        msg_type, _ = read_message(self.sock)
+        if msg_type != KEEPALIVE:
+            raise ValueError('expected KEEPALIVE, got %s' % msg_type)
+        self.state = 'ESTABLISHED'
+        self.established.set()
+        if self.hold_time:
+            thread = threading.Thread(target=self._keepalive)
+            thread.daemon = True
+            thread.start()
+
+    def _keepalive(self):
+        while self.established.is_set() and not self.stopped.wait(self.hold_time / 3.0):
+            try:
+                self.send(encode_message(KEEPALIVE))
+            except socket.error:
+                return
+
+    def _receive(self):
+        """Drain messages from the peer until the session goes down."""
+        while True:
+            msg_type, body = read_message(self.sock)
+            if msg_type is None:
+                raise ValueError('connection closed by peer')
+            if msg_type == NOTIFICATION:
+                raise ValueError('NOTIFICATION %d/%d received' % (body[0], body[1]))
+
+    def send(self, msg):
+        """Send msg. A socket error is raised once the session is marked down, so the fanout
+        counts what was not sent as lost; _run notices the broken connection and reconnects."""
+        with self.lock:
+            try:
+                self.sock.sendall(msg)
+            except socket.error:
+                self.established.clear()
+                raise
+
+    def send_many(self, msgs):
+        self.send(b''.join(msgs))
+
+
+class StandInPeer(object):
+    """A passive BGP peer accepting any session and counting the UPDATEs it receives. When
+    set, recorder(body) is called with the body of every UPDATE."""
+    def __init__(self, host='127.0.0.1', port=9179, asn=65000, router_id='127.0.0.2', hold_time=90):
+        self.asn = asn
+        self.router_id = router_id
+        self.hold_time = hold_time
+        self.updates = 0
+        self.messages = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self.recorder = None
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(16)
+        self.address = self.server.getsockname()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.close()
+
+    def serve(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self._session, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _session(self, sock):
+        try:
+            msg_type, body = read_message(sock)
+            if msg_type != OPEN:
+                return
+            sock.sendall(encode_open(self.asn, self.hold_time, self.router_id) + encode_message(KEEPALIVE))
+            while True:
+                msg_type, body = read_message(sock)
+                if msg_type is None or msg_type == NOTIFICATION:
+                    return
+                self.messages += 1
+                if msg_type == UPDATE:
+                    now = time.time()
+                    if self.first is None:
+                        self.first = now
+                    self.last = now
+                    self.updates += 1
+                    self.bytes += HEADER_LEN + len(body)
+                    if self.recorder:
+                        self.recorder(body)
+        except socket.error:
+            return
+        finally:
+            sock.close()
+
+    def rate(self):
+        """Return the UPDATE messages/sec received so far."""
+        if not self.first or self.last == self.first:
+            return 0.0
+        return (self.updates - 1) / (self.last - self.first)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a stand-in BGP peer and report the UPDATE rate received')
+    parser.add_argument('--listen', default='127.0.0.1:9179', help='address:port to listen on')
+    parser.add_argument('--asn', type=int, default=65000)
+    args = parser.parse_args()
+    host, port = args.listen.rsplit(':', 1)
+    peer = StandInPeer(host, int(port), args.asn)
+    peer.start()
+    print('listening on %s:%d' % peer.address)
+    try:
+        while True:
+            updates = peer.updates
+            time.sleep(1)
+            print('%d updates/sec, %d total, %d bytes' % (peer.updates - updates, peer.updates, peer.bytes))
+    except KeyboardInterrupt:
+        peer.stop()
+
+
+if __name__ == '__main__':
+    main()
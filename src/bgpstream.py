@@ -1,77 +1,260 @@
 #!/usr/bin/env python
-import os, sys, time
-from datetime import datetime
-import yaml
-from _pybgpstream import BGPStream, BGPRecord, BGPElem
+"""Read BGP updates from a CAIDA BGPStream, live from a collector or from a local MRT file.
+
+BGPStream runs in a background thread of the reader. Each record is decoded into updates,
+one for every peer and attribute set found in its elems plus one per peer for the
+withdrawals, and the updates of several records are handed to the reader in batches
+through a bounded queue. Collector latency spikes then drain the queue instead of stalling
+the sender, and a reader which falls behind stops the thread pulling records.
+
+python bgpstream.py --mrt_file updates.mrt reads a local file through the singlefile data
+interface, to check the reader offline.
+"""
+import sys
+import time
+import queue
+import argparse
+import threading
+
+from bgpprefix import parse_prefix
+
+DONE = None
+
+
+class _Failure(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _as_path(text):
+    """Flatten the AS path text of an elem ('1 2 {3,4}') into a list of ASNs."""
+    as_path = []
+    for segment in text.replace('{', ' ').replace('}', ' ').replace(',', ' ').split():
+        try:
+            as_path.append(int(segment))
+        except ValueError:
+            # asdot notation
+            high, _, low = segment.partition('.')
+            as_path.append((int(high) << 16) + int(low or 0))
+    return as_path
+
+
+def _communities(communities):
+    """Communities as 32-bit integers, from {'asn', 'value'} dicts or 'asn:value' text."""
+    values = []
+    for community in communities or ():
+        if isinstance(community, dict):
+            asn, value = community['asn'], community['value']
+        else:
+            asn, _, value = str(community).partition(':')
+        values.append((int(asn) << 16) + int(value))
+    return values
+
+
+def decode_record(timestamp, elems):
+    """Group the elems of a record into (timestamp, attr, nlri, withdraw) updates, one per peer
+    and attribute set and one per peer withdrawing prefixes, in the order first seen."""
+    groups = {}
+    order = []
+    for elem in elems:
+        fields = elem.fields
+        peer = (elem.peer_address, elem.peer_asn)
+        if elem.type in ('A', 'R'):
+            as_path = fields.get('as-path') or ''
+            nexthop = fields.get('next-hop')
+            communities = _communities(fields.get('communities'))
+            key = (peer, as_path, nexthop, tuple(communities))
+            group = groups.get(key)
+            if group is None:
+                attr = {'as_path': _as_path(as_path), 'nexthop': nexthop}
+                if communities:
+                    attr['community'] = communities
+                group = groups[key] = (timestamp, attr, [], [])
+                order.append(group)
+            group[2].append(parse_prefix(fields['prefix']))
+        elif elem.type == 'W':
+            key = (peer, None)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (timestamp, {}, [], [])
+                order.append(group)
+            group[3].append(parse_prefix(fields['prefix']))
+    return order
+
+
+def _elems(rec):
+    elem = rec.get_next_elem()
+    while elem:
+        yield elem
+        elem = rec.get_next_elem()
 
-stream = BGPStream()
 
 class BGPStreamReader(object):
+    """Iterate over the updates of a BGPStream as (timestamp, attr, nlri, withdraw) tuples.
+    Up to queue_size batches of batch_size updates are read ahead. A timer thread also hands
+    a batch over once its first update has waited max_delay seconds, as the reading thread
+    may be blocked in BGPStream waiting for the next record of a quiet live feed; both hand
+    batches over under one lock, which keeps them in order."""
     defaults = {
         'mrt_file': None,
         'collector': 'rrc00',
-        'record_type': 'update',
-        'from_date': int(time.time())i - 3600*24*7, # back up a week
+        'record_type': 'updates',
+        'from_date': None,  # a week back
         'until_date': 0,
         'prefix_filter': None,
         'peer_as_filter': None,
         'communities_filter': None,
+        'batch_size': 256,
+        'queue_size': 64,
+        'max_delay': 0.1,
     }
 
-    def __init__(self, config={}):
-        self.config = config
+    def __init__(self, config=None):
+        self.config = dict(config or {})
         for k, v in self.defaults.items():
             self.config.setdefault(k, v)
-        if self.config['mrt_file'] is None:
-            stream.add_filter('collector', self.config['collector'])
-            stream.add_filter('record-type', self.config['record_type'])
-            stream.add_interval_filter(self.config['from_date'], self.config['until_date'])
-            stream.set_live_mode()
+        if self.config['from_date'] is None:
+            self.config['from_date'] = int(time.time()) - 3600 * 24 * 7
+        self.queue = queue.Queue(self.config['queue_size'])
+        self.stopped = threading.Event()
+        self.batch = iter(())
+        self.lock = threading.Lock()
+        self.pending = []
+        self.started = None
+        self.finished = threading.Event()
+        self.done = False
+        self.records = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _stream(self):
+        from _pybgpstream import BGPStream
+        config = self.config
+        stream = BGPStream()
+        if config['mrt_file'] is None:
+            stream.add_filter('collector', config['collector'])
+            stream.add_filter('record-type', config['record_type'])
+            stream.add_interval_filter(int(config['from_date']), int(config['until_date']))
+            if not config['until_date']:
+                stream.set_live_mode()
         else:
             stream.set_data_interface('singlefile')
-            stream.set_data_interface_option('singlefile', 'upd-file', self.config['mrt_file'])
-        if self.config['prefix_filter']:
-            for prefix in self.config['prefix_filter']:
-                stream.add_filter('prefix', prefix)
-        if self.config['peer_as_filter']:
-            for asn in self.config['peer_as_filter']:
-                stream.add_filter('peer-asn', str(asn))
-        if self.config['communities_filter']:
-            for community in self.config['communities_filter']:
-                stream.add_filter('community', community)
+            option = 'rib-file' if config['record_type'] == 'ribs' else 'upd-file'
+            stream.set_data_interface_option('singlefile', option, config['mrt_file'])
+        for prefix in config['prefix_filter'] or ():
+            stream.add_filter('prefix', prefix)
+        for asn in config['peer_as_filter'] or ():
+            stream.add_filter('peer-asn', str(asn))
+        for community in config['communities_filter'] or ():
+            stream.add_filter('community', community)
         stream.start()
-        print('BGPSteamReader has started')
+        return stream
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _hand_over(self):
+        """Queue the pending updates, with self.lock held."""
+        batch = self.pending
+        self.pending = []
+        return not batch or self._put(batch)
+
+    def _flush_idle(self):
+        max_delay = self.config['max_delay']
+        while not self.finished.wait(max_delay / 2) and not self.stopped.is_set():
+            with self.lock:
+                if self.pending and time.monotonic() - self.started >= max_delay:
+                    if not self._hand_over():
+                        return
+
+    def _run(self):
+        from _pybgpstream import BGPRecord
+        batch_size = self.config['batch_size']
+        flusher = threading.Thread(target=self._flush_idle)
+        flusher.daemon = True
+        flusher.start()
+        try:
+            stream = self._stream()
+            rec = BGPRecord()
+            while not self.stopped.is_set() and stream.get_next_record(rec):
+                self.records += 1
+                if rec.status != 'valid':
+                    continue
+                updates = decode_record(rec.time, _elems(rec))
+                if not updates:
+                    continue
+                with self.lock:
+                    if not self.pending:
+                        self.started = time.monotonic()
+                    self.pending.extend(updates)
+                    if len(self.pending) >= batch_size and not self._hand_over():
+                        return
+            end = DONE
+        except Exception:
+            end = _Failure(sys.exc_info())
+        finally:
+            self.finished.set()
+        with self.lock:
+            if self._hand_over():
+                self._put(end)
 
     def __iter__(self):
         return self
 
     def next(self):
-        rec = BGPRecord()
-        print('get next rec')
-        if stream.get_next_record(rec):
-            if rec.status == 'valid':
-                elem = rec.get_next_elem()
-                timestamp = rec.time
-                nlri = []
-                withdraw = []
-                attr = {}
-                while(elem):
-                    peer_address = elem.peer_address
-                    peer_asn = elem.peer_asn
-                    if elem.type == 'A' or elem.type == 'R':
-                        nlri.append(elem.fields['prefix'])
-                        attr['as_path'] = elem.fields['as-path']
-                        attr['nexthop'] = elem.fields['next-hop']
-                        attr['community'] = elem.fields['communities']
-                    elif elem.type == 'W':
-                        withdraw.append(elem.fields['prefix'])
-                    elem = rec.get_next_elem()
-                return (timestamp, attr, nlri, withdraw)
-            else:
-                return self.next(rec)
-        else:
-            StopIteration
+        while True:
+            update = next(self.batch, None)
+            if update is not None:
+                return update
+            if self.done:
+                raise StopIteration
+            batch = self.queue.get()
+            if batch is DONE:
+                self.done = True
+                raise StopIteration
+            if isinstance(batch, _Failure):
+                self.done = True
+                raise batch.exc_info[1].with_traceback(batch.exc_info[2])
+            self.batch = iter(batch)
+    __next__ = next
+
+    def close(self):
+        """Stop reading records; the thread ends at the next record or full queue."""
+        self.stopped.set()
+        self.done = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read updates from BGPStream and report their rate')
+    parser.add_argument('--collector', default='rrc00', help='collector to read live from')
+    parser.add_argument('--mrt_file', help='read this MRT file through the singlefile interface instead')
+    parser.add_argument('--record_type', default='updates', choices=['updates', 'ribs'])
+    parser.add_argument('--count', type=int, default=0, help='stop after this many updates')
+    parser.add_argument('--show', action='store_true', help='print every update')
+    args = parser.parse_args()
+    reader = BGPStreamReader({'collector': args.collector, 'mrt_file': args.mrt_file,
+                              'record_type': args.record_type})
+    start = time.time()
+    count = prefixes = 0
+    for timestamp, attr, nlri, withdraw in reader:
+        count += 1
+        prefixes += len(nlri) + len(withdraw)
+        if args.show:
+            print(timestamp, attr, [str(p) for p in nlri], [str(p) for p in withdraw])
+        if args.count and count >= args.count:
+            reader.close()
+            break
+    elapsed = time.time() - start
+    print('%d records, %d updates, %d prefixes in %.2fs (%.0f updates/sec)' % (
+        reader.records, count, prefixes, elapsed, count / elapsed if elapsed else 0))
+
 
-if __name__=='__main__':
-    stream = BGPStreamGenerator("")
-    stream.run()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Read compressed MRT files in large blocks, decompressed ahead in a background thread.
+
+bz2 and gzip files are decompressed by the fastest decompressor available: the
+indexed_bzip2 module (parallel bz2), else a parallel command line tool (lbzip2, pbzip2,
+pigz) writing to a pipe, else a zlib or bz2 decompressor fed in chunks. Unlike the bz2 and
+gzip file objects, which drop everything decoded in a read() that hits the end of a truncated
+file, the chunked decompressor hands on the output decoded up to the break before reporting
+it. A thread reads the output in blocks
+of `block_size` and hands them over through a bounded queue, so decompression overlaps with
+parsing while at most `prefetch` blocks are held, whatever the size of the file.
+"""
+import os
+import bz2
+import zlib
+import queue
+import shutil
+import threading
+import subprocess
+
+BLOCK_SIZE = 1 << 20
+PREFETCH = 4
+CHUNK_SIZE = 1 << 16
+# parallel decompressors writing the decompressed file to stdout, by compression
+TOOLS = {
+    'bz2': (['lbzip2', '-dc'], ['pbzip2', '-dc']),
+    'gz': (['pigz', '-dc'],),
+}
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class _ToolStream(object):
+    """The stdout of a decompressor process, read like a file."""
+    def __init__(self, command, filename):
+        self.proc = subprocess.Popen(command + [filename], stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        self.name = command[0]
+
+    def read(self, size):
+        data = self.proc.stdout.read(size)
+        if not data and self.proc.wait() != 0:
+            raise IOError('%s failed: %s' % (self.name, self.proc.stderr.read().decode('utf-8', 'replace').strip()))
+        return data
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+
+
+class _ChunkedStream(object):
+    """A bz2 or gz file decompressed a chunk at a time, read like a file. Concatenated
+    streams are read one after the other. The data before a truncation is returned first,
+    the next read raises EOFError."""
+    def __init__(self, filename, compression):
+        self.f = open(filename, 'rb')
+        if compression == 'bz2':
+            self.new = bz2.BZ2Decompressor
+        else:
+            self.new = lambda: zlib.decompressobj(wbits=31)
+        self.zlib = compression != 'bz2'
+        self.d = self.new()
+        self.fed = False
+        self.input = b''
+
+    def _decompress(self, size):
+        """Return the next decompressed data (at most size bytes), None when the file ends."""
+        while True:
+            d = self.d
+            if self.zlib:
+                data = d.unconsumed_tail
+                needs_input = not data
+            else:
+                data = b''
+                needs_input = d.needs_input
+            if needs_input:
+                if not self.input:
+                    self.input = self.f.read(CHUNK_SIZE)
+                    if not self.input:
+                        return None
+                data, self.input = self.input, b''
+                self.fed = True
+            out = d.decompress(data, size)
+            if d.eof:
+                # the rest belongs to the next stream
+                self.input = d.unused_data + self.input
+                self.d = self.new()
+                self.fed = False
+            if out:
+                return out
+
+    def read(self, size):
+        out = []
+        left = size
+        while left > 0:
+            data = self._decompress(left)
+            if data is None:
+                break
+            out.append(data)
+            left -= len(data)
+        if not out and self.fed:
+            raise EOFError('compressed file ended before the end-of-stream marker was reached')
+        return b''.join(out)
+
+    def close(self):
+        self.f.close()
+
+
+def open_decompressed(filename, compression, parallel=True):
+    """Return a file object reading the decompressed content of a bz2 or gz file."""
+    if parallel:
+        if compression == 'bz2':
+            try:
+                import indexed_bzip2
+                return indexed_bzip2.open(filename, parallelization=os.cpu_count() or 1)
+            except ImportError:
+                pass
+        for command in TOOLS.get(compression, ()):
+            if shutil.which(command[0]):
+                return _ToolStream(command, filename)
+    return _ChunkedStream(filename, compression)
+
+
+class BlockReader(object):
+    """Iterate over the blocks of a file object, read ahead by a background thread. A read
+    error (a truncated or corrupt compressed stream) ends the blocks and is kept in `error`."""
+    def __init__(self, f, block_size=BLOCK_SIZE, prefetch=PREFETCH):
+        self.f = f
+        self.block_size = block_size
+        self.queue = queue.Queue(prefetch)
+        self.stopped = threading.Event()
+        self.error = None
+        self.bytes = 0
+        self.buf = b''
+        self.pos = 0
+        self.eof = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        read = self.f.read
+        size = self.block_size
+        try:
+            while not self.stopped.is_set():
+                block = read(size)
+                if not block:
+                    break
+                if not self._put(block):
+                    return
+        except (IOError, OSError, EOFError, ValueError, zlib.error) as e:
+            self._put(_Failure('%s: %s' % (type(e).__name__, e)))
+            return
+        self._put(None)
+
+    def _next_block(self):
+        """Return the next block, None at the end."""
+        if self.eof:
+            return None
+        block = self.queue.get()
+        if isinstance(block, _Failure):
+            self.error = block.error
+            block = None
+        if block is None:
+            self.eof = True
+            return None
+        self.bytes += len(block)
+        return block
+
+    def __iter__(self):
+        while True:
+            block = self._next_block()
+            if block is None:
+                return
+            yield block
+
+    def read(self, size):
+        """Read like a file, from a buffer refilled a block at a time."""
+        while len(self.buf) - self.pos < size:
+            block = self._next_block()
+            if block is None:
+                break
+            self.buf = self.buf[self.pos:] + block
+            self.pos = 0
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.f.close()
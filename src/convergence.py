@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""Measure how fast a router under test propagates the updates sent to it.
+
+The generator, run with --convergence_log sent.log, logs every prefix it announces or
+withdraws with the time it handed the update to the agent. A monitor, a passive BGP peer of
+the router, logs every prefix the router announces or withdraws to it with the time it
+arrived. report joins the two logs: each sent event is matched with the first event for the
+same prefix and action received after it (and before the prefix is sent again), giving the
+propagation latency of every prefix, the prefixes that never came through and the send and
+receive rates over time.
+
+Times come from the monotonic clock, so the generator and the monitor must run on the same
+host. A log is a header followed by fixed size events: float64 time, action (1: announce,
+2: withdraw), the address family and the prefix in NLRI wire format, zero padded. Events
+are packed into a preallocated buffer written out whenever it is full, which keeps logging
+cheap enough to run at full rate.
+
+python convergence.py monitor --listen 0.0.0.0:179 --asn 65001 --output received.log
+python convergence.py report --sent sent.log --received received.log
+"""
+import sys
+import json
+import time
+import signal
+import struct
+import bisect
+import argparse
+import threading
+from array import array
+
+from bgpprefix import PREFIX_TYPES
+
+MAGIC = b'BGPL'
+VERSION = 1
+HEADER = struct.Struct('<4sBxxx')
+EVENT = struct.Struct('<dBB17s')
+ANNOUNCE = 1
+WITHDRAW = 2
+ACTIONS = {ANNOUNCE: 'announce', WITHDRAW: 'withdraw'}
+QUANTILES = (50, 90, 99, 99.9)
+
+
+class EventLog(object):
+    """Append (time, action, prefix) events to a log file through a buffer of `capacity`
+    events. log() is called by one thread at a time."""
+    def __init__(self, filename, capacity=1 << 16):
+        self.f = open(filename, 'wb')
+        self.f.write(HEADER.pack(MAGIC, VERSION))
+        self.capacity = capacity
+        self.buf = bytearray(capacity * EVENT.size)
+        self.pos = 0
+        self.count = 0
+        self.end = len(self.buf)
+
+    def add(self, now, action, prefixes):
+        pack_into = EVENT.pack_into
+        buf = self.buf
+        for prefix in prefixes:
+            if self.pos == self.end:
+                self.flush()
+            pack_into(buf, self.pos, now, action, prefix.afi, prefix)
+            self.pos += EVENT.size
+        self.count += len(prefixes)
+
+    def log(self, update):
+        """Log the prefixes of an update as sent now."""
+        now = time.monotonic()
+        if update.get('withdraw'):
+            self.add(now, WITHDRAW, update['withdraw'])
+        if update.get('nlri'):
+            self.add(now, ANNOUNCE, update['nlri'])
+
+    def flush(self):
+        self.f.write(memoryview(self.buf)[:self.pos])
+        self.pos = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_events(filename):
+    """Yield the (time, action, prefix) events of a log."""
+    types = PREFIX_TYPES
+    with open(filename, 'rb') as f:
+        magic, version = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a convergence log' % filename)
+        size = EVENT.size
+        while True:
+            block = f.read(size * 4096)
+            for now, action, afi, prefix in EVENT.iter_unpack(block[:len(block) - len(block) % size]):
+                yield now, action, types[afi](prefix[:1 + (prefix[0] + 7) // 8])
+            if len(block) < size * 4096:
+                return
+
+
+class Monitor(object):
+    """A passive BGP peer of the router under test, logging the prefixes of every UPDATE it
+    receives."""
+    def __init__(self, output, host='0.0.0.0', port=179, asn=65000, router_id='127.0.0.2'):
+        from bgpspeaker import StandInPeer
+        self.log = EventLog(output)
+        self.lock = threading.Lock()
+        self.peer = StandInPeer(host, port, asn, router_id)
+        self.peer.recorder = self.record
+
+    def record(self, body):
+        from pybgpdump import MRTRecord
+        now = time.monotonic()
+        update = MRTRecord(now, 0, 0, True, body)
+        withdraw, nlri = update.withdraw, update.nlri
+        with self.lock:
+            if withdraw:
+                self.log.add(now, WITHDRAW, withdraw)
+            if nlri:
+                self.log.add(now, ANNOUNCE, nlri)
+
+    def start(self):
+        self.peer.start()
+
+    def flush(self):
+        with self.lock:
+            self.log.flush()
+
+    def stop(self):
+        self.peer.stop()
+        with self.lock:
+            self.log.close()
+
+
+def _percentile(values, p):
+    """The p-th percentile of sorted values (nearest rank)."""
+    if not values:
+        return 0.0
+    rank = max(1, int(len(values) * p / 100.0 + 0.999999))
+    return values[min(rank, len(values)) - 1]
+
+
+def _events_by_key(filenames):
+    events = {}
+    first = None
+    for filename in filenames:
+        for now, action, prefix in read_events(filename):
+            events.setdefault((action, prefix), array('d')).append(now)
+            if first is None or now < first:
+                first = now
+    for times in events.values():
+        times[:] = array('d', sorted(times))
+    return events, first
+
+
+def _curve(times, start, interval):
+    counts = {}
+    for now in times:
+        slot = int((now - start) // interval)
+        counts[slot] = counts.get(slot, 0) + 1
+    return counts
+
+
+def report(sent_files, received_files, interval=1.0):
+    """Join sent and received logs, return a dict of the results."""
+    sent, sent_start = _events_by_key(sent_files)
+    received, received_start = _events_by_key(received_files)
+    latencies = dict((action, []) for action in ACTIONS)
+    unmatched = dict((action, 0) for action in ACTIONS)
+    used = 0
+    for key, send_times in sent.items():
+        action = key[0]
+        recv_times = received.get(key)
+        if recv_times is None:
+            unmatched[action] += len(send_times)
+            continue
+        for i, sent_at in enumerate(send_times):
+            # the first event received after this send and before the next send of the prefix
+            j = bisect.bisect_left(recv_times, sent_at)
+            limit = send_times[i + 1] if i + 1 < len(send_times) else float('inf')
+            if j < len(recv_times) and recv_times[j] < limit:
+                latencies[action].append(recv_times[j] - sent_at)
+                used += 1
+            else:
+                unmatched[action] += 1
+    total_received = sum(len(times) for times in received.values())
+    start = min(t for t in (sent_start, received_start) if t is not None) if sent or received else 0.0
+    sent_curve = _curve((t for times in sent.values() for t in times), start, interval)
+    recv_curve = _curve((t for times in received.values() for t in times), start, interval)
+    slots = range(max(list(sent_curve) + list(recv_curve) + [-1]) + 1)
+    results = {
+        'sent': sum(len(times) for times in sent.values()),
+        'received': total_received,
+        'unsolicited': total_received - used,
+        'interval': interval,
+        'curve': [{'time': slot * interval, 'sent': sent_curve.get(slot, 0) / interval,
+                   'received': recv_curve.get(slot, 0) / interval} for slot in slots],
+    }
+    everything = []
+    for action, name in ACTIONS.items():
+        values = sorted(latencies[action])
+        everything.extend(values)
+        results[name] = _latency_stats(values, unmatched[action])
+    results['all'] = _latency_stats(sorted(everything), sum(unmatched.values()))
+    return results
+
+
+def _latency_stats(values, unmatched):
+    stats = {'matched': len(values), 'unmatched': unmatched}
+    if values:
+        for q in QUANTILES:
+            stats['p%g' % q] = _percentile(values, q)
+        stats['mean'] = sum(values) / len(values)
+        stats['max'] = values[-1]
+    return stats
+
+
+def summary(results):
+    lines = ['%d prefix events sent, %d received (%d not matching any sent)' % (
+        results['sent'], results['received'], results['unsolicited'])]
+    for name in ('announce', 'withdraw', 'all'):
+        stats = results[name]
+        text = '%-9s %8d matched %8d lost' % (name, stats['matched'], stats['unmatched'])
+        if stats['matched']:
+            text += '  ' + ' '.join('p%g %.2fms' % (q, stats['p%g' % q] * 1000) for q in QUANTILES)
+            text += ' max %.2fms' % (stats['max'] * 1000)
+        lines.append(text)
+    lines.append('%8s %12s %12s' % ('time', 'sent/s', 'received/s'))
+    for point in results['curve']:
+        lines.append('%8.1f %12.0f %12.0f' % (point['time'], point['sent'], point['received']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the propagation of updates through a router')
+    commands = parser.add_subparsers(dest='command')
+    monitor = commands.add_parser('monitor', help='peer with the router and log what it advertises')
+    monitor.add_argument('--listen', default='0.0.0.0:179', help='address:port to listen on')
+    monitor.add_argument('--asn', type=int, default=65000)
+    monitor.add_argument('--router_id', default='127.0.0.2')
+    monitor.add_argument('--output', required=True, help='log of the prefixes received')
+    report_parser = commands.add_parser('report', help='join the logs of the generator and the monitor')
+    report_parser.add_argument('--sent', required=True, action='append',
+                               help='log written by --convergence_log')
+    report_parser.add_argument('--received', required=True, action='append', help='log written by the monitor')
+    report_parser.add_argument('--interval', type=float, default=1.0, help='seconds per point of the rate curve')
+    report_parser.add_argument('--json', help='file to save the results to')
+    args = parser.parse_args()
+    if args.command == 'monitor':
+        host, port = args.listen.rsplit(':', 1)
+        monitor = Monitor(args.output, host, int(port), args.asn, args.router_id)
+        monitor.start()
+        print('listening on %s:%d' % monitor.peer.address)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                count = monitor.log.count
+                time.sleep(1)
+                monitor.flush()
+                print('%d prefixes/sec, %d total' % (monitor.log.count - count, monitor.log.count))
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            monitor.stop()
+    elif args.command == 'report':
+        results = report(args.sent, args.received, args.interval)
+        print(summary(results))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
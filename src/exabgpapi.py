@@ -0,0 +1,153 @@
+"""Talk to ExaBGP through its API named pipes.
+
+ExaBGP reads API commands from <pipename>.in and, with exabgp.api.ack enabled, answers every
+command with a `done` or `error` line on <pipename>.out. Statements are written in batches,
+one write per batch, and at most `max_inflight` of them may be waiting for their answer:
+beyond that the writer waits, which pushes back on the generator instead of letting ExaBGP's
+backlog grow without bound.
+"""
+import os
+import time
+import errno
+import fcntl
+import threading
+
+PIPENAME = 'exabgp'
+
+
+def make_pipes(directory, pipename=PIPENAME):
+    """Create the API named pipes in directory, return (in path, out path)."""
+    paths = (os.path.join(directory, pipename + '.in'), os.path.join(directory, pipename + '.out'))
+    for path in paths:
+        if not os.path.exists(path):
+            os.mkfifo(path, 0o600)
+    return paths
+
+
+class ExaBGPPipe(object):
+    """The writing end of ExaBGP's command pipe and the reader of its answers."""
+    def __init__(self, in_path, out_path, max_inflight=10000, ack=True):
+        self.in_path = in_path
+        self.out_path = out_path
+        self.max_inflight = max_inflight
+        self.ack = ack
+        self.fd = None
+        self.lock = threading.Condition()
+        self.sent = 0
+        self.writes = 0
+        self.done = 0
+        self.errors = 0
+        self.max_backlog = 0
+        self.closed = False
+        self.reader = None
+        # lines of text answering a query, collected while one is running
+        self.text = None
+
+    def open(self, timeout=30):
+        """Wait for ExaBGP to open its end of the command pipe, return False on timeout."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                # a FIFO can only be opened for writing without blocking once it has a reader
+                self.fd = os.open(self.in_path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO or time.time() >= deadline:
+                    return False
+                time.sleep(0.1)
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        if self.ack:
+            self.reader = threading.Thread(target=self._read_answers)
+            self.reader.daemon = True
+            self.reader.start()
+        return True
+
+    def _read_answers(self):
+        with open(self.out_path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                with self.lock:
+                    if line == b'done':
+                        self.done += 1
+                    elif line == b'error':
+                        self.errors += 1
+                    else:
+                        if self.text is not None:
+                            self.text.append(line.decode('utf-8', 'replace'))
+                        continue
+                    self.lock.notify_all()
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def backlog(self):
+        """Number of statements ExaBGP has not answered yet."""
+        return self.sent - self.done - self.errors if self.ack else 0
+
+    def send(self, payloads):
+        """Write payloads (text of one or more newline separated statements each) in one go,
+        once ExaBGP's backlog leaves room for them."""
+        data = ''.join(payloads).encode('ascii')
+        count = data.count(b'\n')
+        if self.ack:
+            with self.lock:
+                while (not self.closed and self.backlog() > 0
+                       and self.backlog() + count > self.max_inflight):
+                    self.lock.wait(1.0)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+        with self.lock:
+            self.sent += count
+            self.writes += 1
+            self.max_backlog = max(self.max_backlog, self.backlog())
+
+    def query(self, command, timeout=5):
+        """Send a command answered with text (show ...) and return the lines of its answer, or
+        None when ExaBGP answered error or did not answer within timeout. Updates must not be
+        sent meanwhile."""
+        if not self.ack:
+            return None
+        with self.lock:
+            self.text = []
+            answered = self.done + self.errors
+            errors = self.errors
+        self.send([command + '\n'])
+        deadline = time.time() + timeout
+        with self.lock:
+            while not self.closed and self.done + self.errors <= answered and time.time() < deadline:
+                self.lock.wait(max(0.0, deadline - time.time()))
+            lines, self.text = self.text, None
+            if self.done + self.errors <= answered or self.errors > errors:
+                return None
+            return lines
+
+    def drain(self, timeout=10):
+        """Wait until every statement sent has been answered."""
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.ack and not self.closed and self.backlog() > 0 and time.time() < deadline:
+                self.lock.wait(max(0.0, deadline - time.time()))
+        return self.backlog() == 0
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'writes': self.writes,
+            'done': self.done,
+            'errors': self.errors,
+            'backlog': self.backlog(),
+            'max_backlog': self.max_backlog,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return ('exabgp: %d statements in %d writes, %d done, %d errors, backlog %d (max %d)' % (
+            stats['sent'], stats['writes'], stats['done'], stats['errors'], stats['backlog'],
+            stats['max_backlog']))
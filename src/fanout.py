@@ -0,0 +1,166 @@
+"""Fan updates out to many peers.
+
+An update is encoded once by the agent and the encoded payload is put on a bounded queue per
+peer. Each queue is serviced by its own worker thread, so a slow peer only delays itself until
+its queue fills up; then the producer either waits for it (block) or the peer misses the
+update (drop). A peer whose send fails (its session was reset) is marked failed: what is
+queued for it is discarded and it takes no more updates, so it cannot stall the others.
+"""
+import time
+import queue
+import asyncio
+import threading
+
+from latency import Histogram
+
+POLICIES = ('block', 'drop')
+
+
+class Channel(object):
+    """The queue and worker of one peer. send(payloads) is called from the worker thread with
+    every payload waiting, in order. An exception raised by send fails the channel: `error`
+    keeps it, the payloads not sent are counted in `lost` and put() no longer queues."""
+    max_batch = 256
+
+    def __init__(self, name, send, maxsize=1024, policy='block'):
+        self.name = name
+        self.send = send
+        self.policy = policy
+        self.queue = queue.Queue(maxsize)
+        self.sent = 0
+        self.dropped = 0
+        self.lost = 0
+        self.error = None
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.latency = Histogram('%s queue' % name)
+        self.first = None
+        self.last = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, payload, block=True):
+        """Queue payload, return False if the queue is full or the channel failed and it was
+        not queued."""
+        if self.error is not None:
+            self.dropped += 1
+            return False
+        item = (time.monotonic(), payload)
+        if self.policy == 'drop' or not block:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                if self.policy == 'drop':
+                    self.dropped += 1
+                return False
+            return True
+        self.queue.put(item)
+        return True
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            while items[-1] is not None and len(items) < self.max_batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = items[-1] is None
+            if done:
+                items.pop()
+            if items and self.error is not None:
+                self.lost += len(items)
+            elif items:
+                try:
+                    self.send([payload for _, payload in items])
+                except Exception as e:
+                    self.error = '%s: %s' % (type(e).__name__, e)
+                    self.lost += len(items)
+                    if done:
+                        return
+                    continue
+                now = time.monotonic()
+                if self.first is None:
+                    self.first = now
+                self.last = now
+                latency = self.latency
+                for queued, _ in items:
+                    self.lag = now - queued
+                    self.total_lag += self.lag
+                    self.max_lag = max(self.max_lag, self.lag)
+                    latency.add(self.lag)
+                self.sent += len(items)
+            if done:
+                return
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        elapsed = (self.last - self.first) if self.first is not None else 0.0
+        return {
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'lost': self.lost,
+            'queued': self.queue.qsize(),
+            'rate': self.sent / elapsed if elapsed else 0.0,
+            'lag': self.lag,
+            'avg_lag': self.total_lag / self.sent if self.sent else 0.0,
+            'max_lag': self.max_lag,
+        }
+
+
+class FanOut(object):
+    """A set of per-peer channels."""
+    def __init__(self, maxsize=1024, policy='block'):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.channels = []
+
+    def add(self, name, send):
+        channel = Channel(name, send, self.maxsize, self.policy)
+        self.channels.append(channel)
+        return channel
+
+    def publish(self, payload, channels):
+        for channel in channels:
+            channel.put(payload)
+
+    async def publish_async(self, payload, channels):
+        """Queue payload on channels, waiting without blocking the event loop for full queues."""
+        for channel in channels:
+            while (not channel.put(payload, block=False) and channel.policy == 'block'
+                   and channel.error is None):
+                await asyncio.sleep(0.001)
+
+    def close(self):
+        """Wait for the channels to send what is queued and stop their workers."""
+        for channel in self.channels:
+            if channel.thread.is_alive():
+                channel.close()
+
+    def samples(self):
+        """Metrics samples of every channel, labelled with the peer."""
+        from metrics import histogram_samples
+        samples = []
+        for channel in self.channels:
+            labels = {'peer': channel.name}
+            samples.append(('peer_queue_depth', labels, channel.queue.qsize()))
+            samples.append(('peer_sent', labels, channel.sent))
+            samples.append(('peer_dropped', labels, channel.dropped))
+            samples.append(('peer_lost', labels, channel.lost))
+            samples.append(('peer_failed', labels, int(channel.error is not None)))
+            samples.extend(histogram_samples('peer_send_seconds', channel.latency, labels))
+        return samples
+
+    def report(self):
+        for channel in self.channels:
+            stats = channel.stats()
+            print('peer %s: sent %d, dropped %d, queued %d, %.1f/s, lag avg %.2fms max %.2fms' % (
+                channel.name, stats['sent'], stats['dropped'], stats['queued'], stats['rate'],
+                stats['avg_lag'] * 1000, stats['max_lag'] * 1000))
+            if channel.error:
+                print('  failed: %s, %d updates lost' % (channel.error, channel.lost))
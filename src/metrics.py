@@ -0,0 +1,284 @@
+"""Metrics of a run: counters, gauges and timings, exported as JSON lines and Prometheus text.
+
+Counters are plain integers bumped by the loop owning them and timings are sampled, one call
+in SAMPLE_EVERY, so instrumenting the per-update paths costs little. Everything else (queue
+depths, agent statistics, RSS) is read by collectors only when the metrics are exported.
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+from latency import Histogram
+
+SAMPLE_EVERY = 16
+QUANTILES = (50, 90, 99)
+
+
+def rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        # peak rather than current, in KiB on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def histogram_samples(name, histogram, labels=None):
+    """Samples of a latency histogram: count, sum and quantiles in seconds."""
+    labels = labels or {}
+    samples = [(name + '_count', labels, histogram.count), (name + '_sum', labels, histogram.total)]
+    for q in QUANTILES:
+        quantile = dict(labels, quantile='%g' % (q / 100.0))
+        samples.append((name, quantile, histogram.percentile(q)))
+    return samples
+
+
+class Counter(object):
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self):
+        return [(self.name, {}, self.value)]
+
+
+class Timing(object):
+    """Durations in seconds, usually a sample of them."""
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self.histogram = Histogram(name)
+
+    def add(self, seconds):
+        self.histogram.add(seconds)
+
+    def samples(self):
+        return histogram_samples(self.name, self.histogram)
+
+
+class Gauge(object):
+    """A value read from fn() when exported."""
+    def __init__(self, name, fn, help=''):
+        self.name = name
+        self.fn = fn
+        self.help = help
+
+    def samples(self):
+        return [(self.name, {}, self.fn())]
+
+
+class Registry(object):
+    """The metrics of a run. Collectors are functions returning a list of
+    (name, labels, value) samples."""
+    def __init__(self, prefix='bgpgen_'):
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors = []
+        self.start = time.time()
+        self.last = None
+
+    def counter(self, name, help=''):
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def timing(self, name, help=''):
+        metric = Timing(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, fn, help=''):
+        metric = Gauge(name, fn, help)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn):
+        self.collectors.append(fn)
+
+    def samples(self):
+        samples = []
+        for metric in self.metrics:
+            samples.extend(metric.samples())
+        for collector in self.collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                samples.append(('collector_errors', {'error': type(e).__name__}, 1))
+        return samples
+
+    def snapshot(self):
+        """Return the metrics as a dict, with the rate of each counter since the last
+        snapshot."""
+        now = time.time()
+        snapshot = {'time': now, 'uptime': now - self.start}
+        for name, labels, value in self.samples():
+            if labels:
+                key = ','.join('%s=%s' % item for item in sorted(labels.items()))
+                snapshot.setdefault(name, {})[key] = value
+            else:
+                snapshot[name] = value
+        last = self.last
+        for metric in self.metrics:
+            if isinstance(metric, Counter) and last is not None:
+                elapsed = now - last['time']
+                previous = last.get(metric.name, 0)
+                snapshot[metric.name + '_rate'] = (metric.value - previous) / elapsed if elapsed else 0.0
+        self.last = snapshot
+        return snapshot
+
+    def json_line(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        helps = dict((metric.name, metric.help) for metric in self.metrics if metric.help)
+        kinds = dict((metric.name, 'counter' if isinstance(metric, Counter) else
+                      'summary' if isinstance(metric, Timing) else 'gauge') for metric in self.metrics)
+        # the samples of a metric must be contiguous, collectors give them peer by peer
+        families = {}
+        for name, labels, value in self.samples():
+            base = name
+            for suffix in ('_count', '_sum'):
+                stem = name[:-len(suffix)]
+                if name.endswith(suffix) and (kinds.get(stem) == 'summary' or stem.endswith('_seconds')):
+                    base = stem
+            if labels:
+                label_text = ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                                      for k, v in sorted(labels.items()))
+                line = '%s%s{%s} %s' % (self.prefix, name, label_text, _number(value))
+            else:
+                line = '%s%s %s' % (self.prefix, name, _number(value))
+            families.setdefault(base, []).append(line)
+        lines = []
+        for base, family in families.items():
+            if base in helps:
+                lines.append('# HELP %s%s %s' % (self.prefix, base, helps[base]))
+            kind = kinds.get(base, 'summary' if base.endswith('_seconds') else 'gauge')
+            lines.append('# TYPE %s%s %s' % (self.prefix, base, kind))
+            lines.extend(family)
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+class Reporter(object):
+    """Write a JSON line of the metrics to out every interval seconds, and serve them to
+    Prometheus on port if given."""
+    def __init__(self, registry, interval=10.0, out=None, port=None, host='0.0.0.0'):
+        self.registry = registry
+        self.interval = interval
+        self.out = out
+        self.port = port
+        self.host = host
+        self.stopped = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def start(self):
+        if self.interval:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        if self.port is not None:
+            self._serve()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        line = self.registry.json_line()
+        if self.out:
+            with open(self.out, 'a') as f:
+                f.write(line + '\n')
+        else:
+            print(line)
+            sys.stdout.flush()
+
+    def _serve(self):
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer((self.host, self.port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop reporting and write a last line."""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.interval:
+            self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class ProfileWindow(object):
+    """Run cProfile over a window of `count` updates, after the first `skip` ones. tick() is
+    called once per update; the profile is written to `output` (pstats format) when given and
+    the top functions are printed."""
+    def __init__(self, count, skip=0, output=None, top=25):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.count = count
+        self.skip = skip
+        self.output = output
+        self.top = top
+        self.seen = 0
+        self.running = False
+        self.done = False
+
+    def tick(self):
+        self.seen += 1
+        if self.done:
+            return
+        if not self.running and self.seen > self.skip:
+            self.running = True
+            self.profile.enable()
+        elif self.running and self.seen > self.skip + self.count:
+            self.stop()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.profile.disable()
+        self.running = False
+        self.done = True
+        import pstats
+        if self.output:
+            self.profile.dump_stats(self.output)
+            print('profile of %d updates written to %s' % (self.seen - self.skip - 1, self.output))
+        pstats.Stats(self.profile, stream=sys.stdout).sort_stats('cumulative').print_stats(self.top)
@@ -0,0 +1,258 @@
+"""Compiled replay cache for MRT files.
+
+A cache file holds the updates of a MRT stream, after nexthop rewriting, in columns that can
+be mmap'ed and replayed without decompressing or decoding the MRT file again:
+
+- ts:        uint32 timestamp of every update (sorted, so it doubles as the seek index)
+- attr_id:   uint32 index into the attribute table, NO_ATTR for withdraw-only updates
+- nlri_idx:  uint32 end of each update's nlri in the prefix columns, count + 1 entries
+- wd_idx:    uint32 end of each update's withdrawals, which follow its nlri, count + 1 entries
+- pfx_off:   uint32 end of each prefix in pfx_data, npfx + 1 entries
+- pfx_afi:   uint8 address family of each prefix
+- pfx_data:  prefixes in NLRI wire format
+- attr_idx:  uint32 offsets into attr_data, one entry per interned attribute set + 1
+- attr_data: attribute sets; those read with their wire encoding (pybgpdump.PathAttributes)
+             are kept as that encoding, the AS number size and the JSON encoded nexthop, so
+             they can be sent again as they are; other attribute sets are JSON encoded
+
+Columns are stored in native byte order; a cache written on another architecture, or by
+another version, is rebuilt.
+"""
+import os, sys
+import json
+import array
+import bisect
+import hashlib
+import mmap
+import struct
+import tempfile
+
+from bgpprefix import PREFIX_TYPES, parse_prefix
+
+MAGIC = b'BGPC'
+VERSION = 3
+NO_ATTR = 0xffffffff
+# kinds of attr_data entries
+ATTR_JSON = 0
+ATTR_RAW = 1
+SECTIONS = ('ts', 'attr_id', 'nlri_idx', 'wd_idx', 'pfx_off', 'pfx_afi', 'pfx_data', 'attr_idx', 'attr_data')
+SECTION_TYPES = {
+    'ts': 'I', 'attr_id': 'I', 'nlri_idx': 'I', 'wd_idx': 'I', 'pfx_off': 'I', 'pfx_afi': 'B',
+    'pfx_data': 'B', 'attr_idx': 'I', 'attr_data': 'B'}
+HEADER = struct.Struct('=4sBBxxIII' + 'QQ' * len(SECTIONS))
+BYTEORDER = 0 if sys.byteorder == 'little' else 1
+
+
+def file_digest(filenames, extra=None):
+    """Return a key identifying the content of filenames (sha1 and size of each) and extra."""
+    key = hashlib.sha1()
+    for filename in filenames:
+        h = hashlib.sha1()
+        size = 0
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+                size += len(block)
+        key.update(('%s-%d;' % (h.hexdigest(), size)).encode('ascii'))
+    if extra is not None:
+        key.update(json.dumps(extra, sort_keys=True).encode('utf-8'))
+    return key.hexdigest()
+
+
+class _Column(object):
+    """An array spilled to a temporary file every `flush_size` items."""
+    flush_size = 1 << 16
+
+    def __init__(self, typecode):
+        self.data = array.array(typecode)
+        self.f = tempfile.TemporaryFile()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.data) + self.nbytes // self.data.itemsize
+
+    def append(self, value):
+        self.data.append(value)
+        if len(self.data) >= self.flush_size:
+            self.flush()
+
+    def extend(self, values):
+        self.data.extend(values)
+        if len(self.data) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        self.nbytes += len(self.data) * self.data.itemsize
+        self.data.tofile(self.f)
+        del self.data[:]
+
+    def copy_to(self, out):
+        self.flush()
+        self.f.seek(0)
+        for block in iter(lambda: self.f.read(1 << 20), b''):
+            out.write(block)
+        self.f.close()
+
+
+def _attr_key(attr):
+    """Return the interning key of an attribute set: its wire encoding, AS number size and
+    nexthop when it has one, else its JSON encoding."""
+    if getattr(attr, 'raw', None) is not None:
+        nexthop = [attr['nexthop']] if 'nexthop' in attr else []
+        return (bytes(attr.raw), attr.as4, json.dumps(nexthop))
+    return json.dumps(attr, sort_keys=True)
+
+
+def _attr_entry(key):
+    """Encode an interning key as an attr_data entry."""
+    if isinstance(key, tuple):
+        raw, as4, nexthop = key
+        return bytearray([ATTR_RAW, 1 if as4 else 0]) + nexthop.encode('utf-8') + b'\n' + raw
+    return bytearray([ATTR_JSON]) + key.encode('utf-8')
+
+
+def _attr_decode(data):
+    """Decode an attr_data entry."""
+    if data[0] == ATTR_RAW:
+        from pybgpdump import PathAttributes
+        end = data.index(b'\n', 2)
+        attr = PathAttributes(data[end + 1:], bool(data[1]))
+        for nexthop in json.loads(data[2:end].decode('utf-8')):
+            # keeps the wire encoding
+            attr['nexthop'] = nexthop
+        return attr
+    return json.loads(data[1:].decode('utf-8'))
+
+
+def compile_cache(stream, cachefile, transform=None):
+    """Write every (timestamp, attr, nlri, withdraw) update from stream to cachefile.
+    transform(attr) is applied to the attributes of announcements before interning.
+    Returns the number of updates written."""
+    columns = dict((name, _Column(SECTION_TYPES[name])) for name in SECTIONS)
+    attr_ids = {}
+    npfx = 0
+    count = 0
+    columns['nlri_idx'].append(0)
+    columns['wd_idx'].append(0)
+    columns['attr_idx'].append(0)
+    columns['pfx_off'].append(0)
+    for timestamp, attr, nlri, withdraw in stream:
+        attr_id = NO_ATTR
+        if nlri:
+            if transform is not None:
+                transform(attr)
+            key = _attr_key(attr)
+            attr_id = attr_ids.get(key)
+            if attr_id is None:
+                attr_id = attr_ids[key] = len(attr_ids)
+                columns['attr_data'].extend(_attr_entry(key))
+                columns['attr_idx'].append(len(columns['attr_data']))
+        for prefixes, idx in ((nlri, 'nlri_idx'), (withdraw, 'wd_idx')):
+            for prefix in prefixes:
+                prefix = parse_prefix(prefix)
+                columns['pfx_data'].extend(prefix)
+                columns['pfx_off'].append(len(columns['pfx_data']))
+                columns['pfx_afi'].append(prefix.afi)
+                npfx += 1
+            columns[idx].append(npfx)
+        columns['ts'].append(timestamp)
+        columns['attr_id'].append(attr_id)
+        count += 1
+    tmpfile = cachefile + '.tmp'
+    with open(tmpfile, 'wb') as out:
+        out.write(b'\x00' * HEADER.size)
+        sections = []
+        for name in SECTIONS:
+            pad = -out.tell() % 8
+            out.write(b'\x00' * pad)
+            offset = out.tell()
+            columns[name].copy_to(out)
+            sections.extend((offset, out.tell() - offset))
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, BYTEORDER, count, npfx, len(attr_ids), *sections))
+    os.rename(tmpfile, cachefile)
+    return count
+
+
+class CachedBGPDump(object):
+    """Replay updates from a compiled cache file. Interned attribute dicts are shared between
+    updates and must not be modified."""
+    def __init__(self, cachefile):
+        self.f = open(cachefile, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.mm)
+        magic, version, byteorder, self.count, _, nattrs = header[:6]
+        if magic != MAGIC or version != VERSION or byteorder != BYTEORDER:
+            self.close()
+            raise ValueError('%s is not a compatible cache file' % cachefile)
+        view = memoryview(self.mm)
+        offsets = header[6:]
+        self.columns = {}
+        for i, name in enumerate(SECTIONS):
+            offset, length = offsets[2 * i], offsets[2 * i + 1]
+            self.columns[name] = view[offset:offset + length].cast(SECTION_TYPES[name])
+        self.attrs = [None] * nattrs
+        self.pos = 0
+
+    def close(self):
+        self.columns = {}
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass
+            self.mm = None
+        self.f.close()
+
+    def seek(self, timestamp):
+        """Position the replay at the first update at or after timestamp."""
+        self.pos = bisect.bisect_left(self.columns['ts'], timestamp)
+        return self.pos
+
+    def _attr(self, attr_id):
+        attr = self.attrs[attr_id]
+        if attr is None:
+            idx = self.columns['attr_idx']
+            data = self.columns['attr_data'][idx[attr_id]:idx[attr_id + 1]]
+            attr = self.attrs[attr_id] = _attr_decode(bytes(data))
+        return attr
+
+    def _prefixes(self, start, end):
+        off = self.columns['pfx_off']
+        afi = self.columns['pfx_afi']
+        data = self.columns['pfx_data']
+        return [PREFIX_TYPES[afi[i]](data[off[i]:off[i + 1]]) for i in range(start, end)]
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        i = self.pos
+        if i >= self.count:
+            self.close()
+            raise StopIteration
+        self.pos += 1
+        columns = self.columns
+        attr_id = columns['attr_id'][i]
+        attr = self._attr(attr_id) if attr_id != NO_ATTR else {}
+        nlri_end = columns['nlri_idx'][i + 1]
+        nlri = self._prefixes(columns['wd_idx'][i], nlri_end)
+        withdraw = self._prefixes(nlri_end, columns['wd_idx'][i + 1])
+        return (columns['ts'][i], attr, nlri, withdraw)
+    __next__ = next
+
+
+def cached_dump(filenames, cache_dir, open_stream, transform=None, extra=None):
+    """Return a CachedBGPDump for filenames, compiling it from open_stream() if it is not cached yet."""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cachefile = os.path.join(cache_dir, '%s.bgpc' % file_digest(filenames, extra))
+    if os.path.exists(cachefile):
+        try:
+            return CachedBGPDump(cachefile)
+        except ValueError:
+            # written by another version or on another architecture
+            pass
+    print('compiling %s into %s' % (', '.join(filenames), cachefile))
+    compile_cache(open_stream(), cachefile, transform)
+    return CachedBGPDump(cachefile)
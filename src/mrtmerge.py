@@ -0,0 +1,158 @@
+"""Replay several MRT files in global timestamp order.
+
+Each file is decompressed and parsed by its own worker process, which hands decoded updates
+back in chunks through a bounded queue (the prefetch window). The main process merges the
+streams with a heap keyed on the MRT timestamp.
+"""
+import os, glob
+import heapq
+import traceback
+import multiprocessing
+
+from pybgpdump import FastBGPDump, OffsetIndex, file_opener, MRT_HEADER, MRT_HEADER_LEN
+
+
+def expand_mrt_files(pattern):
+    """Return the sorted list of MRT files in a directory, matching a glob, or the file itself.
+    Timestamp index files are left out."""
+    if os.path.isdir(pattern):
+        filenames = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                     if not name.startswith('.')]
+    else:
+        filenames = glob.glob(pattern)
+    suffixes = (OffsetIndex.SUFFIX, '.tmp')
+    return sorted(name for name in filenames if os.path.isfile(name) and not name.endswith(suffixes))
+
+
+def first_timestamp(filename):
+    """Return the timestamp of the first record in a MRT file, None if it is empty."""
+    f = file_opener(filename)(filename, 'rb')
+    try:
+        s = f.read(MRT_HEADER_LEN)
+    finally:
+        f.close()
+    if len(s) < MRT_HEADER_LEN:
+        return None
+    return MRT_HEADER.unpack(s)[0]
+
+
+def _produce(filename, queue, chunk_size, start_ts=None):
+    """Worker process: decode filename from start_ts and put lists of update tuples, then None,
+    on queue."""
+    try:
+        chunk = []
+        dump = FastBGPDump(filename)
+        if start_ts is not None:
+            dump.seek(start_ts)
+        for update in dump.updates():
+            chunk.append(update)
+            if len(chunk) >= chunk_size:
+                queue.put(chunk)
+                chunk = []
+        if chunk:
+            queue.put(chunk)
+        if dump.corrupt or dump.truncated:
+            print(dump.summary())
+    except Exception:
+        print('failed to decode %s' % filename)
+        traceback.print_exc()
+    finally:
+        queue.put(None)
+
+
+class _FileStream(object):
+    """The consuming side of a worker process."""
+    def __init__(self, filename, chunk_size, prefetch, start_ts=None):
+        self.filename = filename
+        self.queue = multiprocessing.Queue(maxsize=prefetch)
+        self.proc = multiprocessing.Process(target=_produce,
+                                            args=(filename, self.queue, chunk_size, start_ts))
+        self.proc.daemon = True
+        self.proc.start()
+        self.chunk = iter(())
+
+    def next(self):
+        """Return the next update tuple, None when the file is exhausted."""
+        while True:
+            for update in self.chunk:
+                return update
+            chunk = self.queue.get()
+            if chunk is None:
+                self.proc.join()
+                return None
+            self.chunk = iter(chunk)
+
+    def close(self):
+        if self.proc.is_alive():
+            self.proc.terminate()
+        self.proc.join()
+
+
+class MultiBGPDump(object):
+    """Merge updates from many MRT files by timestamp.
+
+    Files are expected to be ordered internally (as collector dumps are). A worker is started
+    when the merge reaches the first timestamp of its file, plus up to `workers` files of
+    read-ahead, so only files overlapping in time are decoded at once. Each worker buffers at
+    most `prefetch` chunks of `chunk_size` updates.
+    """
+    def __init__(self, filenames, workers=None, chunk_size=2000, prefetch=4):
+        if not isinstance(filenames, (list, tuple)):
+            filenames = expand_mrt_files(filenames)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.pending = []
+        for filename in filenames:
+            ts = first_timestamp(filename)
+            if ts is not None:
+                self.pending.append((ts, filename))
+        self.pending.sort()
+        self.pending.reverse()
+        self.streams = []
+        self.heap = []
+        self.order = 0
+        self.start_ts = None
+
+    def _start_next(self):
+        _, filename = self.pending.pop()
+        stream = _FileStream(filename, self.chunk_size, self.prefetch, self.start_ts)
+        self.streams.append(stream)
+        self.order += 1
+        self._push(stream, self.order)
+
+    def _push(self, stream, order):
+        update = stream.next()
+        if update is None:
+            self.streams.remove(stream)
+            return
+        heapq.heappush(self.heap, (update[0], order, update, stream))
+
+    def seek(self, timestamp):
+        """Start every file at timestamp, each worker seeking in its own file. Must be called
+        before reading."""
+        self.start_ts = timestamp
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
+        self.heap = []
+        self.pending = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        # a pending file must be merged before its first timestamp is passed
+        while self.pending and (not self.heap or self.pending[-1][0] <= self.heap[0][0]):
+            self._start_next()
+        while self.pending and len(self.streams) < self.workers:
+            self._start_next()
+        if not self.heap:
+            self.close()
+            raise StopIteration
+        _, order, update, stream = heapq.heappop(self.heap)
+        self._push(stream, order)
+        return update
+    __next__ = next
@@ -0,0 +1,290 @@
+"""Run the update source in stages overlapping with sending.
+
+The generator reads (timestamp, update) pairs from a source, applies transforms to them (the
+nexthop rewrite), and the agent encodes them and hands them to its per-peer workers. A Pipeline
+runs the source and the transforms ahead of the agent:
+
+- thread:  the source and the transforms run in threads of their own, handing chunks of
+           updates on through bounded queues
+- process: the source and the transforms run in a child process, which encodes the updates
+           as trace records (see updatetrace) into slots of a ring buffer in shared memory;
+           the generator decodes them from there, no pickling involved
+
+Every queue is bounded and the ring has a fixed number of slots, so when the agent stops
+taking updates (its peer queues are full, ExaBGP's backlog or YaBGP's requests in flight are
+at their limit) the stages upstream stop in turn, back to the source.
+"""
+import sys
+import time
+import queue
+import struct
+import threading
+import traceback
+import multiprocessing
+
+from updatetrace import RecordEncoder, RecordDecoder
+
+MODES = ('thread', 'process')
+SLOT_HEADER = struct.Struct('=I')
+# marks the last slot written by a failed producer
+FAILED = 0xffffffff
+
+
+class _Failure(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _put(q, item, stop):
+    """Put item on the bounded queue q, waiting for room unless stop is set."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class _Batcher(object):
+    """Group items into batches handed on by hand_over(batch), which returns False to stop.
+    The caller hands a batch over once it reaches size (items, or bytes when append(batch,
+    item) encodes items into a bytearray); a timer thread hands it over once its first item
+    has waited max_delay seconds, as the source may block a long time before its next item
+    (a live feed). Both hand over under one lock, which keeps the batches in order."""
+    def __init__(self, hand_over, max_delay, size, append=None):
+        self.hand_over = hand_over
+        self.max_delay = max_delay
+        self.size = size
+        self.append = append
+        self.batch = self._new()
+        self.started = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._flush_idle)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _new(self):
+        return [] if self.append is None else bytearray()
+
+    def _hand_over(self):
+        batch = self.batch
+        if not batch:
+            return True
+        self.batch = self._new()
+        return self.hand_over(batch)
+
+    def _flush_idle(self):
+        while not self.done.wait(self.max_delay / 2):
+            with self.lock:
+                if self.batch and time.monotonic() - self.started >= self.max_delay:
+                    if not self._hand_over():
+                        return
+
+    def add(self, item):
+        with self.lock:
+            if not self.batch:
+                self.started = time.monotonic()
+            if self.append is None:
+                self.batch.append(item)
+            else:
+                self.append(self.batch, item)
+            if len(self.batch) >= self.size:
+                return self._hand_over()
+        return True
+
+    def close(self):
+        """Stop the timer and hand over the last batch."""
+        self.done.set()
+        with self.lock:
+            return self._hand_over()
+
+
+def _apply(updates, transforms):
+    for timestamp, update in updates:
+        for transform in transforms:
+            transform(update)
+        yield timestamp, update
+
+
+class SharedRing(object):
+    """Slots of shared memory handed from one producer process to one consumer. A slot holds
+    its length followed by whole records; the `empty` and `full` semaphores count the slots
+    each side may take, which also orders the memory accesses between the processes."""
+    def __init__(self, slots=16, slot_size=1 << 20, context=None):
+        from multiprocessing import shared_memory
+        context = context or multiprocessing
+        self.slots = slots
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.empty = context.Semaphore(slots)
+        self.full = context.Semaphore(0)
+        self.position = 0
+
+    def put(self, data, failed=False):
+        """Write data (at most slot_size - 4 bytes) to the next slot, waiting for one to be free."""
+        if len(data) > self.slot_size - SLOT_HEADER.size:
+            raise ValueError('%d bytes do not fit in a ring slot of %d' % (len(data), self.slot_size))
+        self.empty.acquire()
+        offset = (self.position % self.slots) * self.slot_size
+        buf = self.shm.buf
+        SLOT_HEADER.pack_into(buf, offset, FAILED if failed else len(data))
+        buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+        self.position += 1
+        self.full.release()
+
+    def get(self, alive=None):
+        """Return a copy of the next slot, an empty bytes when the producer is done and None if
+        it failed, or died (alive() turned false) before writing a last slot."""
+        while not self.full.acquire(timeout=0.5):
+            if alive is not None and not alive():
+                return None
+        offset = (self.position % self.slots) * self.slot_size
+        buf = self.shm.buf
+        length, = SLOT_HEADER.unpack_from(buf, offset)
+        data = None if length == FAILED else bytes(buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length])
+        self.position += 1
+        self.empty.release()
+        return data
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _produce_records(updates, transforms, ring, max_delay):
+    """Child process: encode the transformed updates into the ring, then an empty slot."""
+    encoder = RecordEncoder()
+
+    def hand_over(buf):
+        ring.put(buf)
+        return True
+    batcher = _Batcher(hand_over, max_delay, ring.slot_size // 2,
+                       lambda buf, item: encoder.encode(item[0], item[1], buf))
+    failed = False
+    try:
+        for item in _apply(updates, transforms):
+            batcher.add(item)
+    except Exception:
+        traceback.print_exc()
+        failed = True
+    batcher.close()
+    ring.put(b'', failed)
+    ring.close()
+    sys.exit(1 if failed else 0)
+
+
+class Pipeline(object):
+    """Iterate over the (timestamp, update) pairs of a source, with transforms applied, while
+    the source runs ahead in threads or a child process. `depth` bounds the chunks (thread)
+    or ring slots (process) in flight between stages. The source is created by make_source()
+    in the stage running it."""
+    def __init__(self, make_source, transforms=(), mode='thread', depth=16, chunk_size=256,
+                 max_delay=0.05, slot_size=1 << 20):
+        if mode not in MODES:
+            raise ValueError('unknown pipeline mode %s, expected one of %s' % (mode, ', '.join(MODES)))
+        self.make_source = make_source
+        self.transforms = list(transforms)
+        self.mode = mode
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.max_delay = max_delay
+        self.slot_size = slot_size
+        self.stop = threading.Event()
+        self.threads = []
+        self.proc = None
+        self.ring = None
+
+    def _stage(self, fn, *args):
+        thread = threading.Thread(target=fn, args=args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _source_stage(self, out):
+        batcher = _Batcher(lambda chunk: _put(out, chunk, self.stop), self.max_delay, self.chunk_size)
+        end = None
+        try:
+            for item in self.make_source():
+                if not batcher.add(item):
+                    break
+        except Exception:
+            end = _Failure(sys.exc_info())
+        if batcher.close():
+            _put(out, end, self.stop)
+
+    def _transform_stage(self, chunks, out):
+        transforms = self.transforms
+        while not self.stop.is_set():
+            chunk = chunks.get()
+            if chunk is not None and not isinstance(chunk, _Failure):
+                try:
+                    for _, update in chunk:
+                        for transform in transforms:
+                            transform(update)
+                except Exception:
+                    chunk = _Failure(sys.exc_info())
+            if not _put(out, chunk, self.stop) or chunk is None or isinstance(chunk, _Failure):
+                return
+
+    def _iter_threads(self):
+        chunks = queue.Queue(self.depth)
+        self._stage(self._source_stage, chunks)
+        if self.transforms:
+            transformed = queue.Queue(self.depth)
+            self._stage(self._transform_stage, chunks, transformed)
+            chunks = transformed
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, _Failure):
+                raise chunk.exc_info[1].with_traceback(chunk.exc_info[2])
+            for item in chunk:
+                yield item
+
+    def _iter_process(self):
+        # the child inherits the generator's state (config, random source) by forking
+        context = multiprocessing.get_context('fork')
+        self.ring = SharedRing(self.depth, self.slot_size, context)
+        self.proc = context.Process(target=self._run_producer)
+        self.proc.start()
+        decoder = RecordDecoder()
+        while True:
+            data = self.ring.get(self.proc.is_alive)
+            if data is None:
+                self.proc.join()
+                raise RuntimeError('the pipeline source failed (exit code %s)' % self.proc.exitcode)
+            if not data:
+                self.proc.join()
+                return
+            for item in decoder.updates(data):
+                yield item
+
+    def _run_producer(self):
+        _produce_records(self.make_source(), self.transforms, self.ring, self.max_delay)
+
+    def __iter__(self):
+        try:
+            if self.mode == 'process':
+                for item in self._iter_process():
+                    yield item
+            else:
+                for item in self._iter_threads():
+                    yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the stages, which may still be running when the consumer stops early."""
+        self.stop.set()
+        if self.proc is not None:
+            if self.proc.is_alive():
+                self.proc.terminate()
+            self.proc.join()
+            self.proc = None
+        if self.ring is not None:
+            self.ring.close(unlink=True)
+            self.ring = None
@@ -0,0 +1,95 @@
+"""A compact store of announced IPv4 and IPv6 prefixes."""
+from array import array
+
+from bgpprefix import Prefix, Prefix6, AFI_IPV6
+
+MASK64 = (1 << 64) - 1
+
+
+def _key(prefix):
+    """The address and length of a prefix packed in an integer."""
+    addr = int.from_bytes(prefix[1:], 'big') << (8 * (prefix.addr_len + 1 - len(prefix)))
+    return (addr << 8) | prefix[0]
+
+
+class PrefixStore(object):
+    """Prefixes kept as packed integers plus an index of their position: IPv4 addresses in
+    an array('I'), IPv6 addresses as two halves in array('Q')s, the lengths in array('B')s.
+    Removal moves the last prefix of the family into the hole, so add, remove and picking a
+    random prefix are all O(1). Prefixes go in and come out as Prefix and Prefix6 objects."""
+    def __init__(self):
+        self.addrs = array('I')
+        self.lens = array('B')
+        self.index = {}
+        self.highs = array('Q')
+        self.lows = array('Q')
+        self.lens6 = array('B')
+        self.index6 = {}
+
+    def __len__(self):
+        return len(self.lens) + len(self.lens6)
+
+    def __contains__(self, prefix):
+        return _key(prefix) in (self.index6 if prefix.afi == AFI_IPV6 else self.index)
+
+    def add(self, prefix):
+        """Add a prefix, return False if it was already there."""
+        key = _key(prefix)
+        if prefix.afi == AFI_IPV6:
+            if key in self.index6:
+                return False
+            self.index6[key] = len(self.lens6)
+            self.highs.append(key >> 72)
+            self.lows.append((key >> 8) & MASK64)
+            self.lens6.append(key & 0xff)
+            return True
+        if key in self.index:
+            return False
+        self.index[key] = len(self.lens)
+        self.addrs.append(key >> 8)
+        self.lens.append(key & 0xff)
+        return True
+
+    def remove(self, prefix):
+        """Remove a prefix, return False if it was not there."""
+        key = _key(prefix)
+        if prefix.afi == AFI_IPV6:
+            pos = self.index6.pop(key, None)
+            if pos is None:
+                return False
+            high, low, plen = self.highs.pop(), self.lows.pop(), self.lens6.pop()
+            if pos < len(self.lens6):
+                self.highs[pos] = high
+                self.lows[pos] = low
+                self.lens6[pos] = plen
+                self.index6[(((high << 64) | low) << 8) | plen] = pos
+            return True
+        pos = self.index.pop(key, None)
+        if pos is None:
+            return False
+        addr, plen = self.addrs.pop(), self.lens.pop()
+        if pos < len(self.lens):
+            self.addrs[pos] = addr
+            self.lens[pos] = plen
+            self.index[(addr << 8) | plen] = pos
+        return True
+
+    def pick(self, r):
+        """Return the prefix at fraction r (0 <= r < 1) of the store, IPv4 prefixes first."""
+        pos = int(r * len(self))
+        if pos < len(self.lens):
+            return Prefix.from_int(self.addrs[pos], self.lens[pos])
+        pos -= len(self.lens)
+        return Prefix6.from_int((self.highs[pos] << 64) | self.lows[pos], self.lens6[pos])
+
+    def pick_many(self, rs):
+        """Return the distinct prefixes picked by the fractions in rs."""
+        return list(dict.fromkeys(self.pick(r) for r in rs))
+
+
+def withdraw_probability(size, target):
+    """Probability to withdraw in mixed mode. With a target table size, withdrawals get more
+    likely (and announcements less) as the table grows, so it settles around the target."""
+    if not target:
+        return 0.5
+    return float(size) / (size + target)
@@ -1,97 +1,135 @@
 """Parse BGP updates from MRT file (uncompressed or compressed in bz2 or gz format.
 """
+import os, mmap
 import gzip, bz2
+import bisect
+from array import array
 import dpkt, struct
-from socket import inet_ntoa as inet_ntoa
+from socket import inet_ntoa as inet_ntoa, inet_ntop, AF_INET6
 
-BZ2_MAGIC = '\x42\x5a\x68'
-GZIP_MAGIC = dpkt.gzip.GZIP_MAGIC
+from bgpprefix import Prefix, PREFIX_TYPES, SAFI_UNICAST
+from blockreader import BlockReader, open_decompressed, BLOCK_SIZE
+
+BZ2_MAGIC = b'\x42\x5a\x68'
+GZIP_MAGIC = b'\x1f\x8b'
 MRT_HEADER_LEN = dpkt.mrt.MRTHeader.__hdr_len__
-SUPPORTED_AFIS = ( dpkt.mrt.AFI_IPv4, )
+SUPPORTED_AFIS = ( dpkt.mrt.AFI_IPv4, dpkt.mrt.AFI_IPv6 )
 SUPPORTED_TYPES = ( dpkt.bgp.UPDATE, )
 BGP_MARKER = '\xff' * 16
+# larger lengths are taken for a corrupt header, past which records cannot be found again
+MAX_RECORD_LEN = 1 << 24
+# errors of a record whose framing is fine but whose content is not
+RECORD_ERRORS = (struct.error, IndexError, ValueError, KeyError)
+
+
+def compression_of(filename):
+    """Return 'bz2', 'gz' or None, based on the extension and magic bytes of filename."""
+    with open(filename, 'rb') as f:
+        hdr = f.read(max(len(BZ2_MAGIC), len(GZIP_MAGIC)))
+    if filename.endswith('.bz2') and hdr.startswith(BZ2_MAGIC):
+        return 'bz2'
+    elif filename.endswith('.gz') and hdr.startswith(GZIP_MAGIC):
+        return 'gz'
+    return None
+
+
+def file_opener(filename):
+    """Return the function to open filename with, based on its extension and magic bytes."""
+    return {'bz2': bz2.BZ2File, 'gz': gzip.GzipFile}.get(compression_of(filename), open)
+
+
 class BGPDump:
-    """A BGPDump object wraps around a MRT file. next() method can be used to get next updates from the file."""
+    """A BGPDump object wraps around a MRT file. next() method can be used to get next updates from the file.
+    Compressed files are decompressed ahead by a BlockReader. Records which do not parse are
+    skipped and counted in `corrupt`, a record cut short by the end of the file in `truncated`."""
     def __init__(self, filename):
-        with open(filename, 'rb') as f:
-            hdr = f.read(max(len(BZ2_MAGIC), len(GZIP_MAGIC)))
-            if filename.endswith('.bz2') and hdr.startswith(BZ2_MAGIC.encode('utf-8')):
-                self.fobj = bz2.BZ2File
-            elif filename.endswith('.gz') and hdr.startswith(GZIP_MAGIC.encode('utf-8')):
-                self.fobj = gzip.GzipFile
-            else:
-                self.fobj = open
+        self.compression = compression_of(filename)
+        self.corrupt = 0
+        self.truncated = 0
+        self.error = None
         self.open(filename)
 
     def open(self, filename):
-        self.f = self.fobj(filename, 'rb')
+        if self.compression:
+            self.f = BlockReader(open_decompressed(filename, self.compression))
+        else:
+            self.f = open(filename, 'rb')
+
+    def errors(self):
+        """Return the numbers of corrupt and truncated records, and the read error if any."""
+        return {'corrupt': self.corrupt, 'truncated': self.truncated, 'error': self.error}
 
     def close(self):
-        self.f.close()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
         raise StopIteration
 
     def __iter__(self):
         return self
 
+    def _read(self, size):
+        if self.f is None:
+            raise StopIteration
+        s = self.f.read(size)
+        if len(s) < size:
+            self.error = getattr(self.f, 'error', None)
+            if s or size != MRT_HEADER_LEN or self.error:
+                self.truncated += 1
+            self.close()
+        return s
+
     def next(self):
-        mrt_h = bgp_h = bgp_m = None
         while True:
+            mrt_h = dpkt.mrt.MRTHeader(self._read(MRT_HEADER_LEN))
+            if mrt_h.len > MAX_RECORD_LEN:
+                self.corrupt += 1
+                self.error = 'record length %d' % mrt_h.len
+                self.close()
+            s = self._read(mrt_h.len)
+            if mrt_h.type != dpkt.mrt.BGP4MP:
+                continue
             try:
-                s = self.f.read(MRT_HEADER_LEN)
-                if len(s) < MRT_HEADER_LEN:
-                    self.close()
-                    break
-
-                mrt_h = dpkt.mrt.MRTHeader(s)
-                s = self.f.read(mrt_h.len)
-                if len(s) < mrt_h.len:
-                    self.close()
-                    break
-
-                if mrt_h.type != dpkt.mrt.BGP4MP:
-                    continue
-
                 if mrt_h.subtype == dpkt.mrt.BGP4MP_MESSAGE:
                     bgp_h = dpkt.mrt.BGP4MPMessage(s)
                 elif mrt_h.subtype == dpkt.mrt.BGP4MP_MESSAGE_32BIT_AS:
                     bgp_h = dpkt.mrt.BGP4MPMessage_32(s)
                 else:
                     continue
-
-                if bgp_h.family not in SUPPORTED_AFIS:
+                # dpkt only parses the IPv4 BGP4MP header
+                if bgp_h.family != dpkt.mrt.AFI_IPv4:
                     continue
                 bgp_m = dpkt.bgp.BGP(bgp_h.data)
-                if bgp_m.type not in SUPPORTED_TYPES:
-                    continue
+            except (dpkt.UnpackError,) + RECORD_ERRORS:
+                self.corrupt += 1
+                continue
+            if bgp_m.type == dpkt.bgp.UPDATE:
                 break
-            except:
-                pass
-        if mrt_h is None or bgp_h is None or bgp_m is None:
-            StopIteration
-        if bgp_m.type != dpkt.bgp.UPDATE:
-            print(bgp_m.type, 'not an update')
-            return self.next()
         nlri = []
         for p in bgp_m.update.announced:
-            nlri.append("%s/%d" % (inet_ntoa(p.prefix), p.len))
+            nlri.append(Prefix.from_address(p.prefix, p.len))
         withdraw = []
         for p in bgp_m.update.withdrawn:
-            withdraw.append("%s/%d" % (inet_ntoa(p.prefix), p.len))
+            withdraw.append(Prefix.from_address(p.prefix, p.len))
         attr = {}
         for at in bgp_m.update.attributes:
             if at.type == dpkt.bgp.NEXT_HOP:
                 attr['nexthop'] = inet_ntoa(
-                        struct.pack(b'I', at.next_hop.ip))
+                        struct.pack('>I', at.next_hop.ip))
             elif at.type == dpkt.bgp.ORIGIN:
                 attr['origin'] = at.origin.type
             elif at.type == dpkt.bgp.AS_PATH:
-                attr['as_path'] = at.as_path.segments
+                # a flat list of ASNs, as FastBGPDump gives. dpkt guesses the size of the ASNs
+                # from the length of the attribute, the MRT subtype tells it
+                as4 = mrt_h.subtype == dpkt.mrt.BGP4MP_MESSAGE_32BIT_AS
+                record = MRTRecord(mrt_h.ts, 0, bgp_h.family, as4, bgp_h.data[BGP_HEADER_LEN:])
+                attr['as_path'] = record.attr.get('as_path', [])
             elif at.type == dpkt.bgp.MULTI_EXIT_DISC:
                 attr['med'] = at.multi_exit_disc.value
             elif at.type == dpkt.bgp.LOCAL_PREF:
                 attr['local_pref'] = at.local_pref.value
             elif at.type == dpkt.bgp.COMMUNITIES:
-                attr['community'] = at.communities.list
+                attr['community'] = [_U32.unpack(bytes(community))[0] for community in at.communities.list]
             elif at.type == dpkt.bgp.MP_REACH_NLRI:
                 #TODO: Handle message with mp reach
                 mp_reach = at.mp_reach_nlri
@@ -101,3 +139,513 @@ class BGPDump:
                 #TODO: handle mp unreach message
                 pass
         return (mrt_h.ts, attr, nlri, withdraw)
+    __next__ = next
+
+
+MRT_HEADER = struct.Struct('>IHHI')
+BGP4MP_HEADERS = {
+    dpkt.mrt.BGP4MP_MESSAGE: (struct.Struct('>HHHH'), False),
+    dpkt.mrt.BGP4MP_MESSAGE_32BIT_AS: (struct.Struct('>IIHH'), True),
+}
+BGP4MP_TYPES = (dpkt.mrt.BGP4MP, dpkt.mrt.BGP4MP_ET)
+AFI_ADDR_LEN = {dpkt.mrt.AFI_IPv4: 4, dpkt.mrt.AFI_IPv6: 16}
+BGP_HEADER_LEN = 19
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+
+
+def decode_prefixes(buf, prefix_type=Prefix):
+    """Split a prefix list (withdrawn routes, NLRI or MP NLRI) into packed prefixes."""
+    prefixes = []
+    off = 0
+    end = len(buf)
+    while off < end:
+        nbytes = (buf[off] + 7) // 8
+        prefixes.append(prefix_type(buf[off:off + 1 + nbytes]))
+        off += 1 + nbytes
+    return prefixes
+
+
+def _attributes(buf):
+    """Yield (type, start, value start, end) for the path attributes in buf."""
+    off = 0
+    end = len(buf)
+    while off < end:
+        flags, at_type = buf[off], buf[off + 1]
+        if flags & 0x10:
+            value_off = off + 4
+            value_end = value_off + _U16.unpack_from(buf, off + 2)[0]
+        else:
+            value_off = off + 3
+            value_end = value_off + buf[off + 2]
+        yield at_type, off, value_off, value_end
+        off = value_end
+
+
+def split_mp_attributes(buf):
+    """Return (attributes, mp_reach, mp_unreach): the attributes without MP_REACH_NLRI and
+    MP_UNREACH_NLRI, and the values of those (None if absent). buf is returned as is when it
+    has neither."""
+    reach = unreach = None
+    parts = []
+    start = 0
+    for at_type, off, value_off, value_end in _attributes(buf):
+        if at_type == dpkt.bgp.MP_REACH_NLRI:
+            reach = buf[value_off:value_end]
+        elif at_type == dpkt.bgp.MP_UNREACH_NLRI:
+            unreach = buf[value_off:value_end]
+        else:
+            continue
+        parts.append(buf[start:off])
+        start = value_end
+    if not parts:
+        return buf, None, None
+    parts.append(buf[start:])
+    return b''.join(parts), reach, unreach
+
+
+def decode_mp_reach(value):
+    """Return (nexthop, prefixes) of a MP_REACH_NLRI value. Only IPv4 and IPv6 unicast are
+    decoded, other families give (None, [])."""
+    afi, safi, nh_len = struct.unpack_from('>HBB', value)
+    if afi not in PREFIX_TYPES or safi != SAFI_UNICAST:
+        return None, []
+    nexthop = bytes(value[4:4 + nh_len])
+    if len(nexthop) >= 16:
+        nexthop = inet_ntop(AF_INET6, nexthop[:16])
+    elif len(nexthop) >= 4:
+        nexthop = inet_ntoa(nexthop[:4])
+    else:
+        nexthop = None
+    # a reserved octet follows the nexthop
+    return nexthop, decode_prefixes(value[5 + nh_len:], PREFIX_TYPES[afi])
+
+
+def decode_mp_unreach(value):
+    """Return the withdrawn prefixes of a MP_UNREACH_NLRI value."""
+    afi, safi = struct.unpack_from('>HB', value)
+    if afi not in PREFIX_TYPES or safi != SAFI_UNICAST:
+        return []
+    return decode_prefixes(value[3:], PREFIX_TYPES[afi])
+
+
+def decode_as_path(buf, as4):
+    """Decode AS_PATH segments into a flat list of ASNs."""
+    as_path = []
+    asn = _U32 if as4 else _U16
+    off = 0
+    while off + 2 <= len(buf):
+        _, count = buf[off], buf[off + 1]
+        off += 2
+        for _ in range(count):
+            as_path.append(asn.unpack_from(buf, off)[0])
+            off += asn.size
+    return as_path
+
+
+def decode_attributes(buf, as4=False):
+    """Decode path attributes into the dict format returned by BGPDump. MP_REACH_NLRI only
+    gives the nexthop, if there is no NEXT_HOP."""
+    attr = {}
+    for at_type, _, value_off, value_end in _attributes(buf):
+        value = buf[value_off:value_end]
+        at_len = value_end - value_off
+        if at_type == dpkt.bgp.NEXT_HOP:
+            attr['nexthop'] = inet_ntoa(bytes(value[:4]))
+        elif at_type == dpkt.bgp.ORIGIN:
+            attr['origin'] = value[0]
+        elif at_type == dpkt.bgp.AS_PATH:
+            attr['as_path'] = decode_as_path(value, as4)
+        elif at_type == dpkt.bgp.MULTI_EXIT_DISC:
+            attr['med'] = _U32.unpack_from(value)[0]
+        elif at_type == dpkt.bgp.LOCAL_PREF:
+            attr['local_pref'] = _U32.unpack_from(value)[0]
+        elif at_type == dpkt.bgp.COMMUNITIES:
+            attr['community'] = [_U32.unpack_from(value, i)[0] for i in range(0, at_len - 3, 4)]
+        elif at_type == dpkt.bgp.MP_REACH_NLRI and at_len >= 5:
+            nexthop = decode_mp_reach(value)[0]
+            if nexthop is not None:
+                attr.setdefault('nexthop', nexthop)
+    return attr
+
+
+class PathAttributes(dict):
+    """Decoded attributes which keep the wire encoding they were decoded from (raw), so it can
+    be sent again as is. raw is dropped when any attribute other than the nexthop is changed.
+    raw never holds MP_REACH_NLRI or MP_UNREACH_NLRI, their prefixes are part of the update."""
+    def __init__(self, raw, as4, nexthop=None):
+        dict.__init__(self, decode_attributes(raw, as4))
+        if nexthop is not None:
+            dict.setdefault(self, 'nexthop', nexthop)
+        self.raw = raw
+        self.as4 = as4
+
+    def __setitem__(self, key, value):
+        if key != 'nexthop':
+            self.raw = None
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.raw = None
+        dict.__delitem__(self, key)
+
+    def pop(self, *args):
+        self.raw = None
+        return dict.pop(self, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        self.raw = None
+        dict.update(self, *args, **kwargs)
+
+    def clear(self):
+        self.raw = None
+        dict.clear(self)
+
+
+class MRTRecord(object):
+    """A BGP UPDATE found in a MRT file. Only the section offsets are computed up front;
+    prefixes and attributes are decoded on first access. nlri and withdraw include the
+    prefixes of MP_REACH_NLRI and MP_UNREACH_NLRI."""
+    __slots__ = ('ts', 'peer_as', 'afi', 'as4', 'data', '_attr_start', '_attr_end', '_mp')
+
+    def __init__(self, ts, peer_as, afi, as4, data):
+        self.ts = ts
+        self.peer_as = peer_as
+        self.afi = afi
+        self.as4 = as4
+        self.data = data
+        withdraw_len = _U16.unpack_from(data, 0)[0]
+        self._attr_start = 4 + withdraw_len
+        self._attr_end = self._attr_start + _U16.unpack_from(data, 2 + withdraw_len)[0]
+        self._mp = None
+
+    @property
+    def withdraw_bytes(self):
+        return self.data[2:self._attr_start - 2]
+
+    @property
+    def attr_bytes(self):
+        return self.data[self._attr_start:self._attr_end]
+
+    @property
+    def nlri_bytes(self):
+        return self.data[self._attr_end:]
+
+    def mp_attributes(self):
+        """Return split_mp_attributes() of the attributes."""
+        if self._mp is None:
+            self._mp = split_mp_attributes(self.attr_bytes)
+        return self._mp
+
+    @property
+    def withdraw(self):
+        prefixes = decode_prefixes(self.withdraw_bytes)
+        unreach = self.mp_attributes()[2]
+        if unreach is not None and len(unreach) >= 3:
+            prefixes.extend(decode_mp_unreach(unreach))
+        return prefixes
+
+    @property
+    def nlri(self):
+        prefixes = decode_prefixes(self.nlri_bytes)
+        reach = self.mp_attributes()[1]
+        if reach is not None and len(reach) >= 5:
+            prefixes.extend(decode_mp_reach(reach)[1])
+        return prefixes
+
+    @property
+    def attr(self):
+        return decode_attributes(self.attr_bytes, self.as4)
+
+    def as_tuple(self):
+        """Return (timestamp, attr, nlri, withdraw) as BGPDump.next() does. attr is a
+        PathAttributes holding a copy of the attribute bytes, less the MP attributes."""
+        raw, reach, _ = self.mp_attributes()
+        nexthop = None
+        if reach is not None and len(reach) >= 5:
+            nexthop = decode_mp_reach(reach)[0]
+        return (self.ts, PathAttributes(bytes(raw), self.as4, nexthop), self.nlri, self.withdraw)
+
+
+def parse_record(ts, mrt_type, subtype, body):
+    """Return a MRTRecord for a BGP4MP UPDATE record, or None if the record is not supported."""
+    if mrt_type not in BGP4MP_TYPES:
+        return None
+    if mrt_type == dpkt.mrt.BGP4MP_ET:
+        body = body[4:]
+    if subtype not in BGP4MP_HEADERS:
+        return None
+    hdr, as4 = BGP4MP_HEADERS[subtype]
+    if len(body) < hdr.size:
+        return None
+    peer_as, _, _, afi = hdr.unpack_from(body)
+    if afi not in SUPPORTED_AFIS:
+        return None
+    off = hdr.size + 2 * AFI_ADDR_LEN[afi]
+    if len(body) < off + BGP_HEADER_LEN:
+        return None
+    bgp_len, bgp_type = struct.unpack_from('>HB', body, off + 16)
+    if bgp_type not in SUPPORTED_TYPES:
+        return None
+    return MRTRecord(ts, peer_as, afi, as4, body[off + BGP_HEADER_LEN:off + bgp_len])
+
+
+class OffsetIndex(object):
+    """A sparse timestamp index of an uncompressed MRT file.
+
+    An entry (timestamp, offset) is kept every `step` bytes, timestamp being the highest
+    timestamp of the records before offset, so the records before an entry found for a
+    time are all older than it even if the file is not strictly ordered. The index is saved
+    next to the MRT file and is only reused for the same file size and modification time.
+    """
+    HEADER = struct.Struct('=4sQdI')
+    MAGIC = b'MRTI'
+    SUFFIX = '.idx'
+    step = 1 << 16
+
+    def __init__(self, filename):
+        self.filename = filename + self.SUFFIX
+        st = os.stat(filename)
+        self.size, self.mtime = st.st_size, st.st_mtime
+        self.keys = array('I')
+        self.offsets = array('Q')
+        self.complete = False
+
+    def add(self, timestamp, offset):
+        self.keys.append(timestamp)
+        self.offsets.append(offset)
+
+    def lookup(self, timestamp):
+        """Return the offset to start from to get every record at or after timestamp."""
+        i = bisect.bisect_left(self.keys, timestamp)
+        return self.offsets[i - 1] if i else 0
+
+    def load(self):
+        """Load the saved index, return False if there is none for this version of the file."""
+        try:
+            with open(self.filename, 'rb') as f:
+                magic, size, mtime, count = self.HEADER.unpack(f.read(self.HEADER.size))
+                if magic != self.MAGIC or size != self.size or mtime != self.mtime:
+                    return False
+                self.keys = array('I')
+                self.offsets = array('Q')
+                self.keys.fromfile(f, count)
+                self.offsets.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return False
+        self.complete = True
+        return True
+
+    def save(self):
+        tmpfile = self.filename + '.tmp'
+        try:
+            with open(tmpfile, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.size, self.mtime, len(self.keys)))
+                self.keys.tofile(f)
+                self.offsets.tofile(f)
+            os.rename(tmpfile, self.filename)
+        except OSError:
+            # read-only location, the index is rebuilt next time
+            pass
+
+
+class FastBGPDump(object):
+    """A BGPDump that does not build dpkt objects. Uncompressed files are mmap'ed and the
+    MRT/BGP4MP headers are walked in place; unsupported records are skipped without copying.
+
+    records() yields MRTRecord objects which decode their content lazily,
+    next() returns the same (timestamp, attr, nlri, withdraw) tuple as BGPDump.
+    seek(timestamp) skips the records before timestamp without decoding them; on an
+    uncompressed file it jumps close to the first one through an OffsetIndex, which is
+    built along the first full pass over the file.
+
+    Compressed files are decompressed ahead by a BlockReader and records are sliced out of
+    its blocks, so memory use does not grow with the file. Records which do not decode are
+    skipped and counted in `corrupt`; a record cut short by the end of the file (or of a
+    broken compressed stream) is counted in `truncated` and ends the file, as does a header
+    with an impossible length, after which no record boundary can be trusted.
+    """
+    def __init__(self, filename, block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.mm = None
+        self.index = None
+        self.reader = None
+        self.start_offset = 0
+        self.start_ts = None
+        self.corrupt = 0
+        self.truncated = 0
+        self.error = None
+        compression = compression_of(filename)
+        if compression:
+            self.f = None
+            self.reader = BlockReader(open_decompressed(filename, compression), block_size)
+        else:
+            self.f = open(filename, 'rb')
+            if os.fstat(self.f.fileno()).st_size > 0:
+                self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.index = OffsetIndex(filename)
+                self.index.load()
+        self._records = self.records()
+
+    def errors(self):
+        """Return the numbers of corrupt and truncated records, and the read error if any."""
+        return {'corrupt': self.corrupt, 'truncated': self.truncated, 'error': self.error}
+
+    def summary(self):
+        text = '%s: %d corrupt records skipped, %d truncated' % (self.filename, self.corrupt, self.truncated)
+        if self.error:
+            text += ' (%s)' % self.error
+        return text
+
+    def close(self):
+        self._records = iter(())
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # records handed out still reference the map, it is unmapped once they are gone
+                pass
+            self.mm = None
+        if self.f is not None:
+            self.f.close()
+
+    def seek(self, timestamp):
+        """Position the replay at the first record at or after timestamp. Must be called
+        before reading."""
+        self.start_ts = timestamp
+        if self.index is not None:
+            if not self.index.complete:
+                # the indexing pass must not count a broken tail twice
+                counts = self.corrupt, self.truncated
+                for _ in self._headers(0):
+                    pass
+                self.corrupt, self.truncated = counts
+            self.start_offset = self.index.lookup(timestamp)
+        self._records = self.records()
+        return self.start_offset
+
+    def _headers(self, off):
+        """Yield (offset of the body, ts, type, subtype, length) for the records of the mmap'ed
+        file from off, indexing them on a pass from the start."""
+        buf = self.mm
+        end = len(buf)
+        index = self.index if off == 0 and not self.index.complete else None
+        if index is not None:
+            index.keys = array('I')
+            index.offsets = array('Q')
+        mark = 0
+        max_ts = 0
+        while off + MRT_HEADER_LEN <= end:
+            ts, mrt_type, subtype, length = MRT_HEADER.unpack_from(buf, off)
+            if index is not None and off >= mark:
+                index.add(max_ts, off)
+                mark = off + index.step
+            if ts > max_ts:
+                max_ts = ts
+            off += MRT_HEADER_LEN
+            if length > MAX_RECORD_LEN:
+                self.corrupt += 1
+                self.error = 'record length %d at byte %d' % (length, off - MRT_HEADER_LEN)
+                break
+            if off + length > end:
+                self.truncated += 1
+                break
+            yield off, ts, mrt_type, subtype, length
+            off += length
+        if index is not None:
+            index.complete = True
+            index.save()
+
+    def _raw_records(self):
+        """Yield (ts, type, subtype, body) for every MRT record in the file (from the seek
+        position)."""
+        start_ts = self.start_ts
+        if self.mm is not None:
+            buf = memoryview(self.mm)
+            for off, ts, mrt_type, subtype, length in self._headers(self.start_offset):
+                if start_ts is None or ts >= start_ts:
+                    yield ts, mrt_type, subtype, buf[off:off + length]
+        elif self.reader is not None:
+            for ts, mrt_type, subtype, body in self._block_records():
+                if start_ts is None or ts >= start_ts:
+                    yield ts, mrt_type, subtype, body
+
+    def _block_records(self):
+        """Yield (ts, type, subtype, body) for the records of the decompressed blocks. Bodies
+        are slices of the blocks; a record spanning two blocks is copied together with the
+        start of the next block it needs, unless it is longer than a block."""
+        buf = b''
+        pos = 0
+        unpack_header = MRT_HEADER.unpack_from
+        for block in self.reader:
+            segments = ((block, 0),)
+            if pos < len(buf):
+                tail = buf[pos:]
+                head = tail + block[:MRT_HEADER_LEN]
+                need = len(block) + 1
+                if len(head) >= MRT_HEADER_LEN:
+                    need = MRT_HEADER_LEN + unpack_header(head, 0)[3] - len(tail)
+                if need <= len(block):
+                    segments = ((tail + block[:need], 0), (block, need))
+                else:
+                    segments = ((tail + block, 0),)
+            for buf, pos in segments:
+                end = len(buf)
+                view = memoryview(buf)
+                while pos + MRT_HEADER_LEN <= end:
+                    ts, mrt_type, subtype, length = unpack_header(buf, pos)
+                    if length > MAX_RECORD_LEN:
+                        self.corrupt += 1
+                        self.error = 'record length %d at byte %d' % (length, self.reader.bytes - end + pos)
+                        return
+                    body = pos + MRT_HEADER_LEN
+                    if body + length > end:
+                        break
+                    yield ts, mrt_type, subtype, view[body:body + length]
+                    pos = body + length
+        if pos < len(buf) or self.reader.error:
+            self.truncated += 1
+        if self.reader.error:
+            self.error = self.reader.error
+
+    def records(self):
+        """Yield a MRTRecord for every supported UPDATE in the file, skipping corrupt ones."""
+        for ts, mrt_type, subtype, body in self._raw_records():
+            try:
+                rec = parse_record(ts, mrt_type, subtype, body)
+            except RECORD_ERRORS:
+                self.corrupt += 1
+                continue
+            if rec is not None:
+                yield rec
+
+    def updates(self):
+        """Yield the (timestamp, attr, nlri, withdraw) tuple of every update, skipping those
+        which do not decode."""
+        for rec in self.records():
+            try:
+                yield rec.as_tuple()
+            except RECORD_ERRORS:
+                self.corrupt += 1
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        for rec in self._records:
+            try:
+                return rec.as_tuple()
+            except RECORD_ERRORS:
+                self.corrupt += 1
+        self.close()
+        raise StopIteration
+    __next__ = next
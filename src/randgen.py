@@ -0,0 +1,144 @@
+"""Random update generation in bulk with NumPy."""
+import numpy
+
+from bgpprefix import Prefix, Prefix6
+from prefixrib import PrefixStore, withdraw_probability
+
+ORIGINS = ['igp', 'incomplete', 'egp']
+FAMILIES = ('ipv4', 'ipv6', 'both')
+
+
+def shard_range(shard, bits, min_length):
+    """Return the [start, end) addresses of the shard (index, count) of a space of bits
+    bits. Shards are made of whole blocks of the shortest prefix length min_length, so no
+    prefix of min_length or longer straddles two shards."""
+    index, count = shard
+    blocks = 1 << min_length
+    if not 0 <= index < count <= blocks:
+        raise ValueError('shard %d of %d does not fit %d blocks of /%d' % (index, count, blocks, min_length))
+    block_size = 1 << (bits - min_length)
+    return index * blocks // count * block_size, (index + 1) * blocks // count * block_size
+
+
+class RandomUpdates(object):
+    """Iterate over random updates.
+
+    Every value (prefixes, prefix lengths, AS paths, MED, local-pref, origin, nexthop and
+    whether to announce or withdraw) is drawn for `batch_size` updates at a time in NumPy
+    arrays; the update dicts themselves are only built as they are consumed. The same seed
+    gives the same sequence of updates.
+
+    In mixed mode withdrawals are picked from the prefixes announced so far, which settle
+    around `table_size` prefixes if it is set.
+
+    `family` is ipv4, ipv6 (prefixes drawn from 2000::/3, of prefix6_lengths) or both, in
+    which case every update is IPv4 or IPv6 at random.
+
+    `shard` (index, count) restricts the prefixes to the index-th of count disjoint slices of
+    the address space, so generators running side by side never touch each other's prefixes.
+    """
+    def __init__(self, local_as, nexthops, update_type='mixed', max_prefix=1, seed=None,
+                 batch_size=4096, max_as_path=5, prefix_lengths=(24, 24), table_size=0,
+                 family='ipv4', prefix6_lengths=(48, 48), shard=(0, 1)):
+        if family not in FAMILIES:
+            raise ValueError('unknown family %s, expected one of %s' % (family, ', '.join(FAMILIES)))
+        self.local_as = local_as
+        self.nexthops = [str(nexthop) for nexthop in nexthops] or [None]
+        self.update_type = update_type
+        self.max_prefix = max_prefix
+        self.batch_size = batch_size
+        self.max_as_path = max_as_path
+        self.prefix_lengths = prefix_lengths
+        self.prefix6_lengths = prefix6_lengths
+        self.table_size = table_size
+        self.ipv6_share = {'ipv4': 0.0, 'ipv6': 1.0, 'both': 0.5}[family]
+        self.rng = numpy.random.default_rng(seed)
+        self.announced = PrefixStore()
+        # 32 bits of IPv4 addresses, the 61 bits under 2000::/3 of the upper half of IPv6 ones
+        self.range = shard_range(shard, 32, prefix_lengths[0])
+        self.range6 = shard_range(shard, 61, min(prefix6_lengths[0], 64) - 3)
+
+    def _prefixes(self, shape):
+        """Draw random prefixes, return (address, length) arrays."""
+        rng = self.rng
+        low, high = self.prefix_lengths
+        plen = rng.integers(low, high + 1, shape)
+        start, end = self.range
+        addr = rng.integers(start, end, shape, dtype=numpy.uint64)
+        mask = (numpy.uint64(0xffffffff) << (32 - plen).astype(numpy.uint64)) & numpy.uint64(0xffffffff)
+        return addr & mask, plen
+
+    def _prefixes6(self, shape):
+        """Draw random IPv6 prefixes of at most 64 bits, return (upper 64 bits of the address,
+        length) arrays."""
+        rng = self.rng
+        low, high = self.prefix6_lengths
+        plen = rng.integers(low, min(high, 64) + 1, shape)
+        start, end = self.range6
+        addr = rng.integers(start, end, shape, dtype=numpy.uint64) | numpy.uint64(1 << 61)
+        mask = ~((numpy.uint64(1) << (64 - plen).astype(numpy.uint64)) - numpy.uint64(1))
+        return addr & mask, plen
+
+    def _batch(self):
+        """Draw the values of batch_size updates, return them as lists of python objects."""
+        rng = self.rng
+        n = self.batch_size
+        addr, plen = self._prefixes((n, self.max_prefix))
+        addr6, plen6 = self._prefixes6((n, self.max_prefix)) if self.ipv6_share else (addr, plen)
+        batch = {
+            'nexthop': rng.integers(0, len(self.nexthops), n),
+            'med': rng.integers(0, 101, n),
+            'origin': rng.integers(0, len(ORIGINS), n),
+            'local_pref': rng.integers(100, 151, n),
+            'path_len': rng.integers(0, self.max_as_path + 1, n),
+            'asns': rng.integers(1, 65000, (n, self.max_as_path)),
+            'nprefix': rng.integers(1, self.max_prefix + 1, n),
+            'addr': addr,
+            'plen': plen,
+            'addr6': addr6,
+            'plen6': plen6,
+            'ipv6': rng.random(n),
+            'announce': rng.random(n),
+            'withdraw': rng.random(n),
+            'pick': rng.random((n, self.max_prefix)),
+        }
+        return dict((k, v.tolist()) for k, v in batch.items())
+
+    def _update(self, batch, i):
+        attr = {
+            'nexthop': self.nexthops[batch['nexthop'][i]],
+            'med': batch['med'][i],
+            'origin': ORIGINS[batch['origin'][i]],
+            'as_path': [self.local_as] + batch['asns'][i][:batch['path_len'][i]],
+            'local_pref': batch['local_pref'][i],
+        }
+        nprefix = batch['nprefix'][i]
+        if batch['ipv6'][i] < self.ipv6_share:
+            prefixes = [Prefix6.from_int(a << 64, l)
+                        for a, l in zip(batch['addr6'][i][:nprefix], batch['plen6'][i][:nprefix])]
+        else:
+            prefixes = [Prefix.from_int(a, l)
+                        for a, l in zip(batch['addr'][i][:nprefix], batch['plen'][i][:nprefix])]
+        update = {'attr': attr, 'nlri': [], 'withdraw': []}
+        if self.update_type == 'announce':
+            update['nlri'] = prefixes
+        elif self.update_type == 'withdraw':
+            update['withdraw'] = prefixes
+        else:
+            announced = self.announced
+            p_withdraw = withdraw_probability(len(announced), self.table_size)
+            if batch['withdraw'][i] < p_withdraw and announced:
+                update['withdraw'] = announced.pick_many(batch['pick'][i][:nprefix])
+                for prefix in update['withdraw']:
+                    announced.remove(prefix)
+            if batch['announce'][i] >= p_withdraw:
+                for prefix in prefixes:
+                    announced.add(prefix)
+                update['nlri'] = prefixes
+        return update
+
+    def __iter__(self):
+        while True:
+            batch = self._batch()
+            for i in range(self.batch_size):
+                yield self._update(batch, i)
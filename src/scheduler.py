@@ -0,0 +1,96 @@
+"""Pace updates, on an asyncio event loop or in a plain loop."""
+import time
+
+
+class Scheduler(object):
+    """Deadline based pacing.
+
+    With a rate, update n is due at start + n / rate; without one, an update is due at its
+    timestamp relative to the first one, divided by `speed` (60 replays an hour in a minute,
+    keeping its bursts). Updates already due, such as those sharing a timestamp, are sent
+    back to back in a burst, so time lost in sending or oversleeping is made up instead of
+    accumulating as drift. Lag beyond `max_lag` seconds is forgiven rather than caught up,
+    which bounds the size of a burst.
+    """
+    def __init__(self, rate=None, speed=1.0, max_lag=1.0, min_sleep=0.001, yield_every=256):
+        self.rate = float(rate) if rate else None
+        self.speed = float(speed or 1.0)
+        self.max_lag = max_lag
+        self.min_sleep = min_sleep
+        self.yield_every = yield_every
+        self.start = None
+        self.first_ts = None
+        self.sent = 0
+        self.lag = 0.0
+        self.max_seen_lag = 0.0
+        self.total_lag = 0.0
+        self.forgiven = 0.0
+
+    def deadline(self, timestamp=None):
+        if self.rate:
+            return self.start + self.sent / self.rate
+        if self.first_ts is None:
+            self.first_ts = timestamp
+        return self.start + (timestamp - self.first_ts) / self.speed
+
+    def _due(self, timestamp):
+        if self.start is None:
+            self.start = time.monotonic()
+        return self.deadline(timestamp)
+
+    def _account(self, deadline):
+        lag = max(0.0, time.monotonic() - deadline)
+        if lag > self.max_lag:
+            self.start += lag - self.max_lag
+            self.forgiven += lag - self.max_lag
+            lag = self.max_lag
+        self.lag = lag
+        self.total_lag += lag
+        self.max_seen_lag = max(self.max_seen_lag, lag)
+        self.sent += 1
+
+    async def wait(self, timestamp=None):
+        """Wait until the next update is due."""
+        import asyncio
+        deadline = self._due(timestamp)
+        delay = deadline - time.monotonic()
+        if delay > self.min_sleep:
+            await asyncio.sleep(delay)
+        elif self.sent % self.yield_every == 0:
+            # let the agent's I/O run during long bursts
+            await asyncio.sleep(0)
+        self._account(deadline)
+
+    def wait_sync(self, timestamp=None):
+        """Sleep until the next update is due, for agents sending without an event loop."""
+        deadline = self._due(timestamp)
+        delay = deadline - time.monotonic()
+        if delay > self.min_sleep:
+            time.sleep(delay)
+        self._account(deadline)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start if self.start is not None else 0.0
+        return {
+            'sent': self.sent,
+            'elapsed': elapsed,
+            'requested_rate': self.rate,
+            'speed': self.speed,
+            'achieved_rate': self.sent / elapsed if elapsed else 0.0,
+            'lag': self.lag,
+            'avg_lag': self.total_lag / self.sent if self.sent else 0.0,
+            'max_lag': self.max_seen_lag,
+            'forgiven_lag': self.forgiven,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        if stats['requested_rate']:
+            requested = '%.1f/s' % stats['requested_rate']
+        elif stats['speed'] != 1.0:
+            requested = 'timestamps at %gx' % stats['speed']
+        else:
+            requested = 'timestamps'
+        return ('sent %d updates in %.1fs: %.1f/s (requested %s), lag avg %.2fms max %.2fms, %.2fs forgiven' % (
+            stats['sent'], stats['elapsed'], stats['achieved_rate'], requested,
+            stats['avg_lag'] * 1000, stats['max_lag'] * 1000, stats['forgiven_lag']))
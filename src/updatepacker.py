@@ -0,0 +1,205 @@
+"""Pack updates sharing the same attributes into as few UPDATE messages as possible."""
+import time
+import threading
+
+from attrcache import attr_key
+from bgpprefix import parse_prefix, split_families
+from bgpspeaker import wire_attributes, MAX_MSG_LEN, HEADER_LEN
+
+# MP_REACH_NLRI header (extended length) with AFI, SAFI, a 16 octet nexthop and a reserved octet
+MP_OVERHEAD = 4 + 4 + 16 + 1
+
+
+def prefix_size(prefix):
+    """Size of a prefix in the NLRI or withdrawn routes field."""
+    return len(parse_prefix(prefix))
+
+
+def attributes_size(attr):
+    """Size of the path attributes of attr on the wire, as sent to peers with 2 or 4 octet AS
+    numbers: attributes read from a MRT file are sent in the encoding they were read in."""
+    return max(len(wire_attributes(attr, True)), len(wire_attributes(attr, False)))
+
+
+class UpdatePacker(object):
+    """Wrap an agent and coalesce the updates sent to it.
+
+    Announcements are grouped by attribute set and withdrawals are batched together until
+    `window` seconds have passed since the first pending update or `size` prefixes are
+    pending. Only the last action on a prefix is kept, so the peer ends up in the same state
+    as if every update had been sent. Each update handed to the agent fills at most one
+    UPDATE message.
+
+    The window is also checked by a timer thread, so the last pending prefixes, or those
+    followed by a gap in the updates, are not held longer. Pending updates are added and
+    drained under `lock`; packed updates are drained and sent under `send_lock`, which keeps
+    them in order without holding up updates being added while the agent is busy. The timer
+    skips a check while updates are being sent.
+
+    `log`, a convergence.EventLog, logs the packed updates as they are handed to the agent.
+    """
+    def __init__(self, agent, window=1.0, size=10000):
+        self.agent = agent
+        self.window = window
+        self.size = size
+        self.announce = {}
+        self.attrs = {}
+        self.prefix_keys = {}
+        self.withdraw = {}
+        self.pending = 0
+        self.first = None
+        self.updates_in = 0
+        self.prefixes_in = 0
+        self.updates_out = 0
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.log = None
+        self.stopped = threading.Event()
+        self.timer = None
+
+    def start(self, *args):
+        self.timer = threading.Thread(target=self._expire)
+        self.timer.daemon = True
+        self.timer.start()
+        return self.agent.start(*args)
+
+    def _expire(self):
+        interval = max(self.window / 4, 0.01)
+        while not self.stopped.wait(interval):
+            if not self.send_lock.acquire(blocking=False):
+                # sending already, checked again next time
+                continue
+            try:
+                with self.lock:
+                    expired = self.first is not None and time.time() - self.first >= self.window
+                    packed = self._drain() if expired else []
+                self._send(packed)
+            finally:
+                self.send_lock.release()
+
+    def connected(self, *args):
+        return self.agent.connected(*args)
+
+    def stop(self):
+        self.stopped.set()
+        if self.timer is not None:
+            self.timer.join()
+        self.flush()
+        print('packed %d updates (%d prefixes) into %d, ratio %.1f' % (
+            self.updates_in, self.prefixes_in, self.updates_out, self.ratio()))
+        return self.agent.stop()
+
+    def ratio(self):
+        return float(self.updates_in) / self.updates_out if self.updates_out else 0.0
+
+    def _forget(self, prefix):
+        key = self.prefix_keys.pop(prefix, None)
+        if key is not None:
+            del self.announce[key][prefix]
+            self.pending -= 1
+        elif self.withdraw.pop(prefix, None) is not None:
+            self.pending -= 1
+
+    def _add(self, update):
+        """Queue an update, return True when it is time to flush."""
+        nlri = update.get('nlri') or []
+        withdraw = update.get('withdraw') or []
+        self.updates_in += 1
+        self.prefixes_in += len(nlri) + len(withdraw)
+        if self.first is None:
+            self.first = time.time()
+        for prefix in withdraw:
+            prefix = parse_prefix(prefix)
+            self._forget(prefix)
+            self.withdraw[prefix] = True
+            self.pending += 1
+        if nlri:
+            key = attr_key(update['attr'])
+            if key not in self.announce:
+                self.announce[key] = {}
+                self.attrs[key] = update['attr']
+            group = self.announce[key]
+            for prefix in nlri:
+                prefix = parse_prefix(prefix)
+                self._forget(prefix)
+                group[prefix] = True
+                self.prefix_keys[prefix] = key
+                self.pending += 1
+        return self.pending >= self.size or time.time() - self.first >= self.window
+
+    def send_update(self, update):
+        with self.lock:
+            due = self._add(update)
+        if due:
+            self.flush()
+
+    async def send_update_async(self, update):
+        with self.lock:
+            due = self._add(update)
+        if not due:
+            return
+        send_update_async = getattr(self.agent, 'send_update_async', None)
+        if send_update_async is None:
+            self.flush()
+            return
+        log = self.log
+        with self.send_lock:
+            with self.lock:
+                packed = self._drain()
+            for update in packed:
+                if log:
+                    log.log(update)
+                await send_update_async(update)
+
+    def _chunks(self, prefixes, room):
+        chunk = []
+        used = 0
+        for prefix in prefixes:
+            size = prefix_size(prefix)
+            if used + size > room and chunk:
+                yield chunk
+                chunk = []
+                used = 0
+            chunk.append(prefix)
+            used += size
+        if chunk:
+            yield chunk
+
+    def _drain(self):
+        """Return the packed updates for everything pending, withdrawals first. IPv4 and IPv6
+        prefixes are packed apart, as they go in different messages."""
+        room = MAX_MSG_LEN - HEADER_LEN - 4
+        packed = []
+        withdraw, withdraw6 = split_families(self.withdraw)
+        for prefixes, overhead in ((withdraw, 0), (withdraw6, MP_OVERHEAD)):
+            for chunk in self._chunks(prefixes, room - overhead):
+                packed.append({'attr': {}, 'nlri': [], 'withdraw': chunk})
+        for key, group in self.announce.items():
+            attr = self.attrs[key]
+            attr_room = room - attributes_size(attr)
+            nlri, nlri6 = split_families(group)
+            for prefixes, overhead in ((nlri, 0), (nlri6, MP_OVERHEAD)):
+                for chunk in self._chunks(prefixes, attr_room - overhead):
+                    packed.append({'attr': attr, 'nlri': chunk, 'withdraw': []})
+        self.updates_out += len(packed)
+        self.announce = {}
+        self.attrs = {}
+        self.prefix_keys = {}
+        self.withdraw = {}
+        self.pending = 0
+        self.first = None
+        return packed
+
+    def flush(self):
+        """Send everything pending."""
+        with self.send_lock:
+            with self.lock:
+                packed = self._drain()
+            self._send(packed)
+
+    def _send(self, packed):
+        log = self.log
+        for update in packed:
+            if log:
+                log.log(update)
+            self.agent.send_update(update)
@@ -0,0 +1,258 @@
+"""Update trace files: a recorded stream of updates replayed byte for byte.
+
+A trace starts with a header and JSON metadata, followed by length prefixed records, the
+whole record stream optionally compressed with zstd or lz4 (frame format):
+
+- header:  magic 'BGPT', version, compression, flags (1: records carry timestamps), length of
+           the metadata
+- record:  uint32 length of the body, then the body, whose first octet is its type
+- ATTR:    JSON of an attribute set, which gets the next attribute id
+- RAWATTR: an attribute set decoded from a MRT file, kept in wire format so agents can still
+           send it as is: AS4 flag octet, length octet and text of the nexthop, the attributes
+- RESET:   forget the attribute sets defined so far, ids start from 0 again
+- UPDATE:  float64 timestamp (NaN for none), uint32 attribute id (NO_ATTR for withdraw-only
+           updates), uint32 number of announced and of withdrawn prefixes, then each prefix as
+           its address family octet followed by the prefix in NLRI wire format
+
+Integers and floats are little endian. Attribute sets are written once and referred to by id,
+so replaying a trace hands the agents the same attribute dict for every update sharing it.
+"""
+import json
+import math
+import struct
+
+from attrcache import attr_key
+from bgpprefix import PREFIX_TYPES, parse_prefix
+from pybgpdump import PathAttributes
+
+MAGIC = b'BGPT'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxI')
+LENGTH = struct.Struct('<I')
+UPDATE = struct.Struct('<BdIII')
+REC_ATTR = 1
+REC_RESET = 2
+REC_UPDATE = 3
+REC_RAW_ATTR = 4
+NO_ATTR = 0xffffffff
+FLAG_TIMESTAMPS = 1
+COMPRESSIONS = {'none': 0, 'zstd': 1, 'lz4': 2}
+BLOCK_SIZE = 1 << 20
+
+
+def _compressed_writer(f, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).stream_writer(f)
+    if compression == 'lz4':
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(f, 'wb')
+    return f
+
+
+def _compressed_reader(f, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    if compression == 'lz4':
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(f, 'rb')
+    return f
+
+
+class RecordEncoder(object):
+    """Encode (timestamp, update) pairs into records, defining attribute sets as they are first
+    seen. Up to max_attrs attribute sets are remembered; past that the table is reset, which
+    bounds memory on both ends when every update has attributes of its own."""
+    def __init__(self, max_attrs=1 << 16):
+        self.max_attrs = max_attrs
+        self.attr_ids = {}
+
+    @staticmethod
+    def _record(out, body):
+        out += LENGTH.pack(len(body))
+        out += body
+
+    def _attr_id(self, attr, out):
+        key = attr_key(attr)
+        attr_id = self.attr_ids.get(key)
+        if attr_id is None:
+            if len(self.attr_ids) >= self.max_attrs:
+                self._record(out, bytes((REC_RESET,)))
+                self.attr_ids.clear()
+            attr_id = self.attr_ids[key] = len(self.attr_ids)
+            raw = getattr(attr, 'raw', None)
+            if raw is not None:
+                nexthop = str(attr.get('nexthop') or '').encode('ascii')
+                self._record(out, bytes((REC_RAW_ATTR, attr.as4, len(nexthop))) + nexthop + raw)
+            else:
+                self._record(out, bytes((REC_ATTR,)) + json.dumps(attr, sort_keys=True).encode('utf-8'))
+        return attr_id
+
+    def encode(self, timestamp, update, out):
+        """Append the records of an update to the bytearray out."""
+        nlri = [parse_prefix(prefix) for prefix in update.get('nlri') or []]
+        withdraw = [parse_prefix(prefix) for prefix in update.get('withdraw') or []]
+        attr_id = self._attr_id(update['attr'], out) if nlri else NO_ATTR
+        body = bytearray(UPDATE.pack(REC_UPDATE, float('nan') if timestamp is None else timestamp,
+                                     attr_id, len(nlri), len(withdraw)))
+        for prefix in nlri + withdraw:
+            body.append(prefix.afi)
+            body += prefix
+        self._record(out, body)
+
+
+def _raw_attributes(body):
+    end = 3 + body[2]
+    attr = PathAttributes(body[end:], bool(body[1]))
+    if end > 3:
+        # the nexthop was rewritten before recording, setting it keeps the wire encoding
+        attr['nexthop'] = body[3:end].decode('ascii')
+    return attr
+
+
+class RecordDecoder(object):
+    """Decode records back into (timestamp, update) pairs. Attribute dicts are shared between
+    updates and must not be modified."""
+    def __init__(self):
+        self.attrs = []
+
+    def decode(self, body):
+        """Return the (timestamp, update) of an update record, None for other records."""
+        rec_type = body[0]
+        if rec_type == REC_UPDATE:
+            _, timestamp, attr_id, n_nlri, n_withdraw = UPDATE.unpack_from(body)
+            pos = UPDATE.size
+            types = PREFIX_TYPES
+            prefixes = []
+            for _ in range(n_nlri + n_withdraw):
+                end = pos + 2 + (body[pos + 1] + 7) // 8
+                prefixes.append(types[body[pos]](body[pos + 1:end]))
+                pos = end
+            return (None if math.isnan(timestamp) else timestamp, {
+                'attr': self.attrs[attr_id] if attr_id != NO_ATTR else {},
+                'nlri': prefixes[:n_nlri],
+                'withdraw': prefixes[n_nlri:],
+                })
+        if rec_type == REC_ATTR:
+            self.attrs.append(json.loads(body[1:].decode('utf-8')))
+        elif rec_type == REC_RAW_ATTR:
+            self.attrs.append(_raw_attributes(body))
+        elif rec_type == REC_RESET:
+            self.attrs = []
+        return None
+
+    def updates(self, buf):
+        """Yield the (timestamp, update) pairs of a buffer holding whole records."""
+        pos = 0
+        end = len(buf)
+        unpack_length = LENGTH.unpack_from
+        decode = self.decode
+        while pos < end:
+            length, = unpack_length(buf, pos)
+            update = decode(buf[pos + 4:pos + 4 + length])
+            pos += 4 + length
+            if update is not None:
+                yield update
+
+
+class TraceWriter(object):
+    """Write (timestamp, update) pairs to a trace file."""
+    def __init__(self, filename, compression='none', timestamps=True, metadata=None, max_attrs=1 << 16):
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown compression %s, expected one of %s' % (
+                compression, ', '.join(sorted(COMPRESSIONS))))
+        self.f = open(filename, 'wb')
+        meta = json.dumps(metadata or {}, sort_keys=True).encode('utf-8')
+        flags = FLAG_TIMESTAMPS if timestamps else 0
+        self.f.write(HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression], flags, len(meta)) + meta)
+        self.out = _compressed_writer(self.f, compression)
+        self.buf = bytearray()
+        self.encoder = RecordEncoder(max_attrs)
+        self.count = 0
+
+    def write(self, timestamp, update):
+        self.encoder.encode(timestamp, update, self.buf)
+        self.count += 1
+        if len(self.buf) >= BLOCK_SIZE:
+            self.out.write(self.buf)
+            del self.buf[:]
+
+    def close(self):
+        if self.buf:
+            self.out.write(self.buf)
+            del self.buf[:]
+        if self.out is not self.f:
+            self.out.close()
+        if not self.f.closed:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TraceReader(object):
+    """Iterate over the (timestamp, update) pairs of a trace file, timestamp None when the
+    trace has none. The stream is read in blocks of BLOCK_SIZE and records are sliced out of
+    them."""
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        magic, version, compression, flags, meta_len = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            self.f.close()
+            raise ValueError('%s is not a trace file' % filename)
+        self.metadata = json.loads(self.f.read(meta_len).decode('utf-8'))
+        self.compression = dict((v, k) for k, v in COMPRESSIONS.items())[compression]
+        self.timestamps = bool(flags & FLAG_TIMESTAMPS)
+        self.stream = _compressed_reader(self.f, self.compression)
+
+    def close(self):
+        if self.stream is not self.f:
+            self.stream.close()
+        if not self.f.closed:
+            self.f.close()
+
+    def _records(self):
+        """Yield the body of every record."""
+        buf = b''
+        pos = 0
+        unpack_length = LENGTH.unpack_from
+        while True:
+            block = self.stream.read(BLOCK_SIZE)
+            if not block:
+                if pos < len(buf):
+                    raise ValueError('truncated trace record')
+                return
+            buf = buf[pos:] + block
+            pos = 0
+            end = len(buf)
+            while pos + 4 <= end:
+                length, = unpack_length(buf, pos)
+                if pos + 4 + length > end:
+                    break
+                yield buf[pos + 4:pos + 4 + length]
+                pos += 4 + length
+
+    def __iter__(self):
+        decode = RecordDecoder().decode
+        try:
+            for body in self._records():
+                update = decode(body)
+                if update is not None:
+                    yield update
+        finally:
+            self.close()
+
+
+def record(updates, filename, compression='none', timestamps=True, metadata=None, count=0):
+    """Write the (timestamp, update) pairs from updates to a trace file, at most count of them
+    if count is set. Returns the number of updates written."""
+    with TraceWriter(filename, compression, timestamps, metadata) as writer:
+        for timestamp, update in updates:
+            writer.write(timestamp, update)
+            if count and writer.count >= count:
+                break
+    return writer.count
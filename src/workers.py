@@ -0,0 +1,177 @@
+"""Generate random updates in several processes at once.
+
+One process generating and encoding random updates runs on one core, which is not enough to
+keep a fast peer busy. The coordinator forks `workers` generators instead, each producing its
+share of the count. Worker i only draws prefixes from the i-th of `workers` disjoint slices of
+the address space (see randgen.shard_range), so workers never announce or withdraw each
+other's prefixes, and uses a seed derived from the master seed: the same master seed and
+number of workers give every worker the same updates.
+
+Workers do not talk to the peers: a router would see the sessions of several workers from
+the same address, AS and router id as collisions and reset all but one. Each worker encodes
+its updates as trace records into a ring of shared memory slots (see pipeline.SharedRing),
+and the coordinator sends them all, at the configured rate, over one session per peer. As
+workers own disjoint prefixes, interleaving their updates keeps every prefix in order. They are
+interleaved `turn` updates of each worker at a time, whatever the slots they came in, so the
+order sent depends on the master seed and number of workers only.
+"""
+import sys
+import time
+import itertools
+import traceback
+import multiprocessing
+
+import numpy
+
+
+def worker_seeds(seed, workers):
+    """Derive the seed of each worker from the master seed."""
+    children = numpy.random.SeedSequence(seed).spawn(workers)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def split(total, workers):
+    """Split total into workers shares differing by at most one."""
+    return [total // workers + (1 if i < total % workers else 0) for i in range(workers)]
+
+
+class Coordinator(object):
+    """Generate updates with make_source(config) in `workers` processes, each with its own
+    shard, seed and share of the count, and send them with the generator make_generator(config,
+    source). The master seed is drawn and printed when config['seed'] is not set, so a run can
+    be reproduced."""
+    turn = 64
+
+    def __init__(self, config, make_generator, make_source, workers):
+        self.config = config
+        self.make_generator = make_generator
+        self.make_source = make_source
+        self.workers = workers
+        self.seed = config['seed']
+        if self.seed is None:
+            self.seed = numpy.random.SeedSequence().entropy
+        self.counts = []
+        self.procs = []
+        # workers terminated once sending stopped
+        self.stopped = set()
+        self.rings = []
+
+    def worker_configs(self):
+        """Return the config of every worker."""
+        workers = self.workers
+        config = self.config
+        configs = []
+        for index, (seed, count) in enumerate(zip(worker_seeds(self.seed, workers),
+                                                  split(config['count'], workers))):
+            worker = dict(config)
+            worker.update({
+                'seed': seed,
+                'shard': (index, workers),
+                'count': count,
+                'workers': 1,
+            })
+            if config['count'] and not count:
+                continue
+            configs.append(worker)
+        return configs
+
+    def _run_worker(self, config, ring):
+        from pipeline import _produce_records
+        try:
+            updates = self.make_source(config)
+            if config['count']:
+                updates = itertools.islice(updates, config['count'])
+        except Exception:
+            traceback.print_exc()
+            ring.put(b'', True)
+            sys.exit(1)
+        # exits with 1 if the source fails
+        _produce_records(updates, [], ring, 0.05)
+
+    def _worker_updates(self, index):
+        """Yield the updates of worker index until it is done."""
+        from updatetrace import RecordDecoder
+        decoder = RecordDecoder()
+        ring = self.rings[index]
+        alive = self.procs[index].is_alive
+        while True:
+            data = ring.get(alive)
+            if not data:
+                # done, or failed: the exit code tells
+                return
+            for item in decoder.updates(data):
+                yield item
+
+    def _updates(self):
+        """Yield the updates of the workers, `turn` of each in turn."""
+        streams = [self._worker_updates(index) for index in range(len(self.rings))]
+        active = list(range(len(streams)))
+        counts = self.counts
+        turn = self.turn
+        while active:
+            for index in list(active):
+                taken = 0
+                for item in itertools.islice(streams[index], turn):
+                    taken += 1
+                    counts[index] += 1
+                    yield item
+                if taken < turn:
+                    active.remove(index)
+
+    def _register_metrics(self, registry):
+        counts = self.counts
+
+        def worker_samples():
+            return [('worker_updates', {'worker': index}, count) for index, count in enumerate(counts)]
+        registry.add_collector(worker_samples)
+
+    def run(self):
+        """Start the workers and send their updates until they are done. Returns the number
+        of workers which failed, plus one if sending failed."""
+        from pipeline import SharedRing
+        context = multiprocessing.get_context('fork')
+        configs = self.worker_configs()
+        self.counts = [0] * len(configs)
+        print('%d workers, master seed %d' % (len(configs), self.seed))
+        sender = self.make_generator(dict(self.config, workers=1), self._updates)
+        self._register_metrics(sender.metrics)
+        for config in configs:
+            ring = SharedRing(self.config['pipeline_depth'], context=context)
+            proc = context.Process(target=self._run_worker, args=(config, ring))
+            proc.start()
+            self.rings.append(ring)
+            self.procs.append(proc)
+        start = time.time()
+        failed = 0
+        try:
+            if sender.run() is False:
+                failed = 1
+        except Exception:
+            traceback.print_exc()
+            failed = 1
+        finally:
+            elapsed = time.time() - start
+            for index, proc in enumerate(self.procs):
+                if proc.is_alive():
+                    # sending stopped early (count reached, interrupted or failed)
+                    proc.terminate()
+                    self.stopped.add(index)
+                proc.join()
+            for ring in self.rings:
+                ring.close(unlink=True)
+        print(self.summary(elapsed))
+        return failed + sum(1 for proc in self.procs if proc.exitcode and proc.exitcode > 0)
+
+    def summary(self, elapsed):
+        total = sum(self.counts)
+        lines = ['%d updates from %d workers in %.1fs (%.1f/s)' % (
+            total, len(self.counts), elapsed, total / elapsed if elapsed else 0.0)]
+        for index, (count, proc) in enumerate(zip(self.counts, self.procs)):
+            if index in self.stopped:
+                status = ', stopped'
+            elif proc.exitcode:
+                status = ', exit code %s' % proc.exitcode
+            else:
+                status = ''
+            lines.append('  worker %d: %d updates%s' % (index, count, status))
+        return '\n'.join(lines)
@@ -0,0 +1,229 @@
+"""Synthetic workloads: full table load, churn and flap storms.
+
+A scenario is a list of phases run one after the other, each at its own rate, for example
+    load:rate=5000,churn:duration=300:rate=50,storm:count=20000:rate=1000:prefixes=500
+
+- load:  announce the whole table (table_size prefixes)
+- churn: withdraw or re-announce (with a new AS path) random prefixes of the table
+- storm: flap a fixed subset of `prefixes` prefixes, each event toggling one of them
+
+Prefix lengths, AS path lengths, prefixes per update and the share of withdrawals follow
+distributions which can be fitted from a MRT sample. The table is held in NumPy arrays
+(10 bytes per prefix), and AS paths are derived from a per-prefix attribute group id on demand,
+so millions of prefixes are cheap to hold.
+"""
+import numpy
+
+from bgpprefix import Prefix, parse_prefix
+
+# rough shape of the IPv4 default-free zone
+DEFAULT_DISTRIBUTIONS = {
+    'prefix_len': {8: 0.0002, 12: 0.0004, 13: 0.001, 14: 0.002, 15: 0.003, 16: 0.014, 17: 0.008,
+                   18: 0.014, 19: 0.025, 20: 0.04, 21: 0.045, 22: 0.12, 23: 0.1, 24: 0.6273},
+    'as_path_len': {1: 0.02, 2: 0.15, 3: 0.33, 4: 0.28, 5: 0.13, 6: 0.06, 7: 0.02, 8: 0.01},
+    'prefixes_per_update': {1: 0.6, 2: 0.15, 3: 0.08, 4: 0.05, 5: 0.03, 6: 0.02, 8: 0.03, 16: 0.02, 32: 0.02},
+    'withdraw_fraction': 0.2,
+}
+PHASES = ('load', 'churn', 'storm')
+# parameters of every phase, besides rate, duration and count
+PHASE_PARAMS = {'load': (), 'churn': ('withdraw',), 'storm': ('prefixes',)}
+
+
+def _normalize(counts):
+    total = float(sum(counts.values()))
+    return dict((k, v / total) for k, v in counts.items()) if total else {}
+
+
+def fit_distributions(stream, limit=100000):
+    """Fit the workload distributions from the first `limit` updates of a BGPDump stream."""
+    prefix_len = {}
+    as_path_len = {}
+    per_update = {}
+    announced = withdrawn = 0
+    for _, (_, attr, nlri, withdraw) in zip(range(limit), stream):
+        for prefix in nlri:
+            prefix = parse_prefix(prefix)
+            if prefix.afi == Prefix.afi:
+                prefix_len[prefix.plen] = prefix_len.get(prefix.plen, 0) + 1
+        if nlri:
+            length = len(attr.get('as_path') or [])
+            as_path_len[length] = as_path_len.get(length, 0) + 1
+            per_update[len(nlri)] = per_update.get(len(nlri), 0) + 1
+        announced += len(nlri)
+        withdrawn += len(withdraw)
+    distributions = dict(DEFAULT_DISTRIBUTIONS)
+    for name, counts in (('prefix_len', prefix_len), ('as_path_len', as_path_len),
+                         ('prefixes_per_update', per_update)):
+        if counts:
+            distributions[name] = _normalize(counts)
+    if announced + withdrawn:
+        distributions['withdraw_fraction'] = float(withdrawn) / (announced + withdrawn)
+    return distributions
+
+
+def parse_scenario(text):
+    """Parse 'phase[:key=value]*,...' into a list of (phase, params)."""
+    phases = []
+    for spec in text.split(','):
+        fields = spec.strip().split(':')
+        name = fields[0]
+        if name not in PHASES:
+            raise ValueError('unknown phase %s, expected one of %s' % (name, ', '.join(PHASES)))
+        keys = ('rate', 'duration', 'count') + PHASE_PARAMS[name]
+        params = {}
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            if key not in keys:
+                raise ValueError('unknown parameter %s of phase %s, expected one of %s' % (
+                    key, name, ', '.join(keys)))
+            try:
+                params[key] = float(value)
+            except ValueError:
+                raise ValueError('parameter %s of phase %s is not a number: %r' % (key, name, value))
+            if key == 'duration' and params[key] < 0:
+                raise ValueError('duration of phase %s is negative: %r' % (name, value))
+            elif key == 'withdraw' and not 0 <= params[key] <= 1:
+                raise ValueError('withdraw of phase %s is not between 0 and 1: %r' % (name, value))
+            elif key in ('rate', 'count', 'prefixes') and params[key] <= 0:
+                raise ValueError('%s of phase %s is not positive: %r' % (key, name, value))
+        phases.append((name, params))
+    return phases
+
+
+class Workload(object):
+    """Generate the phases of a scenario over a table of table_size prefixes."""
+    def __init__(self, local_as, nexthops, table_size=900000, distributions=None, seed=None):
+        self.local_as = local_as
+        self.nexthops = [str(nexthop) for nexthop in nexthops] or [None]
+        self.table_size = table_size
+        self.dist = distributions or DEFAULT_DISTRIBUTIONS
+        self.rng = numpy.random.default_rng(seed)
+        self.path_lens = self._draw('as_path_len', 4096).tolist()
+        self.addrs = None
+
+    def _draw(self, name, size):
+        values, probs = zip(*sorted(self.dist[name].items()))
+        probs = numpy.array(probs) / sum(probs)
+        return self.rng.choice(numpy.array(values), size=size, p=probs)
+
+    def build_table(self):
+        """Draw table_size distinct prefixes, sorted by address."""
+        keys = numpy.empty(0, dtype=numpy.uint64)
+        while len(keys) < self.table_size:
+            n = int((self.table_size - len(keys)) * 1.1) + 16
+            plen = self._draw('prefix_len', n).astype(numpy.uint64)
+            addr = self.rng.integers(1 << 24, 224 << 24, n, dtype=numpy.uint64)
+            addr &= (numpy.uint64(0xffffffff) << (numpy.uint64(32) - plen)) & numpy.uint64(0xffffffff)
+            keys = numpy.unique(numpy.concatenate([keys, (addr << numpy.uint64(8)) | plen]))
+        keys = keys[self.rng.permutation(len(keys))[:self.table_size]]
+        keys.sort()
+        self.addrs = (keys >> numpy.uint64(8)).astype(numpy.uint32)
+        self.lens = (keys & numpy.uint64(0xff)).astype(numpy.uint8)
+        self.groups = numpy.zeros(self.table_size, dtype=numpy.uint32)
+        self.announced = numpy.zeros(self.table_size, dtype=bool)
+        self.next_group = 0
+
+    def _attr(self, group):
+        """Attributes of an attribute group, derived from its id."""
+        h = (group * 2654435761 + 1) & 0xffffffff
+        as_path = [self.local_as]
+        x = h
+        for _ in range(self.path_lens[h % len(self.path_lens)]):
+            x = (x * 1103515245 + 12345) & 0x7fffffff
+            as_path.append(1 + x % 64999)
+        return {
+            'nexthop': self.nexthops[h % len(self.nexthops)],
+            'origin': 'igp',
+            'as_path': as_path,
+            'med': h % 101,
+        }
+
+    def _prefix(self, i):
+        return Prefix.from_int(int(self.addrs[i]), int(self.lens[i]))
+
+    def _announce(self, indexes, group=None):
+        if group is None:
+            group = self.next_group
+            self.next_group += 1
+        self.groups[indexes] = group
+        self.announced[indexes] = True
+        return {'attr': self._attr(group), 'nlri': [self._prefix(i) for i in indexes], 'withdraw': []}
+
+    def _withdraw(self, indexes):
+        self.announced[indexes] = False
+        return {'attr': {}, 'nlri': [], 'withdraw': [self._prefix(i) for i in indexes]}
+
+    def load(self, count=None):
+        """Announce the whole table, prefixes_per_update consecutive prefixes per update."""
+        if self.addrs is None:
+            self.build_table()
+        sizes = self._draw('prefixes_per_update', self.table_size).tolist()
+        start = sent = 0
+        while start < self.table_size and (count is None or sent < count):
+            end = min(start + sizes[sent], self.table_size)
+            yield self._announce(numpy.arange(start, end))
+            start = end
+            sent += 1
+
+    def churn(self, count, withdraw=None):
+        """Withdraw announced prefixes or announce prefixes with new attributes."""
+        if self.addrs is None:
+            self.build_table()
+        if withdraw is None:
+            withdraw = self.dist['withdraw_fraction']
+        batch = 4096
+        width = min(max(self.dist['prefixes_per_update']), 64)
+        sent = 0
+        while sent < count:
+            actions = self.rng.random(batch).tolist()
+            sizes = self._draw('prefixes_per_update', batch).tolist()
+            picks = self.rng.integers(0, self.table_size, (batch, width)).tolist()
+            for action, size, pick in zip(actions, sizes, picks):
+                if sent >= count:
+                    return
+                if action < withdraw:
+                    indexes = [i for i in dict.fromkeys(pick[:size]) if self.announced[i]]
+                    if indexes:
+                        yield self._withdraw(indexes)
+                        sent += 1
+                        continue
+                yield self._announce(list(dict.fromkeys(pick[:size])))
+                sent += 1
+
+    def storm(self, count, prefixes=1000):
+        """Flap `prefixes` random prefixes of the table, one toggle per update."""
+        if self.addrs is None:
+            self.build_table()
+        subset = self.rng.choice(self.table_size, size=min(int(prefixes), self.table_size), replace=False)
+        subset = subset.tolist()
+        for n in range(count):
+            i = subset[n % len(subset)]
+            if self.announced[i]:
+                yield self._withdraw([i])
+            else:
+                # a flapping route comes back with the same attributes
+                yield self._announce([i], int(self.groups[i]))
+
+    def run(self, phases, on_phase=None):
+        """Yield (timestamp, update) for a scenario. Timestamps are virtual: each phase starts
+        where the previous one ended and spaces its updates 1/rate apart. on_phase(index, name,
+        rate) is called as each phase starts."""
+        ts = 0.0
+        for index, (name, params) in enumerate(phases):
+            params = dict(params)
+            rate = params.pop('rate', 1000.0)
+            duration = params.pop('duration', None)
+            count = params.pop('count', None)
+            if duration is not None:
+                count = duration * rate
+            if name == 'load':
+                updates = self.load(int(count) if count is not None else None)
+            elif name == 'churn':
+                updates = self.churn(int(count or rate * 60), **params)
+            else:
+                updates = self.storm(int(count or rate * 60), **params)
+            if on_phase is not None:
+                on_phase(index, name, rate)
+            for update in updates:
+                yield ts, update
+                ts += 1.0 / rate
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""Talk to YaBGP through its REST API.
+
+YaBGP sends one BGP UPDATE for every POST to /v1/peer/<address>/send/update, and an UPDATE can
+carry any number of withdrawals plus any number of prefixes sharing one attribute set. The
+updates waiting for a peer are therefore merged into as few requests as possible, which are
+posted over keep-alive connections with at most `max_inflight` requests in flight at once.
+Requests in flight together may be handled by YaBGP in any order, so a request carrying a
+prefix of a request still in flight waits for it: the updates of every prefix reach the peer
+in order, while requests for different prefixes go in parallel.
+
+python yabgpapi.py --listen 127.0.0.1:5555 runs a stub of the API which accepts any update
+and reports the rate, to benchmark against without yabgpd and a BGP router.
+"""
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from latency import Histogram
+
+AUTH = ('admin', 'admin')
+HEADERS = {'content-type': 'application/json'}
+# room left for the prefixes of an UPDATE once the header and attributes are in
+MAX_PREFIX_BYTES = 3072
+
+
+def coalesce(updates, max_bytes=MAX_PREFIX_BYTES):
+    """Merge consecutive updates into as few updates as possible, keeping what the peer ends
+    up with unchanged. An UPDATE withdraws before it announces, so an update withdrawing a
+    prefix announced by the updates merged so far starts a new one, as does an announcement
+    with different attributes."""
+    merged = []
+    attr = None
+    nlri = []
+    withdraw = []
+    announced = set()
+    size = 0
+    for update in updates:
+        update_nlri = update.get('nlri') or []
+        update_withdraw = update.get('withdraw') or []
+        update_size = sum(map(len, update_nlri)) + sum(map(len, update_withdraw))
+        update_attr = update.get('attr') if update_nlri else None
+        if (nlri or withdraw) and (
+                size + update_size > max_bytes
+                or (update_attr is not None and attr is not None
+                    and update_attr is not attr and update_attr != attr)
+                or (announced and any(prefix in announced for prefix in update_withdraw))):
+            merged.append({'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
+            attr = None
+            nlri = []
+            withdraw = []
+            announced = set()
+            size = 0
+        if update_attr is not None:
+            attr = update_attr
+            nlri.extend(update_nlri)
+            announced.update(update_nlri)
+        withdraw.extend(update_withdraw)
+        size += update_size
+    if nlri or withdraw:
+        merged.append({'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
+    return merged
+
+
+class YaBGPClient(object):
+    """Post updates to the API of one yabgpd. send(updates) is called from the peer's worker
+    thread; it merges the updates, renders each merged update with encode(update) and hands the
+    requests to a pool of max_inflight threads, waiting when they are all busy or an earlier
+    request for one of the prefixes is not answered yet."""
+    def __init__(self, url, encode, max_inflight=4, max_bytes=MAX_PREFIX_BYTES):
+        self.url = url
+        self.encode = encode
+        self.max_inflight = max_inflight
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        self.session.auth = AUTH
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_inflight)
+        self.session.mount('http://', adapter)
+        self.pool = ThreadPoolExecutor(max_inflight)
+        self.slots = threading.BoundedSemaphore(max_inflight)
+        self.lock = threading.Lock()
+        # prefix -> requests in flight carrying it
+        self.inflight = {}
+        self.answered = threading.Condition()
+        self.latency = Histogram('%s requests' % url)
+        self.updates = 0
+        self.requests = 0
+        self.errors = 0
+        self.held = 0
+        self.last_error = None
+
+    def send(self, updates):
+        self.updates += len(updates)
+        inflight = self.inflight
+        for update in coalesce(updates, self.max_bytes):
+            prefixes = update['nlri'] + update['withdraw']
+            body = self.encode(update)
+            with self.answered:
+                if any(prefix in inflight for prefix in prefixes):
+                    self.held += 1
+                    while any(prefix in inflight for prefix in prefixes):
+                        self.answered.wait()
+                for prefix in prefixes:
+                    inflight[prefix] = inflight.get(prefix, 0) + 1
+            self.slots.acquire()
+            self.pool.submit(self._post, body, prefixes)
+
+    def _done(self, prefixes):
+        inflight = self.inflight
+        with self.answered:
+            for prefix in prefixes:
+                if inflight[prefix] == 1:
+                    del inflight[prefix]
+                else:
+                    inflight[prefix] -= 1
+            self.answered.notify_all()
+
+    def _post(self, body, prefixes):
+        start = time.monotonic()
+        error = None
+        try:
+            res = self.session.post(self.url, data=body)
+            if not res.ok:
+                error = '%d %s' % (res.status_code, res.text)
+            elif not res.json().get('status', True):
+                error = res.text
+        except (requests.RequestException, ValueError) as e:
+            error = str(e)
+        finally:
+            self._done(prefixes)
+            self.slots.release()
+        with self.lock:
+            self.latency.add(time.monotonic() - start)
+            self.requests += 1
+            if error:
+                self.errors += 1
+                self.last_error = error
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+    def stats(self):
+        stats = {
+            'updates': self.updates,
+            'requests': self.requests,
+            'errors': self.errors,
+            'held': self.held,
+        }
+        stats.update(self.latency.stats())
+        return stats
+
+    def summary(self):
+        text = '%s: %d updates in %d requests, %d errors, %d held for a prefix in flight\n  %s' % (
+            self.url, self.updates, self.requests, self.errors, self.held, self.latency.summary())
+        if self.last_error:
+            text += '\n  last error: %s' % self.last_error
+        return text
+
+
+class StubYaBGP(object):
+    """A stand-in for the REST API of yabgpd, with an established peer taking every update.
+    delay (seconds) is added to every update request to play a slower yabgpd."""
+    def __init__(self, host='127.0.0.1', port=5555, peer='127.0.0.1', delay=0.0):
+        from http.server import ThreadingHTTPServer
+        self.peer = peer
+        self.delay = delay
+        self.requests = 0
+        self.prefixes = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # answer with one segment, flushed at the end of each request
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def _reply(self, obj, code=200):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/v1/peers':
+                    self._reply({'peers': [{'fsm': 'ESTABLISHED', 'remote_addr': stub.peer}]})
+                else:
+                    self._reply({'status': False}, 404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self.path.endswith('/send/update'):
+                    self._reply({'status': False}, 404)
+                    return
+                try:
+                    update = json.loads(body)
+                except ValueError:
+                    self._reply({'status': False, 'code': 'invalid JSON'}, 400)
+                    return
+                if stub.delay:
+                    time.sleep(stub.delay)
+                attr = update.get('attr', {})
+                prefixes = (len(update.get('nlri', [])) + len(update.get('withdraw', []))
+                            + len(attr.get('14', {}).get('nlri', []))
+                            + len(attr.get('15', {}).get('withdraw', [])))
+                with stub.lock:
+                    stub.requests += 1
+                    stub.prefixes += prefixes
+                self._reply({'status': True})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a stub of the YaBGP REST API and report the rate of updates received')
+    parser.add_argument('--listen', default='127.0.0.1:5555', help='address:port to listen on')
+    parser.add_argument('--peer', default='127.0.0.1', help='address of the established peer it reports')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before answering an update')
+    args = parser.parse_args()
+    host, port = args.listen.rsplit(':', 1)
+    stub = StubYaBGP(host, int(port), args.peer, args.delay)
+    stub.start()
+    print('listening on %s:%d' % stub.address)
+    try:
+        while True:
+            requests_, prefixes = stub.requests, stub.prefixes
+            time.sleep(1)
+            print('%d requests/sec, %d prefixes/sec, %d requests total' % (
+                stub.requests - requests_, stub.prefixes - prefixes, stub.requests))
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
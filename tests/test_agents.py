@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bgpplayer import ExaBGPAgent, YaBGPAgent  # noqa: E402
+from pybgpdump import BGPDump  # noqa: E402
+from bgpbench import write_synthetic_mrt  # noqa: E402
+
+
+def _announcement(tmp_path):
+    mrt = str(tmp_path / 'updates.mrt')
+    write_synthetic_mrt(mrt, 200, seed=2)
+    for _, attr, nlri, _ in BGPDump(mrt):
+        if nlri and len(attr['as_path']) > 1:
+            return attr
+
+
+def test_exabgp_renders_attributes_read_by_dpkt(tmp_path):
+    attr = _announcement(tmp_path)
+    text = ExaBGPAgent()._render_attributes(attr, False)
+    assert ' as-path [ %s ]' % ' '.join(str(asn) for asn in attr['as_path']) in text
+    assert "b'" not in text
+
+
+def test_yabgp_renders_attributes_read_by_dpkt(tmp_path):
+    attr = _announcement(tmp_path)
+    members = YaBGPAgent()._render_attributes(attr)[0]
+    assert json.loads('{%s}' % members)['2'] == [[1, attr['as_path']]]
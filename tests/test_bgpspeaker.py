@@ -0,0 +1,25 @@
+import os
+import sys
+import socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bgpspeaker import BGPSession  # noqa: E402
+from fanout import FanOut  # noqa: E402
+
+
+def test_updates_to_a_dead_peer_are_lost():
+    session = BGPSession('127.0.0.1', 179, 65001, '127.0.0.1', 65000)
+    session.sock, peer = socket.socketpair()
+    session.established.set()
+    peer.close()
+    fanout = FanOut(16)
+    channel = fanout.add('dead', session.send_many)
+    for _ in range(5):
+        channel.put(b'update')
+    fanout.close()
+    assert channel.error is not None
+    assert channel.sent == 0
+    assert channel.lost + channel.dropped == 5
+    assert not session.established.is_set()
+    session.stop()
@@ -0,0 +1,108 @@
+import os
+import bz2
+import sys
+import zlib
+import gzip
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from blockreader import BlockReader, open_decompressed  # noqa: E402
+from pybgpdump import FastBGPDump, BGPDump  # noqa: E402
+from bgpbench import write_synthetic_mrt  # noqa: E402
+
+
+def _payload(size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = b'%08d %x\n' % (i, i * 2654435761 % (1 << 32))
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b''.join(lines)
+
+
+def _read_all(filename, compression, block_size=1 << 16):
+    reader = BlockReader(open_decompressed(filename, compression, parallel=False), block_size)
+    data = b''.join(reader)
+    error = reader.error
+    reader.close()
+    return data, error
+
+
+def test_complete_streams(tmp_path):
+    data = _payload(1 << 20)
+    for compression, compress in (('gz', gzip.compress), ('bz2', bz2.compress)):
+        filename = str(tmp_path / ('data.' + compression))
+        with open(filename, 'wb') as f:
+            # two concatenated streams
+            f.write(compress(data[:1000]) + compress(data[1000:]))
+        assert _read_all(filename, compression) == (data, None)
+
+
+def test_truncated_gz_keeps_decoded_data(tmp_path):
+    data = _payload(4 << 20)
+    compressed = gzip.compress(data)
+    cut = compressed[:len(compressed) // 2]
+    filename = str(tmp_path / 'cut.gz')
+    with open(filename, 'wb') as f:
+        f.write(cut)
+    expected = zlib.decompressobj(wbits=31).decompress(cut)
+    read, error = _read_all(filename, 'gz')
+    assert read == expected
+    assert len(read) > len(data) // 4
+    assert error is not None
+
+
+def test_truncated_bz2_keeps_decoded_data(tmp_path):
+    data = _payload(4 << 20)
+    compressed = bz2.compress(data, 1)
+    cut = compressed[:len(compressed) // 2]
+    filename = str(tmp_path / 'cut.bz2')
+    with open(filename, 'wb') as f:
+        f.write(cut)
+    expected = bz2.BZ2Decompressor().decompress(cut)
+    read, error = _read_all(filename, 'bz2')
+    assert read == expected
+    assert len(read) > 0
+    assert error is not None
+
+
+def test_truncated_mrt_gz_returns_every_complete_record(tmp_path):
+    mrt = str(tmp_path / 'updates.mrt')
+    write_synthetic_mrt(mrt, 20000, seed=3)
+    with open(mrt, 'rb') as f:
+        compressed = gzip.compress(f.read())
+    cut = compressed[:len(compressed) // 2]
+    truncated = str(tmp_path / 'updates.mrt.gz')
+    with open(truncated, 'wb') as f:
+        f.write(cut)
+    # the records before the cut, as an uncompressed file
+    recovered = str(tmp_path / 'recovered.mrt')
+    with open(recovered, 'wb') as f:
+        f.write(zlib.decompressobj(wbits=31).decompress(cut))
+    expected = sum(1 for _ in FastBGPDump(recovered).records())
+    assert expected > 0
+
+    dump = FastBGPDump(truncated, block_size=1 << 14)
+    assert sum(1 for _ in dump.records()) == expected
+    assert dump.truncated == 1
+    assert dump.error is not None
+    assert sum(1 for _ in BGPDump(truncated)) == sum(1 for _ in FastBGPDump(recovered))
+
+
+def test_records_spanning_blocks(tmp_path):
+    mrt = str(tmp_path / 'updates.mrt')
+    write_synthetic_mrt(mrt, 5000, seed=4)
+    with open(mrt, 'rb') as f:
+        data = f.read()
+    compressed = str(tmp_path / 'updates.mrt.gz')
+    with open(compressed, 'wb') as f:
+        f.write(gzip.compress(data))
+    expected = [rec.as_tuple() for rec in FastBGPDump(mrt).records()]
+    # blocks smaller than a record, and blocks holding a few of them
+    for block_size in (7, 100, 4096):
+        dump = FastBGPDump(compressed, block_size=block_size)
+        assert [rec.as_tuple() for rec in dump.records()] == expected
+        assert dump.errors() == {'corrupt': 0, 'truncated': 0, 'error': None}
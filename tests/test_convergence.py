@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bgpprefix import Prefix  # noqa: E402
+import convergence  # noqa: E402
+import mrtcache  # noqa: E402
+from convergence import EventLog, read_events, ANNOUNCE  # noqa: E402
+from mrtcache import compile_cache  # noqa: E402
+
+
+def test_read_events(tmp_path):
+    log = EventLog(str(tmp_path / 'sent.log'))
+    prefix = Prefix.from_string('10.0.0.0/24')
+    log.add(1.5, ANNOUNCE, [prefix])
+    log.close()
+    assert list(read_events(str(tmp_path / 'sent.log'))) == [(1.5, ANNOUNCE, prefix)]
+
+
+def test_other_files_are_not_read_as_logs(tmp_path):
+    assert convergence.MAGIC != mrtcache.MAGIC
+    cachefile = str(tmp_path / 'updates.bgpc')
+    compile_cache(iter([(1, {'med': 1}, ['10.0.0.0/24'], [])]), cachefile)
+    with pytest.raises(ValueError) as error:
+        list(read_events(cachefile))
+    assert 'not a convergence log' in str(error.value)
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mrtcache import cached_dump, compile_cache, CachedBGPDump  # noqa: E402
+from pybgpdump import FastBGPDump  # noqa: E402
+from bgpbench import write_synthetic_mrt  # noqa: E402
+
+
+def _rewrite_nexthop(attr):
+    attr['nexthop'] = '10.0.0.1'
+
+
+def test_cached_attributes_keep_their_wire_encoding(tmp_path):
+    mrt = str(tmp_path / 'updates.mrt')
+    write_synthetic_mrt(mrt, 2000, seed=5, ipv6=0.3)
+    expected = []
+    for timestamp, attr, nlri, withdraw in FastBGPDump(mrt):
+        if nlri:
+            _rewrite_nexthop(attr)
+        expected.append((timestamp, attr, nlri, withdraw))
+
+    cachefile = str(tmp_path / 'updates.bgpc')
+    assert compile_cache(FastBGPDump(mrt), cachefile, _rewrite_nexthop) == len(expected)
+    cached = list(CachedBGPDump(cachefile))
+    assert cached == expected
+    for (_, attr, nlri, _), (_, want, _, _) in zip(cached, expected):
+        if nlri:
+            assert attr.raw == want.raw
+            assert attr.as4 == want.as4
+            assert attr['nexthop'] == '10.0.0.1'
+
+
+def test_plain_attributes_and_rebuild(tmp_path):
+    updates = [(1, {'nexthop': '10.0.0.2', 'as_path': [1, 2]}, ['10.0.0.0/24'], []),
+               (2, {}, [], ['10.0.0.0/24'])]
+    mrt = str(tmp_path / 'updates.mrt')
+    open(mrt, 'wb').close()
+    cache_dir = str(tmp_path / 'cache')
+    dump = cached_dump([mrt], cache_dir, lambda: iter(updates))
+    assert [(ts, attr, [str(p) for p in nlri], [str(p) for p in withdraw])
+            for ts, attr, nlri, withdraw in dump] == updates
+
+    # a cache of another version is compiled again
+    cachefile = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    with open(cachefile, 'r+b') as f:
+        f.seek(4)
+        f.write(b'\x01')
+    dump = cached_dump([mrt], cache_dir, lambda: iter(updates))
+    assert len(list(dump)) == 2
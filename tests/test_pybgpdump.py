@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pybgpdump import BGPDump, FastBGPDump, decode_attributes  # noqa: E402
+from bgpspeaker import encode_attributes  # noqa: E402
+from bgpbench import write_synthetic_mrt  # noqa: E402
+
+
+def _plain(update):
+    timestamp, attr, nlri, withdraw = update
+    return timestamp, dict(attr), [str(p) for p in nlri], [str(p) for p in withdraw]
+
+
+def test_dpkt_reader_gives_the_updates_of_the_fast_reader(tmp_path):
+    mrt = str(tmp_path / 'updates.mrt')
+    write_synthetic_mrt(mrt, 2000, seed=2)
+    updates = [_plain(update) for update in BGPDump(mrt)]
+    assert updates == [_plain(update) for update in FastBGPDump(mrt)]
+    for _, attr, nlri, _ in updates:
+        if nlri:
+            assert all(type(asn) is int for asn in attr['as_path'])
+            # the native agent encodes them again
+            assert decode_attributes(encode_attributes(attr, as4=True), as4=True) == attr
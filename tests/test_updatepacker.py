@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import struct
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bgpprefix import Prefix  # noqa: E402
+from bgpspeaker import UpdateEncoder, encode_attributes  # noqa: E402
+from pybgpdump import PathAttributes  # noqa: E402
+from updatepacker import UpdatePacker  # noqa: E402
+
+
+class _Agent(object):
+    def __init__(self):
+        self.updates = []
+
+    def start(self, *args):
+        pass
+
+    def stop(self):
+        pass
+
+    def send_update(self, update):
+        self.updates.append(update)
+
+
+def _prefixes(count):
+    return [Prefix.from_int((10 << 24) + (i << 8), 24) for i in range(count)]
+
+
+def test_packed_updates_fit_a_message_with_the_raw_attributes():
+    attr = {'origin': 0, 'as_path': [65000, 65001], 'nexthop': '10.0.0.1', 'med': 5}
+    # an optional transitive attribute the decoder does not know, kept in the raw encoding only
+    unknown = struct.pack('>BBH', 0xd0, 99, 1500) + b'\x00' * 1500
+    raw = PathAttributes(encode_attributes(attr) + unknown, True)
+    raw['nexthop'] = '10.0.0.2'
+    agent = _Agent()
+    packer = UpdatePacker(agent, window=60, size=2000)
+    packer.send_update({'attr': raw, 'nlri': _prefixes(2000), 'withdraw': []})
+    packer.flush()
+    encoder = UpdateEncoder(as4=True)
+    assert agent.updates
+    for update in agent.updates:
+        assert len(list(encoder.messages(update['attr'], update['nlri'], update['withdraw']))) == 1
+
+
+def test_timer_is_not_held_up_by_a_slow_send():
+    release = threading.Event()
+
+    class SlowAgent(_Agent):
+        async def send_update_async(self, update):
+            while not release.is_set():
+                await asyncio.sleep(0.01)
+            self.updates.append(update)
+
+    agent = SlowAgent()
+    packer = UpdatePacker(agent, window=0.05, size=1)
+    packer.start()
+
+    async def send():
+        await packer.send_update_async({'attr': {'med': 1}, 'nlri': _prefixes(1), 'withdraw': []})
+
+    free = []
+
+    def add_while_sending():
+        time.sleep(0.1)
+        # the pending updates can be added to while the agent is busy
+        if packer.lock.acquire(timeout=0.05):
+            packer.lock.release()
+            free.append(True)
+        release.set()
+    thread = threading.Thread(target=add_while_sending)
+    thread.start()
+    asyncio.run(send())
+    thread.join()
+    assert free
+    packer.send_update({'attr': {'med': 2}, 'nlri': _prefixes(2)[1:], 'withdraw': []})
+    start = time.time()
+    packer.stop()
+    assert time.time() - start < 1
+    assert [update['attr']['med'] for update in agent.updates] == [1, 2]
+
+
+def test_log_sees_the_packed_updates():
+    class Log(object):
+        def __init__(self):
+            self.updates = []
+
+        def log(self, update):
+            self.updates.append(update)
+
+    agent = _Agent()
+    packer = UpdatePacker(agent, window=60, size=100)
+    packer.log = Log()
+    prefixes = _prefixes(3)
+    packer.send_update({'attr': {'med': 1}, 'nlri': prefixes, 'withdraw': []})
+    # replaces the announcement of the first prefix, which is never sent
+    packer.send_update({'attr': {}, 'nlri': [], 'withdraw': prefixes[:1]})
+    packer.flush()
+    assert packer.log.updates == agent.updates
+    assert [update['withdraw'] for update in agent.updates] == [prefixes[:1], []]
+    assert [update['nlri'] for update in agent.updates] == [[], prefixes[1:]]
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bgpplayer import BgpUpdateGenerator, DEFAULTS  # noqa: E402
+from metrics import Registry  # noqa: E402
+from workers import Coordinator  # noqa: E402
+
+
+class _Sender(object):
+    """Stands for the generator sending the updates of the workers, keeping them."""
+    def __init__(self, config, source, limit=None):
+        self.limit = limit or config['count']
+        self.source = source
+        self.metrics = Registry()
+        self.sent = []
+
+    def run(self):
+        for _, update in self.source():
+            self.sent.append(repr(update))
+            if len(self.sent) >= self.limit:
+                break
+        return True
+
+
+def _uneven_source(config):
+    # pauses long enough for the rings to hand over partial slots, at times differing per run
+    pause = random.SystemRandom()
+    for n, item in enumerate(BgpUpdateGenerator(config)._random_updates()):
+        if n % 500 == 0:
+            time.sleep(pause.random() * 0.1)
+        yield item
+
+
+def _run(count=6000, workers=3):
+    config = dict(DEFAULTS, agent='console', count=count, seed=5, workers=workers)
+    senders = []
+
+    def make_generator(config, source):
+        senders.append(_Sender(config, source))
+        return senders[-1]
+    assert Coordinator(config, make_generator, _uneven_source, workers).run() == 0
+    return senders[0].sent
+
+
+def test_same_seed_sends_the_same_sequence():
+    first = _run()
+    assert len(first) == 6000
+    assert _run() == first
+
+
+def test_workers_stopped_once_sending_stops_did_not_fail():
+    # without a count, workers generate until they are terminated
+    config = dict(DEFAULTS, agent='console', count=0, seed=5, workers=2)
+    coordinator = Coordinator(config, lambda config, source: _Sender(config, source, 1000),
+                              lambda config: BgpUpdateGenerator(config)._random_updates(), 2)
+    assert coordinator.run() == 0
+    summary = coordinator.summary(1.0)
+    assert 'stopped' in summary and 'exit code' not in summary
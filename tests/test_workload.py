@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from workload import Workload, parse_scenario  # noqa: E402
+
+
+def test_parse_scenario():
+    assert parse_scenario('load:rate=5000,churn:duration=3:withdraw=0.5,storm:count=20:prefixes=5') == [
+        ('load', {'rate': 5000.0}),
+        ('churn', {'duration': 3.0, 'withdraw': 0.5}),
+        ('storm', {'count': 20.0, 'prefixes': 5.0})]
+
+
+def test_parse_scenario_rejects_parameters_of_other_phases():
+    with pytest.raises(ValueError) as error:
+        parse_scenario('load,churn:count=10:prefixes=5')
+    assert 'prefixes' in str(error.value) and 'churn' in str(error.value)
+    with pytest.raises(ValueError) as error:
+        parse_scenario('storm:count')
+    assert 'storm' in str(error.value)
+
+
+@pytest.mark.parametrize('scenario', ['churn:rate=0', 'load:rate=-5', 'storm:prefixes=0', 'churn:count=0',
+                                      'storm:duration=-1', 'churn:withdraw=1.5'])
+def test_parse_scenario_rejects_values_out_of_range(scenario):
+    name, param = scenario.split(':')
+    with pytest.raises(ValueError) as error:
+        parse_scenario(scenario)
+    assert name in str(error.value) and param.split('=')[0] in str(error.value)
+
+
+def test_run_reports_phases():
+    phases = []
+    workload = Workload(65000, ['10.0.0.1'], table_size=100, seed=1)
+    updates = list(workload.run(parse_scenario('load,churn:count=10:rate=10,storm:count=5:prefixes=3'),
+                                lambda index, name, rate: phases.append((index, name, rate))))
+    assert phases == [(0, 'load', 1000.0), (1, 'churn', 10.0), (2, 'storm', 1000.0)]
+    assert len(updates) > 15
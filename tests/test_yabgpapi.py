@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from yabgpapi import YaBGPClient  # noqa: E402
+
+
+class _Response(object):
+    ok = True
+
+    def json(self):
+        return {'status': True}
+
+
+def test_requests_for_a_prefix_keep_their_order():
+    client = YaBGPClient('http://127.0.0.1:1/v1/peer/127.0.0.1/send/update', json.dumps, max_inflight=8)
+    rand = random.Random(1)
+    applied = []
+    lock = threading.Lock()
+
+    def post(url, data):
+        # answer out of order, as YaBGP may
+        time.sleep(rand.random() * 0.005)
+        with lock:
+            applied.append(json.loads(data))
+        return _Response()
+    client.session.post = post
+
+    prefixes = ['10.0.%d.0/24' % i for i in range(4)]
+    updates = []
+    for i in range(200):
+        prefix = prefixes[i % len(prefixes)]
+        if i % 8 < 4:
+            updates.append({'attr': {'med': i}, 'nlri': [prefix], 'withdraw': []})
+        else:
+            updates.append({'attr': {}, 'nlri': [], 'withdraw': [prefix]})
+    for update in updates:
+        client.send([update])
+    client.close()
+
+    def sequence(requests, prefix):
+        return [('announce', r['attr']['med']) if prefix in r['nlri'] else ('withdraw',)
+                for r in requests if prefix in r['nlri'] or prefix in r['withdraw']]
+    for prefix in prefixes:
+        assert sequence(applied, prefix) == sequence(updates, prefix)
+    assert client.held > 0
+    assert client.requests == len(updates)